@@ -131,6 +131,7 @@ python -m unittest discover -f
 %{python_sitelib}/*
 %{_bindir}/fedora-review
 %{_bindir}/fedora-create-review
+%{_bindir}/fedora-review-client
 %{_bindir}/koji-download-scratch
 %{_mandir}/man1/%{name}.1.*
 %{_mandir}/man1/fedora-create-review.1.*
@@ -3,13 +3,19 @@
 
 import re
 
-from FedoraReview import CheckBase, Mock, RpmFile, RegistryBase
+from FedoraReview import CheckBase, Mock, RegistryBase
+
+_SOFILES_RE = re.compile(r'/usr/(lib|lib64)/[\w\-]*\.so\.[0-9]', re.IGNORECASE)
+_C_SOURCES = ['*.c', '*.C', '*.cpp']
 
 
 class Registry(RegistryBase):
     """ Register all checks in this file. """
 
     group = 'C/C++'
+    file_patterns = {'rpms': [_SOFILES_RE, '*.h', '*.a'],
+                     'buildsrc': _C_SOURCES,
+                     'sources': _C_SOURCES}
 
     def is_applicable(self):
         """Need more comprehensive check and return True in valid cases"""
@@ -23,9 +29,9 @@ class Registry(RegistryBase):
         else:
             src = self.checks.sources
         rpms = self.checks.rpms
-        if rpms.find_re(r'/usr/(lib|lib64)/[\w\-]*\.so\.[0-9]') or \
-            rpms.find('*.h') or rpms.find('*.a') or \
-                src.find('*.c') or src.find('*.C') or src.find('*.cpp'):
+        if rpms.get_matches(_SOFILES_RE) or \
+            rpms.get_matches('*.h') or rpms.get_matches('*.a') or \
+                [p for p in _C_SOURCES if src.get_matches(p)]:
                     return True
         return False
 
@@ -50,20 +56,19 @@ class CheckLDConfig(CCppCheckBase):
         self.text = 'ldconfig called in %post and %postun if required.'
         self.automatic = True
         self.type = 'MUST'
-        self.sofiles_regex = r'/usr/(lib|lib64)/[\w\-]*\.so\.[0-9]'
+        self.sofiles_regex = _SOFILES_RE
 
     def is_applicable(self):
         ''' check if this test is applicable '''
-        return bool(self.rpms.find_re(self.sofiles_regex))
+        return bool(self.rpms.get_matches(self.sofiles_regex))
 
     def run_on_applicable(self):
         ''' Run the test, called if is_applicable() is True. '''
         bad_pkgs = []
         for pkg in self.spec.packages:
-            nvr = self.spec.get_package_nvr(pkg)
-            rpm = RpmFile(pkg, nvr.version, nvr.release)
-            if not self.rpms.find_re(self.sofiles_regex, pkg):
+            if not self.rpms.get_matches(self.sofiles_regex, pkg):
                 continue
+            rpm = self.rpms.get(pkg)
             if not rpm.post or '/sbin/ldconfig' not in rpm.post or \
                 not rpm.postun or '/sbin/ldconfig' not in rpm.postun:
                     bad_pkgs.append(pkg)
@@ -79,6 +84,9 @@ class CheckHeaderFiles(CCppCheckBase):
     '''
     MUST: Header files must be in a -devel package
     '''
+
+    file_patterns = {'rpms': ['*.h']}
+
     def __init__(self, base):
         CCppCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/wiki/Packaging/Guidelines' \
@@ -89,14 +97,14 @@ class CheckHeaderFiles(CCppCheckBase):
 
     def is_applicable(self):
         ''' check if this test is applicable '''
-        return self.rpms.find('*.h')
+        return self.rpms.get_matches('*.h')
 
     def run_on_applicable(self):
         ''' Run the test, called if is_applicable() is True. '''
         passed = True
         extra = ""
         for pkg in self.spec.packages:
-            for path in self.rpms.find_all('*.h', pkg):
+            for path in self.rpms.get_matches('*.h', pkg):
                 # header files (.h) under /usr/src/debug/* will be in
                 #  the -debuginfo package.
                 if path.startswith('/usr/src/debug/') and '-debuginfo' in pkg:
@@ -126,6 +134,9 @@ class CheckSoFiles(CCppCheckBase):
     libfoo.so.1.1), then library files that end in .so (without suffix)
     must go in a -devel package.
     '''
+
+    file_patterns = {'rpms': ['*.so']}
+
     def __init__(self, base):
         CCppCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/wiki/Packaging/Guidelines' \
@@ -139,7 +150,7 @@ class CheckSoFiles(CCppCheckBase):
 
     def run(self):
         ''' Run the test, always called '''
-        if not self.rpms.find('*.so'):
+        if not self.rpms.get_matches('*.so'):
             self.set_passed(self.NA)
             return
         passed = 'pass'
@@ -151,7 +162,7 @@ class CheckSoFiles(CCppCheckBase):
         for pkg in self.spec.packages:
             if pkg.endswith('-devel'):
                 continue
-            for path in self.rpms.find_all('*.so', pkg):
+            for path in self.rpms.get_matches('*.so', pkg):
                 bad_list.append("%s: %s" % (pkg, path))
                 if self.bad_re.search(path):
                     in_libdir = True
@@ -180,6 +191,9 @@ class CheckLibToolArchives(CCppCheckBase):
     MUST: Packages must NOT contain any .la libtool archives,
     these must be removed in the spec if they are built.
     '''
+
+    file_patterns = {'rpms': ['*.la']}
+
     def __init__(self, base):
         CCppCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/wiki/Packaging/Guidelines' \
@@ -190,12 +204,12 @@ class CheckLibToolArchives(CCppCheckBase):
 
     def run_on_applicable(self):
         ''' Run the test, called if is_applicable() is True. '''
-        if not self.rpms.find('*.la'):
+        if not self.rpms.get_matches('*.la'):
             self.set_passed(self.PASS)
         else:
             extra = ""
             for pkg in self.spec.packages:
-                for path in self.rpms.find_all('*.la', pkg):
+                for path in self.rpms.get_matches('*.la', pkg):
                     extra += "%s : %s\n" % (pkg, path)
             self.set_passed(self.FAIL, extra)
 
@@ -25,8 +25,7 @@ import re
 import rpm
 
 from glob import glob
-from StringIO import StringIO
-from subprocess import Popen, PIPE, CalledProcessError
+from subprocess import CalledProcessError
 try:
     from subprocess import check_output          # pylint: disable=E0611
 except ImportError:
@@ -39,6 +38,11 @@ from FedoraReview import RegistryBase, Settings
 
 import FedoraReview.deps as deps
 
+from FedoraReview.license_detect import LicenseDetector
+from FedoraReview.license_scan import LicenseScanner
+from FedoraReview.tree_diff import compare_archives, compare_trees
+from FedoraReview.tree_diff import write_diffs
+
 _DIR_SORT_KEY = '30'
 _LICENSE_SORT_KEY = '20'
 _GL_SORT_KEY = '90'
@@ -107,6 +111,14 @@ class CheckBundledLibs(GenericCheckBase):
     '''
     MUST: Packages must NOT bundle copies of system libraries.
     '''
+
+    needs_data = ['sources']
+
+    regex = re.compile('(.*?/)(3rdparty|thirdparty|libraries|libs|ext'
+                       '|external|include|3rd_party|third_party)/.*',
+                       re.IGNORECASE)
+    file_patterns = {'sources': [regex]}
+
     def __init__(self, base):
         GenericCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/wiki/' \
@@ -117,14 +129,10 @@ class CheckBundledLibs(GenericCheckBase):
         self.type = 'MUST'
 
     def run(self):
-        pattern = '(.*?/)(3rdparty|thirdparty|libraries|libs|ext|external' \
-            '|include|3rd_party|third_party)/.*'
-        regex = re.compile(pattern, re.IGNORECASE)
         check_dirs = set()
-        for i in self.sources.get_filelist():
-            m = regex.match(i)
-            if m:
-                check_dirs.add(m.group(1) + m.group(2))
+        for i in self.sources.get_matches(self.regex):
+            m = self.regex.match(i)
+            check_dirs.add(m.group(1) + m.group(2))
         if check_dirs:
             self.set_passed(
                 self.PENDING,
@@ -338,6 +346,7 @@ class CheckDefattr(GenericCheckBase):
     %files section must include a %defattr(...) line.
     Update: 29-04-2011 This is only for pre rpm 4.4 that this is needed
     '''
+
     def __init__(self, base):
         GenericCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/wiki/' \
@@ -364,6 +373,8 @@ class CheckDefattr(GenericCheckBase):
 class CheckDescMacros(GenericCheckBase):
     ''' Macros in description etc. should be expandable. '''
 
+    needs_data = ['spec']
+
     def __init__(self, base):
         GenericCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/wiki/' \
@@ -449,6 +460,8 @@ class CheckDevelFilesInDevel(GenericCheckBase):
 class CheckDistTag(GenericCheckBase):
     ''' Disttag %{?dist} is present in Release: '''
 
+    needs_data = ['spec']
+
     def __init__(self, base):
         GenericCheckBase.__init__(self, base)
         self.url = 'https://fedoraproject.org/wiki/Packaging:DistTag'
@@ -657,8 +670,7 @@ class CheckLicenseField(GenericCheckBase):
                     relpath = re.sub('.*BUILD/', '', path)
                     f.write(relpath + '\n')
 
-    @staticmethod
-    def _get_source_dir():
+    def _get_source_dir(self):
         ''' Decide which directory to run licensecheck on. This can be
         either patched sources, or we use vanilla unpacked upstream
         tarballs if first option fails '''
@@ -671,10 +683,14 @@ class CheckLicenseField(GenericCheckBase):
             msg = 'There is no build directory. Running licensecheck ' \
                   'on vanilla upstream sources.'
             source_dir = ReviewDirs.upstream_unpacked
+            self.checks.sources.extract()
         return (source_dir, msg)
 
-    def _parse_licenses(self, raw_text):
-        ''' Convert licensecheck output to files_by_license dict. '''
+    def _parse_licenses(self, lines):
+        '''
+        Convert licensecheck output (an iterable of lines) to
+        files_by_license dict.
+        '''
 
         def license_is_valid(_license):
             ''' Test that license from licencecheck is parsed OK. '''
@@ -682,11 +698,7 @@ class CheckLicenseField(GenericCheckBase):
                 'GENERATED' not in _license
 
         files_by_license = {}
-        raw_file = StringIO(raw_text)
-        while True:
-            line = raw_file.readline()
-            if not line:
-                break
+        for line in lines:
             try:
                 file_, license_ = line.split(':')
             except ValueError:
@@ -705,15 +717,20 @@ class CheckLicenseField(GenericCheckBase):
             source_dir, msg = self._get_source_dir()
             self.log.debug("Scanning sources in " + source_dir)
             if os.path.exists(source_dir):
-                cmd = 'licensecheck -r ' + source_dir
+                if Settings.license_scanner == 'builtin':
+                    scanner = LicenseDetector(source_dir)
+                else:
+                    scanner = LicenseScanner(source_dir)
                 try:
-                    out = check_output(cmd, shell=True)
+                    files_by_license = self._parse_licenses(scanner.scan())
                 except (OSError, CalledProcessError) as err:
                     self.set_passed(self.PENDING,
                                     "Cannot run licensecheck: " + str(err))
                     return
-                self.log.debug("Got license reply, length: %d" % len(out))
-                files_by_license = self._parse_licenses(out)
+                except IOError as err:
+                    self.set_passed(self.PENDING,
+                                    "Cannot read sources: " + str(err))
+                    return
                 filename = os.path.join(ReviewDirs.root,
                                         'licensecheck.txt')
                 self._write_license(files_by_license, filename)
@@ -741,6 +758,10 @@ class CheckLicensInDoc(GenericCheckBase):
     ''' Package includes license text files. '''
 
     sort_key = _LICENSE_SORT_KEY
+    patterns = ['*' + p + '*' for p in ['COPYING', 'copying',
+                                        'LICEN', 'licen',
+                                        'COPYRIGHT', 'copyright']]
+    file_patterns = {'rpms': patterns}
 
     def __init__(self, base):
         GenericCheckBase.__init__(self, base)
@@ -768,11 +789,8 @@ class CheckLicensInDoc(GenericCheckBase):
         # pylint: disable=invalid-name
 
         licenses = []
-        for potentialfile in ['COPYING', 'copying',
-                              'LICEN', 'licen',
-                              'COPYRIGHT', 'copyright']:
-            pattern = '*' + potentialfile + '*'
-            licenses.extend(self.rpms.find_all(pattern))
+        for pattern in self.patterns:
+            licenses.extend(self.rpms.get_matches(pattern))
         licenses = filter(lambda l: not self.rpms.find(l + '/*'),
                           licenses)
         licenses = map(lambda f: f.split('/')[-1], licenses)
@@ -783,21 +801,14 @@ class CheckLicensInDoc(GenericCheckBase):
         flagged_files = []
         qpL_files = []
         for pkg in self.spec.packages:
-            nvr = self.spec.get_package_nvr(pkg)
-            rpm_path = Mock.get_package_rpm_path(nvr)
-            cmd = 'rpm -qp%s %s' % (self._license_flag, rpm_path)
-            doclist = check_output(cmd.split())
-            flagged_files.extend(doclist.split('\n'))
+            rpm_pkg = self.rpms.get(pkg)
+            if self._license_flag == 'L':
+                flagged_files.extend(rpm_pkg.license_files)
+                qpL_files.extend(rpm_pkg.license_files)
+            else:
+                flagged_files.extend(rpm_pkg.doc_files)
         flagged_files = map(lambda f: f.split('/')[-1], flagged_files)
-
-        if self._license_flag == 'L':
-            for pkg in self.spec.packages:
-                nvr = self.spec.get_package_nvr(pkg)
-                rpm_path = Mock.get_package_rpm_path(nvr)
-                cmd = 'rpm -qpL %s' % rpm_path
-                qpL_list = check_output(cmd.split())
-                qpL_files.extend(qpL_list.split('\n'))
-            qpL_files = map(lambda f: f.split('/')[-1], qpL_files)
+        qpL_files = map(lambda f: f.split('/')[-1], qpL_files)
 
         for _license in licenses:
             if self._license_flag == 'L' and _license not in qpL_files:
@@ -855,6 +866,8 @@ class CheckLocale(GenericCheckBase):
 class CheckMacros(GenericCheckBase):
     ''' Each package must consistently use macros.  '''
 
+    needs_data = ['spec']
+
     def __init__(self, base):
         GenericCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/' \
@@ -868,6 +881,8 @@ class CheckMacros(GenericCheckBase):
 class CheckBuildrootMacros(GenericCheckBase):
     '''Package must use either %{buildroot} or $RPM_BUILD_ROOT.  '''
 
+    needs_data = ['spec']
+
     def __init__(self, base):
         GenericCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/' \
@@ -889,6 +904,8 @@ class CheckBuildrootMacros(GenericCheckBase):
 class CheckMakeinstall(GenericCheckBase):
     ''' Thou shall not use %makeinstall. '''
 
+    needs_data = ['spec']
+
     def __init__(self, base):
         GenericCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/wiki/Packaging/Guidelines' \
@@ -931,6 +948,9 @@ class CheckNameCharset(GenericCheckBase):
     MUST:all Fedora packages must be named using only the following
          ASCII characters...
     '''
+
+    needs_data = ['spec']
+
     def __init__(self, base):
         GenericCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/wiki/Packaging/NamingGuidelines'
@@ -1096,36 +1116,28 @@ class CheckOwnDirs(GenericCheckBase):
                 pkgs.extend(deps.list_deps(pkgs))
             return list(set(pkgs))
 
-        def get_deps_paths(pkg_deps):
-            ''' Return aggregated  list of files in all pkg_deps. '''
-            if not pkg_deps:
-                return []
-            paths = deps.list_paths(pkg_deps)
+        def get_owned(candidates, pkg_deps):
+            ''' Return the candidates owned by any of pkg_deps. '''
+            owned = deps.list_owned(candidates, pkg_deps)
             for dep in pkg_deps:
                 if dep in self.spec.packages:
-                    paths.extend(self.rpms.get_filelist(dep))
-            return paths
+                    owned |= candidates.intersection(
+                        self.rpms.get_filelist(dep))
+            return owned
 
-        bad_dirs = []
+        bad_dirs = set()
         for pkg in self.spec.packages:
+            index = deps.DirOwnership(self.rpms.get_filelist(pkg))
+            candidates = index.candidates()
+            if not candidates:
+                continue
             pkg_deps = resolve(self.rpms.get(pkg).requires)
             pkg_deps.append('filesystem')
-            pkg_deps_paths = get_deps_paths(pkg_deps)
-            rpm_paths = self.rpms.get_filelist(pkg)
-            for p in rpm_paths:
-                path = p.rsplit('/', 1)[0]  # We own leaf, for sure.
-                while path:
-                    if path not in rpm_paths:
-                        if path in pkg_deps_paths:
-                            break
-                        else:
-                            bad_dirs.append(path)
-                    path = path.rsplit('/', 1)[0]
+            bad_dirs |= index.unowned(get_owned(candidates, pkg_deps))
         if bad_dirs:
-            bad_dirs = list(set(bad_dirs))
             self.set_passed(self.PENDING,
                             "Directories without known owners: "
-                            + ', '.join(bad_dirs))
+                            + ', '.join(sorted(bad_dirs)))
         else:
             self.set_passed(self.PASS)
 
@@ -1175,14 +1187,19 @@ class CheckOwnOther(GenericCheckBase):
         bad_owners_by_dir = {}
         rpm_files = glob(os.path.join(Mock.resultdir, '*.rpm'))
         rpm_files = [r for r in rpm_files if not skip_rpm(r)]
+        dirs_by_rpm = {}
         for rpm_file in rpm_files:
-            rpm_dirs = sorted(deps.list_dirs(rpm_file))
+            dirs_by_rpm[rpm_file] = sorted(deps.list_dirs(rpm_file))
+        all_dirs = set([d for v in dirs_by_rpm.itervalues() for d in v])
+        owners_by_dir = deps.list_owners_bulk(list(all_dirs))
+        for rpm_file in rpm_files:
+            rpm_dirs = dirs_by_rpm[rpm_file]
             my_dirs = []
             allowed = set(self.spec.packages)
             for rpm_dir in rpm_dirs:
                 if [d for d in my_dirs if rpm_dir.startswith(d)]:
                     continue
-                owners = set(deps.list_owners(rpm_dir))
+                owners = set(owners_by_dir[rpm_dir])
                 if owners.issubset(allowed):
                     my_dirs.append(rpm_dir)
                     continue
@@ -1200,6 +1217,9 @@ class CheckRelocatable(GenericCheckBase):
     along with the rationalization for relocation of that specific package.
     Without this, use of Prefix: /usr is considered a blocker.
     '''
+
+    needs_data = ['spec']
+
     def __init__(self, base):
         GenericCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/wiki/' \
@@ -1263,6 +1283,9 @@ class CheckSourceMD5(GenericCheckBase):
     this package, please see the Source URL Guidelines for how to deal
     with this.
     '''
+
+    needs_data = ['srpm', 'sources']
+
     def __init__(self, base):
         GenericCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/wiki/Packaging/SourceURL'
@@ -1272,29 +1295,52 @@ class CheckSourceMD5(GenericCheckBase):
 
     def make_diff(self, sources):
         """
-        For all sources, run a diff -r between upstream and what's in the
-        srpm. Return (passed, text) where passed is True/False
-        and text is either the possibly large diff output or None
+        For all sources, compare upstream and what's in the srpm. Archives
+        are compared member by member without extracting them if possible,
+        and only extracted to diff changed files. Else the extracted trees
+        are compared. Differences are written to
+        diff.txt. Return (passed, path) where passed is True/False and
+        path is the diff.txt path or None if there was an error.
         """
+        deltas = []
         for s in sources:
-            s.extract()
-            upstream = s.extract_dir
-            local = self.srpm.extract(s.filename)
-            if not local:
-                self.log.warn(
-                    "Cannot extract local source: " + s.filename)
-                return(False, None)
-            cmd = '/usr/bin/diff -U2 -r %s %s' % (upstream, local)
-            self.log.debug(' Diff cmd: ' + cmd)
-            try:
-                p = Popen(cmd.split(), stdout=PIPE, stderr=PIPE)
-                output = p.communicate()[0]
-            except OSError:
-                self.log.error("Cannot run diff", exc_info=True)
-                return (False, None)
-            if output and len(output) > 0:
-                return (False, output)
-        return (True, None)
+            if s.local:
+                continue
+            local = os.path.join(ReviewDirs.srpm_unpacked,
+                                 os.path.basename(s.filename))
+            delta = compare_archives(s.filename, local)
+            if delta is not None and not delta:
+                continue
+            if delta is None or delta.changed:
+                # Extracted trees are needed to compare and/or diff.
+                s.extract()
+                local = self.srpm.extract(s.filename)
+                if not local:
+                    self.log.warn(
+                        "Cannot extract local source: " + s.filename)
+                    return (False, None)
+            if delta is None:
+                try:
+                    delta = compare_trees(s.extract_dir, local)
+                except (IOError, OSError):
+                    self.log.error("Cannot compare sources", exc_info=True)
+                    return (False, None)
+            if delta:
+                deltas.append((s, delta, local))
+        if not deltas:
+            return (True, None)
+        path = os.path.join(ReviewDirs.root, 'diff.txt')
+        with open(path, 'w') as f:
+            for s, delta, local in deltas:
+                f.write('%s: %s\n' % (s.tag, s.url))
+                for line in delta.summary('upstream', 'this package'):
+                    f.write(line + '\n')
+                f.write('\n')
+            write_diffs([(delta, s.extract_dir, local)
+                         for s, delta, local in deltas],
+                        f,
+                        Settings.diff_size * 1024)
+        return (False, path)
 
     def check_checksums(self, sources):
         ''' For all sources, compare checksum with upstream. '''
@@ -1341,11 +1387,8 @@ class CheckSourceMD5(GenericCheckBase):
                     msg += 'checksum differs and there are problems '\
                            'running diff. Please verify manually.\n'
                 else:
-                    p = os.path.join(ReviewDirs.root, 'diff.txt')
-                    with open(p, 'w') as f:
-                        f.write(diff)
                     text += 'diff -r also reports differences\n'
-                    msg = 'Upstream MD5sum check error, diff is in ' + p
+                    msg = 'Upstream MD5sum check error, diff is in ' + diff
         except AttributeError as e:
             self.log.debug("CheckSourceMD5(): Attribute error " + str(e),
                            exc_info=True)
@@ -1378,6 +1421,9 @@ class CheckSpecName(GenericCheckBase):
     MUST: The spec file name must match the base package %{name},
     in the format %{name}.spec unless your package has an exemption.
     '''
+
+    needs_data = ['spec']
+
     def __init__(self, base):
         GenericCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/wiki/' \
@@ -1544,6 +1590,8 @@ class CheckNoNameConflict(GenericCheckBase):
 class CheckSourcedirMacroUse(GenericCheckBase):
     ''' Check for usage of %_sourcedir macro. '''
 
+    needs_data = ['spec']
+
     def __init__(self, base):
         GenericCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/wiki/Packaging:Guidelines' \
@@ -159,6 +159,8 @@ class CheckAutotoolsObsoletedMacros(AutotoolsCheckBase):
             src = self.checks.sources
         trace_files = src.find_all('*configure.ac') \
                     + src.find_all('*configure.in')
+        if src is self.checks.sources:
+            src.extract(trace_files)
 
         # get the base tracing command (grep)
         trace_cmd = self.get_trace_command()
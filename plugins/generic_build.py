@@ -23,7 +23,8 @@ Test setup: build, install, run rpmlint and install sources.
 This is a a sequence of tests which builds, install runs
 rpmlint and finally re-install the sources using rpmbuild -bp.
 It offers the standard dependency CheckBuildCompleted, which other
-tests by default depends on.
+tests by default depends on. Tests declaring needs_data only wait
+for the steps providing this data, if any.
 '''
 
 import glob
@@ -60,6 +61,7 @@ class BuildCheckBase(CheckBase):
     ''' Base class for all generic tests. '''
 
     sort_key = '10'
+    cacheable = False
 
     def __init__(self, checks):
         CheckBase.__init__(self, checks, __file__)
@@ -77,7 +79,7 @@ class BuildCheckBase(CheckBase):
         out += '\n'
         out += self._run_cmd(cmd)
         out += '\n'
-        with open('rpmlint.txt', 'w') as f:
+        with open(os.path.join(ReviewDirs.root, 'rpmlint.txt'), 'w') as f:
             f.write(out)
         for line in out.split('\n'):
             if line and len(line) > 0:
@@ -168,7 +170,8 @@ class CheckBuild(BuildCheckBase):
 
         def listfiles():
             ''' Generate listing of dirs and files in each package. '''
-            with open('files.dir', 'w') as f:
+            listing = os.path.join(ReviewDirs.root, 'files.dir')
+            with open(listing, 'w') as f:
                 for pkg in self.spec.packages:
                     nvr = self.spec.get_package_nvr(pkg)
                     path = Mock.get_package_rpm_path(nvr)
@@ -351,6 +354,10 @@ class CheckInitDeps(BuildCheckBase):
         self.needs = ['CheckRpmlintDebuginfo']
 
     def run(self):
+        if deps.is_preloaded():
+            # --daemon keeps a fresh index, shared by all reviews.
+            self.set_passed(self.NA)
+            return
         # Dirty work-around for
         # https://bugzilla.redhat.com/show_bug.cgi?id=1028332
         subprocess.call(['dnf', '-q', 'clean', 'all'])
@@ -401,12 +408,13 @@ class CheckBuildCompleted(BuildCheckBase):
                 "Cannot do rpmbuild -bp, trying with builddeps")
             Mock.install(self.spec.build_requires)
             Mock.rpmbuild_bp(self.srpm)
-        if os.path.lexists('BUILD'):
-            if os.path.islink('BUILD'):
-                os.unlink('BUILD')
+        link = os.path.join(ReviewDirs.root, 'BUILD')
+        if os.path.lexists(link):
+            if os.path.islink(link):
+                os.unlink(link)
             else:
-                shutil.rmtree('BUILD')
-        os.symlink(Mock.get_builddir('BUILD'), 'BUILD')
+                shutil.rmtree(link)
+        os.symlink(Mock.get_builddir('BUILD'), link)
         self.log.info('Active plugins: ' +
                       ', '.join(self.checks.get_plugins(True)))
         self.set_passed(self.NA, None, [self.setup_attachment()])
@@ -72,6 +72,8 @@ class CheckBuildInMock(GenericShouldCheckBase):
 class CheckBuildroot(GenericShouldCheckBase):
     ''' Is buildroot defined as appropriate? '''
 
+    needs_data = ['spec']
+
     def __init__(self, base):
         GenericShouldCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/wiki/' \
@@ -300,6 +302,8 @@ class CheckFullVerReqSub(GenericShouldCheckBase):
 class CheckIllegalSpecTags(GenericShouldCheckBase):
     ''' Thou shall not use illegal spec tags. '''
 
+    needs_data = ['spec']
+
     def __init__(self, base):
         GenericShouldCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/wiki/Packaging:Guidelines#Tags'
@@ -483,6 +487,9 @@ class CheckScriptletSanity(GenericShouldCheckBase):
 
 class CheckSourceComment(GenericShouldCheckBase):
     ''' Source tarballs shoud have comment on how to generate it. '''
+
+    needs_data = ['sources']
+
     def __init__(self, base):
         GenericShouldCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/wiki/Packaging:SourceURL'
@@ -508,6 +515,8 @@ class CheckSourceComment(GenericShouldCheckBase):
 class CheckSourceUrl(GenericShouldCheckBase):
     ''' SourceX is a working URL. '''
 
+    needs_data = ['sources']
+
     def __init__(self, base):
         GenericShouldCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/wiki/Packaging/SourceURL'
@@ -536,6 +545,9 @@ class CheckSpecAsInSRPM(GenericShouldCheckBase):
     Not in guidelines, buth the spec in the spec URL should
     be the same as the one in the srpm.
     '''
+
+    needs_data = ['spec', 'srpm']
+
     def __init__(self, base):
         GenericShouldCheckBase.__init__(self, base)
         self.text = 'Spec file according to URL is the same as in SRPM.'
@@ -652,6 +664,8 @@ class CheckTimeStamps(GenericShouldCheckBase):
 class CheckUseGlobal(GenericShouldCheckBase):
     ''' Thou shall not use %define. '''
 
+    needs_data = ['spec']
+
     def __init__(self, base):
         GenericShouldCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/wiki/Packaging/' \
@@ -723,6 +737,8 @@ class CheckBundledFonts(GenericShouldCheckBase):
 class CheckSourceDownloads(GenericShouldCheckBase):
     ''' Check that sources could be downloaded from their URI. '''
 
+    needs_data = ['sources']
+
     def __init__(self, base):
         GenericShouldCheckBase.__init__(self, base)
         self.url = 'http://fedoraproject.org/wiki/Packaging:Guidelines' \
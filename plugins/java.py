@@ -8,15 +8,15 @@ class Registry(RegistryBase):
     ''' Register all checks in this file in group 'Java'. '''
 
     group = 'Java'
+    file_patterns = {'rpms': ['*.pom', 'pom.xml', '*.class', '*.jar',
+                              '*.ear', '*.war']}
 
     def is_applicable(self):
         ''' Return True if this is a java package. '''
         if self.is_user_enabled():
             return self.user_enabled_value()
         rpms = self.checks.rpms
-        return (rpms.find("*.pom") or rpms.find("pom.xml") or
-                rpms.find("*.class") or rpms.find("*.jar") or
-                rpms.find("*.ear") or rpms.find("*.war"))
+        return any(rpms.get_matches(p) for p in self.file_patterns['rpms'])
 
 
 class CheckJavaPlugin(CheckBase):
@@ -10,12 +10,14 @@ class Registry(RegistryBase):
     ''' Register all checks in this file in group 'Perl'. '''
 
     group = 'Perl'
+    file_patterns = {'rpms': ['*.pm', '*.pl']}
 
     def is_applicable(self):
         if self.is_user_enabled():
             return self.user_enabled_value()
         return self.checks.spec.name.startswith("perl-") or \
-            self.checks.rpms.find('*.pm') or self.checks.rpms.find('*.pl')
+            self.checks.rpms.get_matches('*.pm') or \
+            self.checks.rpms.get_matches('*.pl')
 
 
 class PerlCheckBase(CheckBase):
@@ -9,13 +9,14 @@ class Registry(RegistryBase):
     ''' Register all checks in this file in group 'Python' '''
 
     group = 'Python'
+    file_patterns = {'rpms': ['*.pyc']}
 
     def is_applicable(self):
         ''' Return true if this is a python package. '''
         if self.is_user_enabled():
             return self.user_enabled_value()
         return self.checks.spec.name.startswith("python") or \
-           self.checks.rpms.find('*.pyc')
+           self.checks.rpms.get_matches('*.pyc')
 
 
 class PythonCheckBase(CheckBase):
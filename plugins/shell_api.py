@@ -30,7 +30,8 @@ from glob import glob
 from subprocess import Popen, PIPE
 
 from FedoraReview import AbstractRegistry, GenericCheck
-from FedoraReview import ReviewDirs, Settings, XdgDirs
+from FedoraReview import ReviewDirs, ReviewError, Settings, XdgDirs
+from FedoraReview.rpm_payload import unpack_rpms
 
 
 # pylint:  disable=W1401
@@ -174,10 +175,11 @@ def _quote(s):
 def _settings_generator():
     ''' Bash code defining FR_SETTINGS, reflecting Settings. '''
     body = 'declare -A FR_SETTINGS \n'
-    for key in Settings.__dict__.iterkeys():
+    settings = vars(Settings.target)
+    for key in settings.iterkeys():
         if key.startswith('_'):
             continue
-        value = Settings.__dict__[key]
+        value = settings[key]
         if not value:
             value = ''
         if isinstance(value, str):
@@ -256,6 +258,28 @@ def _write_tag(spec, env, tag):
     return env
 
 
+def _unpack_rpms():
+    '''
+    Unpack the rpms used by unpack_rpms() into rpms-unpacked in parallel,
+    making the shell function a no-op. On errors, leave it to the shell.
+    '''
+    topdir = os.path.join(ReviewDirs.root, 'rpms-unpacked')
+    if os.path.exists(topdir):
+        return
+    if Settings.prebuilt:
+        pattern = os.path.join(ReviewDirs.root, '..', '*.rpm')
+    else:
+        pattern = os.path.join(ReviewDirs.root, 'results', '*.rpm')
+    paths = [p for p in glob(pattern) if not p.endswith('.src.rpm')]
+    if not paths:
+        return
+    try:
+        unpack_rpms(paths, topdir)
+    except (ReviewError, IOError, OSError):
+        Settings.get_logger().debug('Cannot unpack rpms', exc_info=True)
+        shutil.rmtree(topdir, ignore_errors=True)
+
+
 def _create_env(checks):
     ''' Create the review-env.sh file. '''
 
@@ -276,7 +300,7 @@ def _create_env(checks):
                       _flags_generator(checks.flags))
     env = env.replace('FR_DESCRIPTION_generator',
                       _description_generator(checks.spec))
-    with open(ENV_PATH, 'w') as f:
+    with open(os.path.join(ReviewDirs.root, ENV_PATH), 'w') as f:
         f.write(env)
     attach_path = os.path.join(ReviewDirs.root, '.attachments')
     if os.path.exists(attach_path):
@@ -294,6 +318,7 @@ class Registry(AbstractRegistry):
         ''' Create the review-env.sh file in review dir. No output. '''
 
         group = 'Generic'
+        cacheable = False
 
         def __init__(self, checks, registry):
             GenericCheck.__init__(self, checks, __file__)
@@ -355,6 +380,7 @@ class ShellCheck(GenericCheck):
     DEFAULT_GROUP = 'Generic'
     DEFAULT_TYPE = 'MUST'
     implementation = 'script'
+    parallel_safe = False         # Shares .attachments and .log
 
     def __init__(self, registry, path):
         GenericCheck.__init__(self, registry.checks, path)
@@ -370,6 +396,7 @@ class ShellCheck(GenericCheck):
         self.text = ''
         self.registry = registry
         self._name = None
+        self._unpacks_rpms = False
         self._parse(path)
 
     groups = property(lambda self: self.registry.checks.groups)
@@ -425,6 +452,7 @@ class ShellCheck(GenericCheck):
         if not name:
             name = os.path.splitext(os.path.basename(path))[0]
         self._name = name
+        self._unpacks_rpms = bool([l for l in lines if 'unpack_rpms' in l])
         self._parse_attributes(lines)
 
     def _do_run(self, cmd):
@@ -432,7 +460,8 @@ class ShellCheck(GenericCheck):
         Actually invoke the external script, returning
         (retcode, stdout, stderr)
         '''
-        p = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE)
+        p = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE,
+                  cwd=ReviewDirs.root)
         try:
             stdout, stderr = p.communicate()
         except OSError:
@@ -500,6 +529,8 @@ class ShellCheck(GenericCheck):
         if not self.groups[self.group].is_applicable():
             self.set_passed(self.NA)
             return
+        if self._unpacks_rpms:
+            _unpack_rpms()
         cmd = 'env -i bash -c "source ./review-env.sh; source %s"' % \
             self.defined_in
         retval, stdout, stderr = self._do_run(cmd)
@@ -39,7 +39,7 @@ setup(
     packages = ['FedoraReview'],
     package_data = {'': ['*.tmpl', 'version']},
     scripts = ["src/fedora-review", "src/fedora-create-review",
-        "koji-download-scratch"],
+        "src/fedora-review-client", "koji-download-scratch"],
     maintainer  = 'fedora-review maintainers',
     maintainer_email = 'fedorareview@lists.fedorahosted.org'
 )
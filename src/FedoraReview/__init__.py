@@ -23,6 +23,7 @@ Tools for helping Fedora package reviewers
 from check_base   import AbstractCheck, GenericCheck, CheckBase
 from mock         import Mock
 from review_error import ReviewError
+from review_context import ReviewContext
 from review_dirs  import ReviewDirs
 from registry     import AbstractRegistry, RegistryBase
 from rpm_file     import RpmFile
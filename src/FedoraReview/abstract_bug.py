@@ -30,7 +30,7 @@ from helpers_mixin import HelpersMixin
 from review_error import ReviewError
 from settings import Settings
 from srpm_file import SRPMFile
-from review_dirs import ReviewDirs
+from review_dirs import ReviewDirs, SRPM
 
 
 class AbstractBug(HelpersMixin):
@@ -131,25 +131,34 @@ class AbstractBug(HelpersMixin):
               os.path.exists(self.srpm_file))
         return ok
 
-    def _check_cache(self):
-        ''' return True iff srpm and spec are in srpm dir . '''
+    def _find_cached(self, srpm_dir):
+        ''' Return (spec, srpm) paths in srpm_dir, or None. '''
         name = self.get_name()
         assert name != '?'
-        specs = glob(os.path.join(ReviewDirs.srpm,
-                                  name + '*.spec'))
-        found = len(specs)
-        srpms = glob(os.path.join(ReviewDirs.srpm,
-                                  name + '*.src.rpm'))
-        found += len(srpms)
-        if found == 2:
-            self.spec_file = specs[0]
-            self.srpm_file = srpms[0]
-            self.spec_url = 'file://' + specs[0]
-            self.srpm_url = 'file://' + srpms[0]
+        specs = glob(os.path.join(srpm_dir, name + '*.spec'))
+        srpms = glob(os.path.join(srpm_dir, name + '*.src.rpm'))
+        if len(specs) + len(srpms) == 2:
+            return specs[0], srpms[0]
+        return None
+
+    def _check_cache(self):
+        ''' return True iff srpm and spec are in srpm dir . '''
+        found = self._find_cached(ReviewDirs.srpm)
+        if found:
+            self.spec_file, self.srpm_file = found
+            self.spec_url = 'file://' + self.spec_file
+            self.srpm_url = 'file://' + self.srpm_file
             return True
         else:
             return False
 
+    def get_previous(self):
+        '''
+        Return (spec, srpm) paths of the previous revision kept in the
+        review dir by --incremental, or None.
+        '''
+        return self._find_cached(os.path.join(ReviewDirs.previous, SRPM))
+
     def download_files(self):
         """ Download the spec file and srpm extracted from the bug
         report.
@@ -222,7 +231,7 @@ class AbstractBug(HelpersMixin):
             return prefix + self.get_name()
         else:
             return prefix + tempfile.mkdtemp(prefix=prefix,
-                                             dir=os.getcwd())
+                                             dir=ReviewDirs.topdir)
 
     @staticmethod
     def do_check_options(mode, bad_opts):
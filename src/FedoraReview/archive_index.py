@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Read tar and zip archives without extracting them: list member files
+or compute their digests, as laid out on disk by rpmdev-extract.
+'''
+
+import hashlib
+import posixpath
+import tarfile
+import zipfile
+import zlib
+
+from settings import Settings
+
+# Archives which can be read here, others must be extracted.
+_INDEXED = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.zip')
+_CHUNK = 65536
+
+
+def _member_name(name):
+    ''' Archive member name as a relative path, None if unsafe. '''
+    name = posixpath.normpath(name.lstrip('/'))
+    if name == '.' or name.startswith('../'):
+        return None
+    return name
+
+
+def _hash(f):
+    ''' Return sha256 hexdigest of data read from file f. '''
+    ck = hashlib.sha256()
+    for chunk in iter(lambda: f.read(_CHUNK), ''):
+        ck.update(chunk)
+    return ck.hexdigest()
+
+
+def _read_zip(path, digests):
+    ''' Do _read_archive() for a zip file. '''
+    members = {}
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            name = _member_name(info.filename)
+            if not name or info.filename.endswith('/'):
+                continue
+            members[name] = _hash(zf.open(info)) if digests else None
+    return members
+
+
+def _read_tar(path, digests):
+    ''' Do _read_archive() for a tar file, in streaming mode. '''
+    members = {}
+    dirs = set()
+    links = []
+    tf = tarfile.open(path, 'r|*')
+    try:
+        for info in tf:
+            name = _member_name(info.name)
+            if not name:
+                continue
+            if info.isdir():
+                dirs.add(name)
+            elif info.issym():
+                links.append((name, info.linkname))
+                members[name] = 'link:' + info.linkname
+            elif info.islnk():
+                target = _member_name(info.linkname)
+                members[name] = members.get(target)
+            elif info.isfile():
+                members[name] = \
+                    _hash(tf.extractfile(info)) if digests else None
+    finally:
+        tf.close()
+    for name, target in links:
+        target = posixpath.join(posixpath.dirname(name), target)
+        if posixpath.normpath(target) in dirs:
+            del members[name]
+    return members
+
+
+def _read_archive(path, digests):
+    '''
+    Return dict of files (including symlinks not pointing to a
+    directory) in a tar or zip archive, keyed by relative path.
+    Values are content digests if digests is True, else None. Return
+    None if path can't be read this way.
+    '''
+    if not path.endswith(_INDEXED):
+        return None
+    try:
+        if zipfile.is_zipfile(path):
+            return _read_zip(path, digests)
+        return _read_tar(path, digests)
+    except (tarfile.TarError, zipfile.BadZipfile, IOError, EOFError,
+            zlib.error):
+        Settings.get_logger().debug('Cannot read ' + path, exc_info=True)
+        return None
+
+
+def list_archive(path):
+    '''
+    Return list of files in a tar or zip archive as relative paths,
+    reading only the headers. Return None if path can't be listed.
+    '''
+    members = _read_archive(path, False)
+    return sorted(members.iterkeys()) if members is not None else None
+
+
+def archive_digests(path):
+    '''
+    Return dict of content digests by relative path for all files in
+    a tar or zip archive, streamed without extracting. Symlinks are
+    represented by their target. Return None if path can't be read.
+    '''
+    return _read_archive(path, True)
+
+
+# vim: set expandtab ts=4 sw=4:
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+--batch: review many bugs, urls or srpms in one run using a pool of
+worker processes.
+'''
+
+import json
+import multiprocessing
+import os
+import os.path
+import re
+import sys
+import time
+import xml.dom.minidom
+import xml.etree.ElementTree as ET
+
+from checks import ChecksLister
+from mock import Mock
+from review_context import ReviewContext
+from review_dirs import ReviewDirs
+from review_error import ReviewError
+from settings import Settings
+from version import __version__, BUILD_FULL
+
+_JOB_LOG = 'fedora-review.log'
+
+
+class BatchJob(object):
+    '''
+    One line in the batch file: kind is 'bug', 'url' or 'name', arg the
+    bug number, url or name/srpm path. dirname is the job's directory,
+    holding the review directory and the job's console output.
+    '''
+
+    def __init__(self, index, line):
+        self.index = index
+        self.arg = line
+        if re.match(r'^[0-9]+$', line):
+            self.kind = 'bug'
+        elif '://' in line:
+            self.kind = 'url'
+        else:
+            self.kind = 'name'
+        slug = os.path.basename(line.rstrip('/'))
+        slug = re.sub(r'\.src\.rpm$', '', slug)
+        slug = re.sub(r'[^A-Za-z0-9_.+-]', '_', slug)
+        self.dirname = '%03d-%s' % (index, slug)
+
+
+def read_jobs(path):
+    '''
+    Return list of BatchJob from path ('-' for stdin). Blank lines and
+    lines starting with '#' are ignored.
+    '''
+    try:
+        if path == '-':
+            lines = sys.stdin.readlines()
+        else:
+            with open(path) as f:
+                lines = f.readlines()
+    except IOError as err:
+        raise ReviewError('Cannot read batch file: ' + str(err))
+    lines = [l.strip() for l in lines]
+    lines = [l for l in lines if l and not l.startswith('#')]
+    return [BatchJob(i + 1, l) for i, l in enumerate(lines)]
+
+
+def _init_worker(counter):
+    '''
+    Pool initializer: give each worker process its own mock root using
+    a unique --uniqueext, so workers can build in parallel.
+    '''
+    with counter.get_lock():
+        counter.value += 1
+        worker = counter.value
+    Settings.add_uniqueext('batch%d' % worker)
+    Mock.reset()
+
+
+def _get_summary(job, helper, rcode, elapsed):
+    ''' Return dict describing the outcome of job. '''
+    dirs = helper.context.dirs
+    summary = {'index': job.index,
+               'kind': job.kind,
+               'arg': job.arg,
+               'rcode': rcode,
+               'elapsed': round(elapsed, 3),
+               'review_dir': dirs.root if dirs.is_inited else None,
+               'report': None,
+               'counts': {},
+               'failed': []}
+    if not helper.checks or not helper.outfile:
+        return summary
+    summary['report'] = os.path.abspath(helper.outfile)
+    counts = {'pass': 0, 'fail': 0, 'pending': 0, 'na': 0}
+    for check in helper.checks.checkdict.itervalues():
+        if not check.is_run:
+            continue
+        counts[check.state if check.state else 'na'] += 1
+        if check.is_failed:
+            summary['failed'].append(check.name)
+    summary['failed'].sort()
+    summary['counts'] = counts
+    return summary
+
+
+def _run_job(job):
+    '''
+    Review job in current (worker) process using a new ReviewContext,
+    return summary dict. The review directory is created in the job's
+    directory, which also gets the console output.
+    '''
+    # pylint: disable=bare-except
+    from review_helper import ReviewHelper
+
+    jobdir = os.path.join(ReviewDirs.startdir, job.dirname)
+    if not os.path.exists(jobdir):
+        os.mkdir(jobdir)
+    log = open(os.path.join(jobdir, _JOB_LOG), 'w')
+    sys.stdout = log
+    sys.stderr = log
+    Settings.do_logger_setup(Settings.log_level)
+    context = ReviewContext()
+    context.dirs.reset(ReviewDirs.startdir, jobdir)
+    settings = context.settings
+    settings.bug = job.arg if job.kind == 'bug' else None
+    settings.url = job.arg if job.kind == 'url' else None
+    settings.name = job.arg if job.kind == 'name' else None
+    if job.kind == 'name' and job.arg.endswith('.src.rpm'):
+        settings.rpm_spec = True
+    settings.batch = None
+    started_at = time.time()
+    helper = ReviewHelper(context)
+    try:
+        rcode = helper.run()
+        summary = _get_summary(job, helper, rcode, time.time() - started_at)
+    except:
+        Settings.get_logger().debug('Batch job failed', exc_info=True)
+        summary = _get_summary(job, helper, 1, time.time() - started_at)
+    context.mock.reset()
+    log.close()
+    return summary
+
+
+def _write_json(summaries, path):
+    ''' Write summary list as json to path. '''
+    with open(path, 'w') as f:
+        json.dump({'generator': 'fedora-review',
+                   'version': __version__,
+                   'build': BUILD_FULL,
+                   'jobs': summaries},
+                  f, indent=4, sort_keys=True)
+
+
+def _write_xml(summaries, path):
+    ''' Write summary list as xml to path. '''
+    root = ET.Element('batch')
+    ET.SubElement(root,
+                  'generator',
+                  {'name': 'fedora-review',
+                   'version': __version__,
+                   'build': BUILD_FULL})
+    jobs = ET.SubElement(root, 'jobs')
+    for s in summaries:
+        attrs = dict([(k, str(s[k])) for k in
+                      ['index', 'kind', 'arg', 'rcode', 'elapsed']])
+        for key in ['review_dir', 'report']:
+            if s[key]:
+                attrs[key.replace('_', '-')] = s[key]
+        job = ET.SubElement(jobs, 'job', attrs)
+        if s['counts']:
+            ET.SubElement(job, 'counts',
+                          dict([(k, str(v))
+                                for k, v in s['counts'].iteritems()]))
+        for name in s['failed']:
+            ET.SubElement(job, 'failed', {'test-id': name})
+    dom = xml.dom.minidom.parseString(ET.tostring(root))
+    with open(path, 'w') as f:
+        f.write(dom.toprettyxml(indent='    ', encoding='utf-8'))
+
+
+def write_summary(summaries, path):
+    ''' Write summaries to path, as xml if path ends in .xml else json. '''
+    if path.endswith('.xml'):
+        _write_xml(summaries, path)
+    else:
+        _write_json(summaries, path)
+
+
+class BatchReview(object):
+    '''
+    Review all jobs in a batch file using Settings.batch_jobs worker
+    processes. Plugins and mock availability are resolved once in this
+    process and inherited by the forked workers.
+    '''
+
+    def __init__(self, path):
+        self.log = Settings.get_logger()
+        self.jobs = read_jobs(path)
+
+    def run(self):
+        ''' Run all jobs, write summary. Return exit code. '''
+        if not self.jobs:
+            raise ReviewError('No jobs in batch file: ' + Settings.batch)
+        if not Settings.prebuilt and not Mock.is_available():
+            raise ReviewError("Mock unavailable, --prebuilt must be used.")
+        ChecksLister()
+        workers = min(max(Settings.batch_jobs, 1), len(self.jobs))
+        self.log.info('Reviewing %d packages using %d worker(s)'
+                      % (len(self.jobs), workers))
+        pool = multiprocessing.Pool(workers,
+                                    _init_worker,
+                                    (multiprocessing.Value('i', 0),))
+        summaries = []
+        try:
+            for summary in pool.imap_unordered(_run_job, self.jobs):
+                summaries.append(summary)
+                self.log.info('[%d/%d] %s: %s'
+                              % (len(summaries), len(self.jobs),
+                                 summary['arg'],
+                                 'done' if summary['rcode'] == 0
+                                 else 'failed, rc: %d' % summary['rcode']))
+            pool.close()
+        except:                                  # pylint: disable=W0702
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        summaries.sort(key=lambda s: s['index'])
+        path = os.path.abspath(Settings.batch_summary)
+        write_summary(summaries, path)
+        self.log.info('Batch summary in: ' + path)
+        failed = [s for s in summaries if s['rcode'] != 0]
+        return 1 if failed else 0
+
+
+# vim: set expandtab ts=4 sw=4:
@@ -28,6 +28,30 @@ from textwrap import TextWrapper
 
 from helpers_mixin import HelpersMixin
 
+# Data checks can use, in the order it becomes available, and the
+# check which must run before it's available.
+_DATA_STAGES = [('spec', None),
+                ('srpm', None),
+                ('sources', None),
+                ('rpms', 'CheckBuild'),
+                ('buildsrc', 'CheckBuildCompleted')]
+
+
+def needs_for_data(data):
+    """
+    Return the needs list for a check using data, a list of names
+    in _DATA_STAGES. None means using all data.
+    """
+    if data is None:
+        return ['CheckBuildCompleted']
+    names = [stage[0] for stage in _DATA_STAGES]
+    unknown = [d for d in data if d not in names]
+    if unknown:
+        raise ValueError('Unknown needs_data: ' + ', '.join(unknown))
+    last = max([names.index(d) for d in data] + [0])
+    check = _DATA_STAGES[last][1]
+    return [check] if check else []
+
 
 class _Attachment(object):
     """ Text written after the test lines. """
@@ -75,6 +99,8 @@ class AbstractCheck(object):
                 Registry.
       - implementation: 'python'|'shell', defaults to 'python'.
       - sort_key: used to sort checks in output.
+      - parallel_safe: if False, check is never run concurrently with
+        other such checks when using --jobs.
 
     Properties:
       - name: Unique string.
@@ -105,6 +131,7 @@ class AbstractCheck(object):
     version        = '0.1'
     implementation = 'python'
     sort_key       = 50
+    parallel_safe  = True
 
     def __init__(self, defined_in):
         self.defined_in = defined_in
@@ -159,9 +186,28 @@ class GenericCheck(AbstractCheck):
       - url: Usually guidelines url, possibly None.
       - checks: Checks instance which created this check.
       - registry: Defining Registry, set by Registry.register()
+
+    Class attributes:
+      - needs_data: list of data used by the check, any of 'spec',
+        'srpm', 'sources', 'rpms' (built packages) and 'buildsrc'
+        (the prepared build tree). Sets the default needs so that
+        e. g., checks only using spec and sources run without waiting
+        for the build. Defaults to None, i. e. using everything.
+      - cacheable: if True, result can be replayed from an earlier run
+        with unchanged inputs (see needs_data) when using --cache.
+        The dnf repo metadata is an input only if needs_data is None,
+        so checks using deps must not set needs_data.
+        Checks with side effects e. g., building must set it False.
+      - file_patterns: dict of lists of glob patterns or compiled
+        regexes keyed by data source ('rpms', 'sources', 'buildsrc').
+        Patterns are matched in a single pass over each data source,
+        get matching files using e. g., self.rpms.get_matches(pattern).
     """
 
     registry = None
+    file_patterns = {}
+    needs_data = None
+    cacheable = True
 
     class Attachment(_Attachment):
         """ Text written after the test lines. """
@@ -174,7 +220,7 @@ class GenericCheck(AbstractCheck):
         self.text = self.__class__.__name__
         self.description = 'This test has no description'
         self.type = 'MUST'
-        self.needs = ['CheckBuildCompleted']
+        self.needs = needs_for_data(self.needs_data)
         self.attachments = []      # Keep attachments here to support NA
 
     spec       = property(lambda self: self.checks.spec)
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+The check manifest: plugins, checks and flags as found when all plugins
+were last loaded, cached in the XDG cache dir. It is used by the listing
+options instead of loading plugins, and to select the plugins to load
+for a review.
+'''
+
+import json
+import os
+import os.path
+import sys
+
+from contextlib import contextmanager
+from glob import glob
+
+from registry import AbstractRegistry
+from settings import Settings
+from version import __version__
+from xdg_dirs import XdgDirs
+
+MANIFEST = 'check-manifest.json'
+
+
+def _to_str(value):
+    ''' Convert unicode from json to utf-8 str, recursively. '''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [_to_str(v) for v in value]
+    if isinstance(value, dict):
+        return dict([(_to_str(k), _to_str(v)) for k, v in value.iteritems()])
+    return value
+
+
+@contextmanager
+def plugin_path():
+    ''' Add the plugin directories to sys.path while in with block. '''
+    appdir = os.path.realpath(os.path.dirname(__file__))
+    sys.path.insert(0, appdir)
+    sys.path.insert(0, XdgDirs.app_datadir)
+    try:
+        yield
+    finally:
+        sys.path.remove(XdgDirs.app_datadir)
+        sys.path.remove(appdir)
+
+
+def _plugin_files():
+    '''
+    Return list of paths for all plugin modules as found by
+    straight.plugin in plugins/ directories on sys.path, and all
+    shell plugins in the scripts directories.
+    '''
+    paths = []
+    scriptdirs = [os.path.join(XdgDirs.app_datadir, 'scripts')]
+    for topdir in sys.path:
+        plugindir = os.path.join(topdir, 'plugins')
+        if not os.path.isdir(plugindir):
+            continue
+        paths.extend(glob(os.path.join(plugindir, '*.py')))
+        paths.extend(glob(os.path.join(plugindir, '*', '__init__.py')))
+        scriptdirs.append(os.path.normpath(
+            os.path.join(os.path.realpath(plugindir), '..', 'scripts')))
+    for scriptdir in scriptdirs:
+        paths.extend(glob(os.path.join(scriptdir, '*.sh')))
+    return sorted(set(paths))
+
+
+def _get_stamps():
+    ''' Return dict of mtime by path for all plugin files. '''
+    stamps = {}
+    for path in _plugin_files():
+        try:
+            stamps[path] = os.path.getmtime(path)
+        except OSError:
+            pass
+    return stamps
+
+
+def _path():
+    ''' Path to the cached manifest. '''
+    return os.path.join(XdgDirs.app_cachedir, MANIFEST)
+
+
+def read_manifest():
+    '''
+    Return cached manifest dict, or None if missing or stale i. e.,
+    if any plugin file is added, removed or modified since written.
+    Call with plugin_path() active.
+    '''
+    try:
+        with open(_path()) as f:
+            manifest = _to_str(json.load(f))
+    except (IOError, ValueError):
+        return None
+    if manifest.get('version') != __version__ or \
+            manifest.get('stamps') != _get_stamps():
+        return None
+    return manifest
+
+
+def make_manifest(loader, modules):
+    '''
+    Return manifest for a _ChecksLoader with all plugins loaded.
+    modules is a dict of group, flag and check names by module name.
+    Call with plugin_path() active.
+    '''
+    plugins = {}
+    for name, module in modules.iteritems():
+        registry = loader.groups[module['group']]
+        plugins[name] = dict(module,
+                             external_plugin=registry.external_plugin,
+                             version=registry.version,
+                             build_id=registry.build_id)
+    checks = [{'name': c.name,
+               'group': c.group,
+               'text': c.text,
+               'type': c.type,
+               'defined_in': c.defined_in,
+               'needs': list(c.needs),
+               'deprecates': list(c.deprecates)}
+              for c in loader.checkdict.itervalues()]
+    flags = [{'name': f.name, 'doc': f.doc, 'defined_in': f.defined_in}
+             for f in loader.flags.itervalues()]
+    return {'version': __version__,
+            'stamps': _get_stamps(),
+            'plugins': plugins,
+            'checks': checks,
+            'flags': flags}
+
+
+def write_manifest(manifest):
+    ''' Save manifest in the cache, ignoring errors. '''
+    tmp_path = '%s.%d' % (_path(), os.getpid())
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.rename(tmp_path, _path())
+    except (IOError, OSError, TypeError, ValueError, UnicodeDecodeError):
+        Settings.get_logger().debug('Cannot write check manifest',
+                                    exc_info=True)
+
+
+def can_apply(plugin):
+    '''
+    Return False if the registry of plugin (a manifest entry) can't
+    apply since disabled using --plugins. Plugins defining flags are
+    always loaded, flags must be available.
+    '''
+    if plugin['flags']:
+        return True
+    group = plugin['group']
+    group = group.split('.')[0] if '.' in group else group
+    return Settings.plugins.get(group, True)
+
+
+class DisabledRegistry(AbstractRegistry):
+    '''
+    Stands in for the Registry of a plugin not loaded since disabled
+    using --plugins, so it's still listed as disabled.
+    '''
+
+    def __init__(self, checks, plugin):
+        AbstractRegistry.__init__(self, checks)
+        self.group = plugin['group']
+        self.external_plugin = plugin['external_plugin']
+        self.version = plugin['version']
+        self.build_id = plugin['build_id']
+
+    def register(self, plugin):
+        return []
+
+    def is_applicable(self):
+        return False
+
+    def is_user_enabled(self):
+        ''' Always, see can_apply(). '''
+        return True
+
+    def user_enabled_value(self):
+        ''' Always disabled. '''
+        return False
+
+
+class _Record(object):
+    ''' A check, flag or registry as stored in the manifest. '''
+
+    def __init__(self, data):
+        self.__dict__.update(data)
+
+    def __lt__(self, other):
+        return self.name < other.name
+
+
+class CheckManifest(object):
+    '''
+    Read-only view of all checks, flags and plugins for the listing
+    options, read from the cached manifest. Loads all plugins
+    (refreshing the cache) only if the manifest is missing or stale.
+    Properties as for ChecksLister: checkdict, flags and groups.
+    '''
+
+    def __init__(self):
+        with plugin_path():
+            manifest = read_manifest()
+        if not manifest:
+            from checks import ChecksLister
+            manifest = ChecksLister().manifest
+        self.checkdict = dict([(c['name'], _Record(c))
+                               for c in manifest['checks']])
+        self.flags = dict([(f['name'], _Record(f))
+                           for f in manifest['flags']])
+        self.groups = dict([(p['group'], _Record(p))
+                            for p in manifest['plugins'].itervalues()])
+
+    def get_checks(self):
+        ''' Return dict of all checks by name. '''
+        return self.checkdict
+
+    def get_plugins(self):
+        ''' Return list of all groups (i. e., plugins). '''
+        plugins = [p.split('.')[0] if '.' in p else p
+                   for p in self.groups.iterkeys()]
+        return list(set(plugins))
+
+
+# vim: set expandtab ts=4 sw=4:
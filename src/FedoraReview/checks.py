@@ -22,23 +22,33 @@ This module contains misc helper funtions and classes
 
 import os
 import sys
+import threading
 import time
 
+from importlib import import_module
 from operator import attrgetter
+from Queue import Queue, Empty
 from straight.plugin import load                  # pylint: disable=F0401
 
+from check_base import needs_for_data
+from check_manifest import DisabledRegistry, can_apply, plugin_path
+from check_manifest import make_manifest, read_manifest, write_manifest
 from datasrc import RpmDataSource, BuildFilesSource, SourcesDataSource
 from settings import Settings
 from srpm_file import SRPMFile
 from spec_file import SpecFile
+from result_cache import ResultCache
+from review_context import ContextThread
+from review_dirs import ReviewDirs
 from review_error import ReviewError
-from xdg_dirs import XdgDirs
 from reports import write_xml_report, write_template
 
 
 _BATCH_EXCLUDED = 'CheckBuild,CheckPackageInstalls,CheckRpmlintInstalled,' \
     'CheckNoNameConflict,CheckInitDeps,CheckRpmlint'
 
+_POLL_TIMEOUT = 5
+
 
 class _CheckDict(dict):
     """
@@ -151,6 +161,7 @@ class _ChecksLoader(object):
     Interface class to load  and select checks.
     Properties:
        - checkdict: checks by name, all loaded (not deprecated) checks.
+       - manifest: the check manifest dict, see check_manifest.
     """
 
     class Data(object):
@@ -163,6 +174,7 @@ class _ChecksLoader(object):
         self.checkdict = None
         self.flags = _Flags()
         self.groups = None
+        self.manifest = None
         self._load_checks()
         if Settings.single:
             self.set_single_check(Settings.single)
@@ -185,32 +197,88 @@ class _ChecksLoader(object):
             except KeyError:
                 raise ReviewError(key + ': No such flag')
 
-    def _load_checks(self):
+    def _import_plugins(self, manifest):
         """
-        Load all checks in FedoraReview.checks + external plugin
-        directories and add them to self.checkdict
+        Import plugin modules which can apply according to manifest,
+        add a DisabledRegistry for the others. Return list of modules.
         """
+        plugins = []
+        for name, plugin in manifest['plugins'].iteritems():
+            if not can_apply(plugin):
+                self.log.debug('Not loading disabled plugin ' + name)
+                self.groups[plugin['group']] = \
+                    DisabledRegistry(self, plugin)
+                continue
+            try:
+                plugins.append(import_module(name))
+            except ImportError:
+                self.log.debug('Cannot import ' + name, exc_info=True)
+        return plugins
 
-        self.checkdict = _CheckDict()
-        self.groups = {}
-
-        appdir = os.path.realpath(
-            os.path.join(os.path.dirname(__file__)))
-        sys.path.insert(0, appdir)
-        sys.path.insert(0, XdgDirs.app_datadir)
-        plugins = load('plugins')
+    def _register(self, plugins):
+        """
+        Register checks and flags in all plugins, return dict of
+        group and names of flags and checks by module name.
+        """
+        modules = {}
         for plugin in sorted(plugins, key=lambda p: len(p.__name__)):
             if plugin.__name__ == 'plugins.plugins':
                 continue
+            known_flags = set(self.flags.iterkeys())
             registry = plugin.Registry(self)
             tests = registry.register(plugin)
             self.checkdict.extend(tests)
             self.groups[registry.group] = registry
+            modules[plugin.__name__] = \
+                {'group': registry.group,
+                 'checks': [t.name for t in tests],
+                 'flags': [f for f in self.flags.iterkeys()
+                           if f not in known_flags]}
+        return modules
+
+    def _load_checks(self):
+        """
+        Load all checks in FedoraReview.checks + external plugin
+        directories and add them to self.checkdict. If the check
+        manifest is current only plugins which can apply are loaded,
+        else all of them and the manifest is updated.
+        """
+
+        self.checkdict = _CheckDict()
+        self.groups = {}
+
+        with plugin_path():
+            self.manifest = read_manifest()
+            if self.manifest:
+                modules = self._register(self._import_plugins(self.manifest))
+            else:
+                modules = self._register(load('plugins'))
         for c in self.checkdict:
             if not self.checkdict[c].registry:
                 self.checkdict[c].registry = self.groups[c.group]
-        sys.path.remove(XdgDirs.app_datadir)
-        sys.path.remove(appdir)
+        self._delay_deprecations()
+        if not self.manifest:
+            with plugin_path():
+                self.manifest = make_manifest(self, modules)
+            write_manifest(self.manifest)
+
+    def _delay_deprecations(self):
+        """
+        Let checks declaring needs_data wait for the build if they
+        deprecate or are deprecated by other checks. Deprecations
+        are resolved when the first deprecating check is ready using
+        is_applicable(), which might need the built packages.
+        """
+        victims = set()
+        for check in self.checkdict.itervalues():
+            victims.update(check.deprecates)
+        for check in self.checkdict.itervalues():
+            if getattr(check, 'needs_data', None) is None:
+                continue
+            if check.deprecates or check.name in victims:
+                for need in needs_for_data(None):
+                    if need not in check.needs:
+                        check.needs.append(need)
 
     def exclude_checks(self, exclude_arg):
         ''' Mark all checks in exclude_arg (string) as already done. '''
@@ -260,6 +328,212 @@ class ChecksLister(_ChecksLoader):
         _ChecksLoader.__init__(self)
 
 
+class _ParallelRunner(object):
+    """
+    Run checks in dependency order using a pool of worker threads.
+    A check is started as soon as all checks it needs have run, checks
+    which are not parallel_safe are serialized on a common lock.
+
+    The dependency graph is built once for each phase. Phase 0 contains
+    the checks running before the first check with deprecations becomes
+    ready, phase 1 the rest. This is the point where the serial loop calls
+    Checks.deprecate(), so the same set of checks runs in both modes.
+    """
+
+    def __init__(self, checks, jobs):
+        self.checks = checks
+        self.jobs = jobs
+        self.log = Settings.get_logger()
+        self._serial_lock = threading.Lock()
+
+    def _prune_unresolved(self):
+        ''' Remove checks depending on deprecated checks. '''
+        checkdict = self.checks.checkdict
+        while True:
+            bad = [c for c in checkdict.itervalues()
+                   if not c.is_run and
+                   [n for n in c.needs if n not in checkdict]]
+            if not bad:
+                return
+            for check in bad:
+                dep = [n for n in check.needs if n not in checkdict][0]
+                self.log.warning('%s depends on deprecated %s' %
+                                 (check.name, dep))
+                self.log.warning('Removing %s, cannot resolve deps' %
+                                 check.name)
+                del checkdict[check.name]
+
+    def _get_depths(self):
+        """
+        Return dict of depth by name for all checks which can run, where
+        depth is the wave the check would run in using the serial loop.
+        Checks in disabled plugins and all checks needing them are left
+        out, as are checks in dependency cycles.
+        """
+
+        def is_enabled(check):
+            ''' Return False if check's plugin is disabled by user. '''
+            return not check.registry.is_user_enabled() or \
+                check.registry.user_enabled_value()
+
+        def get_depth(name):
+            ''' Compute depth for name, None if it never can run. '''
+            if name in depths:
+                return depths[name]
+            check = checkdict[name]
+            depths[name] = None             # Cycle guard
+            if not is_enabled(check):
+                return None
+            depth = 0
+            for dep in check.needs:
+                if checkdict[dep].is_run:
+                    continue
+                dep_depth = get_depth(dep)
+                if dep_depth is None:
+                    return None
+                depth = max(depth, dep_depth + 1)
+            depths[name] = depth
+            return depth
+
+        checkdict = self.checks.checkdict
+        depths = {}
+        for name, check in checkdict.iteritems():
+            if not check.is_run:
+                get_depth(name)
+        return dict([(n, d) for n, d in depths.iteritems()
+                     if d is not None])
+
+    def _run_one(self, check):
+        ''' Run a single check, possibly holding the serial lock. '''
+        self.log.debug('Running check: ' + check.name)
+        start = time.time()
+        if check.parallel_safe:
+            ResultCache.run(check)
+        else:
+            with self._serial_lock:
+                ResultCache.run(check)
+        self.log.debug('    %s completed: %.3f seconds'
+                       % (check.name, (time.time() - start)))
+
+    def _worker(self, todo, done):
+        ''' Thread body: run checks from todo, report in done. '''
+        while True:
+            check = todo.get()
+            if check is None:
+                return
+            try:
+                self._run_one(check)
+                done.put((check, None))
+            except:                              # pylint: disable=W0702
+                done.put((check, sys.exc_info()))
+
+    @staticmethod
+    def _get_heights(names, dependents):
+        """
+        Return dict of height by name, where height is the length of
+        the longest chain of checks depending on the check.
+        """
+
+        def get_height(name):
+            ''' Compute height for name. '''
+            if name not in heights:
+                heights[name] = 0             # Cycle guard
+                heights[name] = \
+                    max([get_height(d) + 1 for d in dependents[name]] + [0])
+            return heights[name]
+
+        heights = {}
+        for name in names:
+            get_height(name)
+        return heights
+
+    def _run_phase(self, names, order_by_name, todo, done):
+        """
+        Run all checks in names, return list of completed checks. Ready
+        checks on the longest dependency chain e. g., the build, are
+        started first so that short, independent checks run meanwhile.
+        """
+        checkdict = self.checks.checkdict
+        pending = {}
+        dependents = dict([(n, []) for n in names])
+        for name in names:
+            needs = [d for d in checkdict[name].needs if d in names]
+            pending[name] = len(needs)
+            for dep in needs:
+                dependents[dep].append(name)
+        heights = self._get_heights(names, dependents)
+        ready = [n for n in names if pending[n] == 0]
+        completed = []
+        in_flight = 0
+        exc_info = None
+        while ready or in_flight:
+            ready.sort(key=lambda n: (-heights[n], order_by_name[n]))
+            while ready and in_flight < self.jobs and not exc_info:
+                todo.put(checkdict[ready.pop(0)])
+                in_flight += 1
+            if not in_flight:
+                break
+            try:
+                check, error = done.get(True, _POLL_TIMEOUT)
+            except Empty:
+                continue
+            in_flight -= 1
+            if error:
+                exc_info = exc_info if exc_info else error
+                continue
+            completed.append(check)
+            for name in dependents[check.name]:
+                pending[name] -= 1
+                if pending[name] == 0:
+                    ready.append(name)
+        if exc_info:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return completed
+
+    def run(self):
+        """
+        Run all checks which can run. Return list of checks which have
+        run, ordered as if run by the serial loop.
+        """
+        todo = Queue()
+        done = Queue()
+        workers = [ContextThread(target=self._worker, args=(todo, done))
+                   for _ in range(0, self.jobs)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        order_by_name = {}
+        completed = []
+        try:
+            for phase in [0, 1]:
+                self._prune_unresolved()
+                depths = self._get_depths()
+                checkdict = self.checks.checkdict
+                index_by_name = dict([(n, i) for i, n in
+                                      enumerate(checkdict.iterkeys())])
+                for name in depths.iterkeys():
+                    order_by_name[name] = \
+                        (phase, depths[name],
+                         -len(checkdict[name].deprecates),
+                         index_by_name[name])
+                limit = None
+                if phase == 0:
+                    deprecators = [depths[n] for n in depths.iterkeys()
+                                   if checkdict[n].deprecates]
+                    limit = min(deprecators) if deprecators else None
+                names = set([n for n in depths.iterkeys()
+                             if limit is None or depths[n] < limit])
+                completed.extend(self._run_phase(names, order_by_name,
+                                                  todo, done))
+                if limit is None:
+                    break
+                self.checks.deprecate()
+        finally:
+            for worker in workers:
+                todo.put(None)
+        return sorted(completed, key=lambda c: order_by_name[c.name])
+
+
 class Checks(_ChecksLoader):
     ''' Interface class to run checks.  '''
 
@@ -276,15 +550,24 @@ class Checks(_ChecksLoader):
         self.data.buildsrc = BuildFilesSource()
         self.data.sources = SourcesDataSource(self.spec)
         self._clock = None
+        self._register_file_patterns()
 
     rpms = property(lambda self: self.data.rpms)
     sources = property(lambda self: self.data.sources)
     buildsrc = property(lambda self: self.data.buildsrc)
 
+    def _register_file_patterns(self):
+        ''' Register file_patterns in registries and checks. '''
+        owners = self.groups.values() + self.checkdict.values()
+        for owner in owners:
+            for source, patterns in owner.file_patterns.iteritems():
+                getattr(self.data, source).register_patterns(patterns)
+
     @staticmethod
     def _write_testdata(results):
         ''' Write hidden file usable when writing tests. '''
-        with open('.testlog.txt', 'w') as f:
+        path = os.path.join(ReviewDirs.root, '.testlog.txt')
+        with open(path, 'w') as f:
             for r in results:
                 f.write('\n' + 24 * ' '
                         + "('%s', '%s')," % (r.state, r.name))
@@ -349,11 +632,15 @@ class Checks(_ChecksLoader):
             if check.is_run:
                 return
             self.log.debug('Running check: ' + name)
-            check.run()
+            ResultCache.run(check)
             now = time.time()
             self.log.debug('    %s completed: %.3f seconds'
                            % (name, (now - self._clock)))
             self._clock = now
+            add_result(check)
+
+        def add_result(check):
+            """ Update results, attachments and issues from check. """
             attachments.extend(check.attachments)
             result = check.result
             if not result:
@@ -367,16 +654,24 @@ class Checks(_ChecksLoader):
         attachments = []
         has_deprecated = False
 
-        tests_to_run = self._get_ready_to_run()
-        self._clock = time.time()
-        while tests_to_run != []:
-            for name in tests_to_run:
-                if self.checkdict[name].deprecates and not has_deprecated:
-                    self.deprecate()
-                    has_deprecated = True
-                    break
-                run_check(name)
+        ResultCache.load()
+        if Settings.jobs > 1:
+            self.log.debug('Running checks using %d jobs' % Settings.jobs)
+            for check in _ParallelRunner(self, Settings.jobs).run():
+                add_result(check)
+        else:
             tests_to_run = self._get_ready_to_run()
+            self._clock = time.time()
+            while tests_to_run != []:
+                for name in tests_to_run:
+                    if self.checkdict[name].deprecates and \
+                        not has_deprecated:
+                            self.deprecate()
+                            has_deprecated = True
+                            break
+                    run_check(name)
+                tests_to_run = self._get_ready_to_run()
+        ResultCache.save()
 
         if writedown:
             key_getter = attrgetter('group', 'type', 'name')
@@ -386,10 +681,7 @@ class Checks(_ChecksLoader):
                            attachments)
             write_xml_report(self.spec, results)
         else:
-            with open('.testlog.txt', 'w') as f:
-                for r in results:
-                    f.write('\n' + 24 * ' '
-                            + "('%s', '%s')," % (r.state, r.name))
+            self._write_testdata(results)
 
 
 # vim: set expandtab ts=4 sw=4:
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+--daemon: keep modules, plugins, mock status and the dependency index
+loaded and run review requests from fedora-review-client, each in a
+forked child process.
+'''
+
+import errno
+import json
+import os
+import os.path
+import signal
+import socket
+import sys
+
+import deps
+
+from checks import ChecksLister
+from mock import Mock
+from review_client import exit_trailer, socket_path
+from review_dirs import ReviewDirs
+from review_error import ReviewError
+from settings import Settings
+
+_INDEX_MAX_AGE = 3600           # Seconds before dnf metadata is refreshed.
+_IDLE_TIMEOUT = 10              # Seconds between housekeeping when idle.
+
+
+def _init_request(argv, cwd, slot):
+    '''
+    Prepare settings and review dir for options argv in current
+    (child) process. Requests running at the same time have different
+    slots, each using a mock root of its own, so they don't lock or
+    clobber each other's chroot.
+    '''
+    sys.argv = ['fedora-review'] + argv
+    Settings.init_done = False
+    Settings.root_tag = 'daemon%d' % slot
+    ReviewDirs.reset(cwd)
+    Mock.reset()
+
+
+def _run_request(conn, slot):
+    '''
+    Run the review requested on connection conn in current (child)
+    process using mock root slot, with stdout and stderr sent to the
+    client. Return exit code.
+    '''
+    from review_helper import ReviewHelper
+
+    try:
+        request = json.loads(conn.makefile('rb').readline())
+        argv = [str(a) for a in request['argv']]
+        cwd = str(request['cwd'])
+        env = request.get('env', {})
+    except (ValueError, KeyError, TypeError):
+        conn.sendall('ERROR: Bad request\n' + exit_trailer(2))
+        return 2
+    # Private to this child, as are all other process-wide changes.
+    os.chdir(cwd)
+    for key, value in env.iteritems():
+        os.environ[str(key)] = str(value)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(conn.fileno(), 1)
+    os.dup2(conn.fileno(), 2)
+    _init_request(argv, cwd, slot)
+    rcode = ReviewHelper().run()
+    Mock.reset()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    conn.sendall(exit_trailer(rcode))
+    return rcode
+
+
+class ReviewDaemon(object):
+    '''
+    Serve review requests on a Unix socket, see review_client. Loading
+    modules and plugins, checking for mock and loading the dnf repo
+    index is done once; each request runs in a forked child which
+    thus starts with all of this in place. Each running child has a
+    slot, the lowest one free when started, selecting its mock root.
+    '''
+
+    def __init__(self, path=None):
+        self.log = Settings.get_logger()
+        self.path = socket_path(path)
+        self.children = {}              # slot by pid
+        self._socket = None
+
+    def _refresh_index(self):
+        ''' Load dnf repo index if not done or too old. '''
+        try:
+            deps.preload(_INDEX_MAX_AGE)
+        except OSError:
+            self.log.debug('Cannot load repo index', exc_info=True)
+
+    def _warm_up(self):
+        ''' Do all work shared by reviews. '''
+        ChecksLister()
+        if not Settings.prebuilt and not Mock.is_available():
+            raise ReviewError("Mock unavailable, --prebuilt must be used.")
+        self._refresh_index()
+
+    def _bind(self):
+        ''' Create the listening socket, accessible only by this user. '''
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                raise ReviewError('Daemon already running on ' + self.path)
+            except socket.error:
+                os.unlink(self.path)
+            finally:
+                probe.close()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            self._socket.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        self._socket.listen(16)
+        self._socket.settimeout(_IDLE_TIMEOUT)
+
+    def _reap(self):
+        ''' Collect exited children. '''
+        for pid in list(self.children.iterkeys()):
+            try:
+                done = os.waitpid(pid, os.WNOHANG)[0]
+            except OSError:
+                done = pid
+            if done:
+                del self.children[pid]
+
+    def _free_slot(self):
+        ''' Return lowest slot not used by a running child. '''
+        used = set(self.children.itervalues())
+        slot = 1
+        while slot in used:
+            slot += 1
+        return slot
+
+    def _serve(self, conn):
+        ''' Run request on conn in a forked child. '''
+        slot = self._free_slot()
+        pid = os.fork()
+        if pid:
+            conn.close()
+            self.children[pid] = slot
+            self.log.debug('Started review process %d, slot %d'
+                           % (pid, slot))
+            return
+        rcode = 1
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            self._socket.close()
+            rcode = _run_request(conn, slot)
+        except:                                  # pylint: disable=W0702
+            self.log.debug('Review request failed', exc_info=True)
+        finally:
+            os._exit(rcode)                      # pylint: disable=W0212
+
+    def run(self):
+        ''' Serve requests until interrupted. Return exit code. '''
+        self._warm_up()
+        self._bind()
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        self.log.info('Serving reviews on ' + self.path)
+        try:
+            while True:
+                self._reap()
+                try:
+                    conn = self._socket.accept()[0]
+                except socket.timeout:
+                    self._refresh_index()
+                    continue
+                except socket.error as err:
+                    if err.errno == errno.EINTR:
+                        continue
+                    raise
+                conn.settimeout(None)
+                self._serve(conn)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._socket.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self.log.info('Daemon stopped')
+        return 0
+
+
+# vim: set expandtab ts=4 sw=4:
@@ -21,17 +21,91 @@ a filelist.
 import os
 import os.path
 import re
+import sys
+import threading
 
 from abc import ABCMeta, abstractmethod
-from fnmatch import fnmatch
+from fnmatch import translate
 from glob import glob
 
+from review_context import ContextThread
 from review_dirs import ReviewDirs
 from rpm_file import RpmFile
+from review_error import ReviewError
 from settings import Settings
 from source import Source
 
 
+_DOWNLOAD_WORKERS = 4
+_GLOB_CHARS = re.compile(r'[*?[]')
+_globs = {}
+
+
+def _parse_glob(pattern):
+    '''
+    Return (kind, key, regex) for a glob pattern, cached. kind tells
+    which _FileIndex lookup gives all candidate matches for key: 'path'
+    for literal paths, 'ext' for '*.ext', 'basename' for '*/name', 'dir'
+    for 'dir/*' and 'scan' when all files must be matched against regex.
+    '''
+    if pattern in _globs:
+        return _globs[pattern]
+    kind, key = 'scan', None
+    if not _GLOB_CHARS.search(pattern):
+        kind, key = 'path', pattern
+    elif pattern.startswith('*') and not _GLOB_CHARS.search(pattern[1:]):
+        tail = pattern[1:]
+        if tail.startswith('/') and len(tail) > 1 and '/' not in tail[1:]:
+            kind, key = 'basename', tail[1:]
+        elif tail.startswith('.') and len(tail) > 1 \
+                and '.' not in tail[1:] and '/' not in tail:
+            kind, key = 'ext', tail[1:]
+    elif pattern.endswith('/*') and not _GLOB_CHARS.search(pattern[:-2]):
+        kind, key = 'dir', pattern[:-2]
+    entry = (kind, key, re.compile(translate(pattern)))
+    _globs[pattern] = entry
+    return entry
+
+
+class _FileIndex(object):
+    ''' Basename, extension and directory indexes for a file list. '''
+
+    def __init__(self, files):
+        self.files = files
+        self.by_basename = {}
+        self.by_ext = {}
+        self.by_dir = {}
+        for ix, path in enumerate(files):
+            dirname, basename = \
+                path.rsplit('/', 1) if '/' in path else ('', path)
+            self.by_basename.setdefault(basename, []).append(ix)
+            self.by_dir.setdefault(dirname, []).append(ix)
+            if '.' in basename:
+                ext = basename.rsplit('.', 1)[1]
+                self.by_ext.setdefault(ext, []).append(ix)
+
+    def candidates(self, kind, key):
+        '''
+        Return files possibly matching a glob parsed by _parse_glob(),
+        in file list order.
+        '''
+        if kind == 'scan':
+            return self.files
+        if kind == 'path':
+            ixs = self.by_basename.get(key.rsplit('/', 1)[-1], [])
+        elif kind == 'basename':
+            ixs = self.by_basename.get(key, [])
+        elif kind == 'ext':
+            ixs = self.by_ext.get(key, [])
+        else:
+            ixs = []
+            for dirname, dir_ixs in self.by_dir.iteritems():
+                if dirname == key or dirname.startswith(key + '/'):
+                    ixs.extend(dir_ixs)
+            ixs.sort()
+        return [self.files[ix] for ix in ixs]
+
+
 class AbstractDataSource(object):
     '''
      A collection of file containers.
@@ -49,6 +123,10 @@ class AbstractDataSource(object):
     def __init__(self):
         self.log = Settings.get_logger()
         self._inited = False
+        self._lock = threading.RLock()     # Lazy init while using --jobs
+        self._indexes = {}
+        self._patterns = []
+        self._matches = {}
 
     @abstractmethod
     def init(self):
@@ -80,6 +158,98 @@ class AbstractDataSource(object):
         self.init()
         return self.containers
 
+    def _get_index(self, container):
+        ''' Return _FileIndex for container, built once per file list. '''
+        files = self.get_filelist(container)
+        with self._lock:
+            index = self._indexes.get(container)
+            if index is None or index.files is not files:
+                index = _FileIndex(files)
+                self._indexes[container] = index
+        return index
+
+    def _find_glob(self, glob_pattern, container):
+        ''' Yield files in container matching glob_pattern. '''
+        kind, key, regex = _parse_glob(glob_pattern)
+        for f in self._get_index(container).candidates(kind, key):
+            if regex.match(f):
+                yield f
+
+    def register_patterns(self, patterns):
+        '''
+        Register glob patterns (strings) or compiled regexes which later
+        are served by get_matches(). All patterns registered before
+        a container is first scanned are matched in a single pass over
+        its files. Regexes must not use backreferences.
+        '''
+        with self._lock:
+            for pattern in patterns:
+                if pattern not in self._patterns:
+                    self._patterns.append(pattern)
+
+    @staticmethod
+    def _combine(patterns):
+        '''
+        Return list of (combined regex, [(pattern, regex)...]) for
+        patterns, one combined regex for each set of regex flags.
+        '''
+        by_flags = {}
+        for pattern in patterns:
+            regex = pattern if hasattr(pattern, 'match') \
+                else _parse_glob(pattern)[2]
+            by_flags.setdefault(regex.flags, []).append((pattern, regex))
+        combined = []
+        for flags, members in by_flags.iteritems():
+            alternatives = ['(?:%s)' % r.pattern for p, r in members]
+            try:
+                regex = re.compile('|'.join(alternatives), flags)
+            except (re.error, AssertionError):
+                # E. g., too many groups: match each pattern instead.
+                regex = re.compile('')
+            combined.append((regex, members))
+        return combined
+
+    def _scan(self, container):
+        '''
+        Return dict of matching files by pattern in container, scanning
+        the files once for all registered patterns not yet scanned.
+        '''
+        files = self.get_filelist(container)
+        with self._lock:
+            scanned, matches = self._matches.get(container, (None, {}))
+            if scanned is not files:
+                matches = {}
+            todo = [p for p in self._patterns if p not in matches]
+            if todo:
+                combined = self._combine(todo)
+                found = dict([(p, []) for p in todo])
+                for f in files:
+                    for regex, members in combined:
+                        if not regex.match(f):
+                            continue
+                        for pattern, member in members:
+                            if member.match(f):
+                                found[pattern].append(f)
+                matches = dict(matches)
+                matches.update(found)
+            self._matches[container] = (files, matches)
+        return matches
+
+    def get_matches(self, pattern, container=None):
+        '''
+        List of all files matching a glob pattern or compiled regex,
+        like find_all(), served from the single-pass scan of all
+        registered patterns. pattern is registered if required.
+        '''
+        self.init()
+        if container and container not in self.containers:
+            raise ValueError('DataSource: bad source: ' + container)
+        self.register_patterns([pattern])
+        result = []
+        for s in [container] if container else self.containers:
+            result.extend(self._scan(s)[pattern])
+        return result
+
     def find(self, glob_pattern, container=None):
         ''' Find first file matching glob_pattern, or None. '''
         self.init()
@@ -88,9 +258,8 @@ class AbstractDataSource(object):
         if hasattr(glob_pattern, 'match'):
             return self.find_re(glob_pattern, container)
         for s in [container] if container else self.containers:
-            for f in self.get_filelist(s):
-                if fnmatch(f, glob_pattern):
-                    return f
+            for f in self._find_glob(glob_pattern, s):
+                return f
         return None
 
     def find_re(self, regex, container=None):
@@ -115,9 +284,7 @@ class AbstractDataSource(object):
             return self.find_all_re(glob_pattern, container)
         result = []
         for s in [container] if container else self.containers:
-            for f in self.get_filelist(s):
-                if fnmatch(f, glob_pattern):
-                    result.append(f)
+            result.extend(self._find_glob(glob_pattern, s))
         return result
 
     def find_all_re(self, regex, container=None):
@@ -178,12 +345,14 @@ class BuildFilesSource(AbstractDataSource):
         self.init()
         if container and container not in self.containers:
             raise ValueError('BuildFilesSource: illegal rootdir')
-        if self.files is None:
-            self.files = []
-            # pylint: disable=W0612
-            for root, dirs, files in os.walk(self.containers[0]):
-                paths = [os.path.join(root, f) for f in files]
-                self.files.extend(paths)
+        with self._lock:
+            if self.files is None:
+                all_ = []
+                # pylint: disable=W0612
+                for root, dirs, files in os.walk(self.containers[0]):
+                    paths = [os.path.join(root, f) for f in files]
+                    all_.extend(paths)
+                self.files = all_
         return self.files
 
     def get(self, key=None):
@@ -203,15 +372,18 @@ class RpmDataSource(AbstractDataSource):
         self.spec = spec
         self.containers = None
         self.rpms_by_pkg = None
+        self._all_files = None
 
     def init(self):
-        if self.containers:
-            return
-        self.containers = self.spec.packages
-        self.rpms_by_pkg = {}
-        for pkg in self.spec.packages:
-            nvr = self.spec.get_package_nvr(pkg)
-            self.rpms_by_pkg[pkg] = RpmFile(pkg, nvr.version, nvr.release)
+        with self._lock:
+            if self.containers:
+                return
+            rpms_by_pkg = {}
+            for pkg in self.spec.packages:
+                nvr = self.spec.get_package_nvr(pkg)
+                rpms_by_pkg[pkg] = RpmFile(pkg, nvr.version, nvr.release)
+            self.rpms_by_pkg = rpms_by_pkg
+            self.containers = self.spec.packages
 
     def get_filelist(self, container=None):
         self.init()
@@ -219,10 +391,13 @@ class RpmDataSource(AbstractDataSource):
             raise ValueError('RpmSource: bad package: ' + container)
         if container:
             return self.rpms_by_pkg[container].filelist
-        all_ = []
-        for pkg in self.rpms_by_pkg.iterkeys():
-            all_.extend(self.rpms_by_pkg[pkg].filelist)
-        return all_
+        with self._lock:
+            if self._all_files is None:
+                all_ = []
+                for pkg in self.rpms_by_pkg.iterkeys():
+                    all_.extend(self.rpms_by_pkg[pkg].filelist)
+                self._all_files = all_
+        return self._all_files
 
     def get(self, key=None):
         ''' Return RpmFile object for a package name key. '''
@@ -236,14 +411,55 @@ class RpmDataSource(AbstractDataSource):
         return self.rpms_by_pkg.iterkeys()
 
 
+def _create_sources(urls_by_tag):
+    '''
+    Return dict of Source objects by tag for the urls by tag, using
+    a bounded pool of threads to download them concurrently.
+    '''
+    todo = list(urls_by_tag.iteritems())
+    sources = {}
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        ''' Create Sources until todo is empty or there's an error. '''
+        while True:
+            with lock:
+                if not todo or errors:
+                    return
+                tag, url = todo.pop(0)
+            try:
+                source = Source(tag, url)
+            except Exception:                    # pylint: disable=W0703
+                with lock:
+                    errors.append(sys.exc_info())
+                return
+            with lock:
+                sources[tag] = source
+
+    threads = [ContextThread(target=worker)
+               for i in range(min(_DOWNLOAD_WORKERS, len(todo)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(1)       # Plain join() blocks KeyboardInterrupt.
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return sources
+
+
 class SourcesDataSource(AbstractDataSource):
-    ''' The tarballs listed as SourceX: in specfile. '''
+    '''
+    The tarballs listed as SourceX: in specfile. File lists are read
+    from the archive headers when possible; use extract() before
+    reading files.
+    '''
 
     def __init__(self, spec):
         AbstractDataSource.__init__(self)
-        self.sources_by_tag = {}
-        for tag, url in spec.sources_by_tag.iteritems():
-            self.sources_by_tag[tag] = Source(tag, url)
+        self.sources_by_tag = _create_sources(spec.sources_by_tag)
         self.containers = [s.tag for s in self.sources_by_tag.itervalues()]
         self.files_by_tag = {}
 
@@ -253,19 +469,40 @@ class SourcesDataSource(AbstractDataSource):
     def _load_files(self, tag):
         """ Ensure that file list for tag is in files_by_tag. """
 
-        if tag in self.files_by_tag.iterkeys():
-            return
-        source = self.sources_by_tag[tag]
-        if not source.extract_dir:
-            source.extract()
-        self.log.debug('Adding files in : %s' % source.filename)
-        self.files_by_tag[tag] = []
-        # pylint: disable=W0612
-        for root, dirs, files in os.walk(source.extract_dir):
-            paths = [os.path.join(root, f) for f in files]
-            self.files_by_tag[source.tag].extend(paths)
-        self.log.debug('Loaded %d files',
-                       len(self.files_by_tag[source.tag]))
+        with self._lock:
+            if tag in self.files_by_tag.iterkeys():
+                return
+            source = self.sources_by_tag[tag]
+            self.log.debug('Adding files in : %s' % source.filename)
+            all_ = source.get_filelist()
+            self.files_by_tag[source.tag] = all_
+            self.log.debug('Loaded %d files', len(all_))
+
+    def extract(self, paths=None):
+        '''
+        Make sure files in paths (as returned by get_filelist()) are
+        available on disk, extracting the sources holding them. All
+        sources are extracted if paths is None. Return paths.
+        '''
+        if paths is None:
+            tags = self.containers
+        else:
+            tags = set()
+            for path in paths:
+                relpath = os.path.relpath(path, ReviewDirs.upstream_unpacked)
+                tags.add(relpath.split('/', 1)[0])
+        for tag in tags:
+            if tag not in self.sources_by_tag:
+                continue
+            with self._lock:
+                source = self.sources_by_tag[tag]
+                if source.extract_dir:
+                    continue
+                try:
+                    source.extract()
+                except ReviewError as err:
+                    self.log.warning(str(err))
+        return paths
 
     def get_filelist(self, container=None):
         if container and container not in self.containers:
@@ -17,17 +17,183 @@
 
 ''' Interface to package dependencies. '''
 
+import os.path
 import subprocess
+import threading
+import time
+
+from glob import glob
+
+import rpm
 try:
     from subprocess import check_output          # pylint: disable=E0611
 except ImportError:
     from FedoraReview.el_compat import check_output
 
+from rpm_file import HeaderCache
 from settings import Settings
 
+_index = None
+_index_lock = threading.Lock()
+_preloaded_at = None
+
+# repomd.xml in the dnf metadata caches, system and per user.
+_REPOMD_PATTERNS = ['/var/cache/dnf/*/repodata/repomd.xml',
+                    '/var/cache/libdnf5/*/repodata/repomd.xml',
+                    '/var/tmp/dnf-*/*/repodata/repomd.xml']
+
+
+class _RepoIndex(object):
+    '''
+    In-memory index of the available packages in the enabled dnf repos,
+    loaded once from the local metadata cache through the libdnf sack.
+    Answers the same questions as 'dnf repoquery -C', but in batches and
+    without starting a dnf process for each query. File queries need
+    the filelists metadata, has_filelists is False if it's not cached.
+    '''
+
+    def __init__(self):
+        import dnf                                # pylint: disable=F0401
+        self.log = Settings.get_logger()
+        self._lock = threading.Lock()
+        self._base = dnf.Base()
+        try:
+            self._base.conf.cacheonly = True
+            self._base.read_all_repos()
+        except AttributeError:
+            # Older dnf: no cacheonly option.
+            self._base.read_all_repos()
+            for repo in self._base.repos.iter_enabled():
+                repo.md_only_cached = True
+        try:
+            if 'filelists' not in self._base.conf.optional_metadata_types:
+                self._base.conf.optional_metadata_types += ['filelists']
+        except AttributeError:
+            pass                                 # Older dnf: always loaded.
+        self._base.fill_sack(load_system_repo=False,
+                             load_available_repos=True)
+        self._query = self._base.sack.query().available()
+        self.has_filelists = self._have_filelists()
+
+    def _have_filelists(self):
+        ''' Return True if filelists are loaded for all enabled repos. '''
+        for repo in self._base.repos.iter_enabled():
+            try:
+                if not repo.get_metadata_path('filelists'):
+                    self.log.debug('No filelists for repo ' + repo.id)
+                    return False
+            except AttributeError:
+                return True                      # Older dnf: always loaded.
+        return True
+
+    def _filter(self, **kwargs):
+        ''' Run a sack query, return list of packages (possibly []). '''
+        try:
+            return list(self._query.filter(**kwargs))
+        except (ValueError, TypeError):
+            self.log.debug('Bad repo query: ' + str(kwargs), exc_info=True)
+            return []
+
+    def whatprovides(self, reqs):
+        ''' Return dict of sets of package names providing each req. '''
+        result = {}
+        with self._lock:
+            for req in reqs:
+                pkgs = self._filter(provides=req)
+                if req.startswith('/'):
+                    pkgs.extend(self._filter(file=req))
+                result[req] = set([p.name for p in pkgs])
+        return result
+
+    def requires(self, pkgs):
+        ''' Return set of package names resolving requires of pkgs. '''
+        with self._lock:
+            reldeps = []
+            for pkg in self._filter(name__glob=list(pkgs)):
+                reldeps.extend(pkg.requires)
+            if not reldeps:
+                return set()
+            return set([p.name for p in self._filter(provides=reldeps)])
+
+    def file_owners(self, paths):
+        ''' Return dict of sets of package names owning each path. '''
+        result = dict([(p, set()) for p in paths])
+        wanted = set([p.rstrip('/') or '/' for p in paths])
+        owners = {}
+        with self._lock:
+            for pkg in self._filter(file=list(wanted)):
+                for path in wanted.intersection(pkg.files):
+                    owners.setdefault(path, set()).add(pkg.name)
+        for path in paths:
+            result[path] = owners.get(path.rstrip('/') or '/', set())
+        return result
+
+    def file_list(self, pkgs):
+        ''' Return list of all files in the named pkgs. '''
+        paths = []
+        with self._lock:
+            for pkg in self._filter(name__glob=list(pkgs)):
+                paths.extend(pkg.files)
+        return paths
+
+
+def _get_index(files=False):
+    '''
+    Return the shared _RepoIndex, or None if it can't be used. If files
+    is True, also None when the index has no file lists.
+    '''
+    global _index                                # pylint: disable=W0603
+    with _index_lock:
+        if _index is None:
+            try:
+                _index = _RepoIndex()
+            except Exception:                    # pylint: disable=W0703
+                Settings.get_logger().debug(
+                    'Cannot load dnf repo index, using dnf repoquery',
+                    exc_info=True)
+                _index = False
+    if files and _index and not _index.has_filelists:
+        return None
+    return _index if _index else None
+
+
+def preload(max_age):
+    '''
+    Refresh metadata and load the repo index now in a long-running
+    process (--daemon) if not done, or done more than max_age seconds
+    ago. Forked reviews then share this index, see is_preloaded().
+    '''
+    global _preloaded_at                         # pylint: disable=W0603
+    if _preloaded_at and time.time() - _preloaded_at < max_age:
+        return
+    init()
+    _get_index()
+    _preloaded_at = time.time()
+
+
+def is_preloaded():
+    ''' Return True if the index is kept warm using preload(). '''
+    return bool(_preloaded_at)
+
+
+def metadata_stamp():
+    '''
+    Return sorted list of [path, mtime] for the cached repomd.xml
+    files, changes when the repo metadata used by queries is updated.
+    '''
+    stamp = []
+    for pattern in _REPOMD_PATTERNS:
+        for path in glob(pattern):
+            try:
+                stamp.append([path, os.path.getmtime(path)])
+            except OSError:
+                pass
+    return sorted(stamp)
+
 
 def init():
     ''' Setup module for subsequent calls. '''
+    global _index                                # pylint: disable=W0603
     # pk.refresh_cache would be better, but requires privileges.
     # Might be solvable, see
     # https://bugs.launchpad.net/ubuntu/+source/packagekit/+bug/1008106
@@ -36,6 +202,8 @@ def init():
     except subprocess.CalledProcessError:
         Settings.get_logger().warning(
             "Cannot run dnf makecache, trouble ahead")
+    with _index_lock:
+        _index = None
 
 
 def list_deps(pkgs):
@@ -46,6 +214,10 @@ def list_deps(pkgs):
     if not pkgs:
         return []
 
+    index = _get_index()
+    if index:
+        return list(index.requires(set(pkgs)))
+
     cmd = ['dnf', 'repoquery', '-q', '-C', '--requires', '--resolve']
     cmd.extend(list(set(pkgs)))
     Settings.get_logger().debug("Running: " + ' '.join(cmd))
@@ -73,6 +245,11 @@ def resolve(reqs):
         return []
     reqs = list(set(reqs))
 
+    index = _get_index(files=any([r.startswith('/') for r in reqs]))
+    if index:
+        providers = index.whatprovides(reqs)
+        return [elem for req in reqs for elem in providers[req]]
+
     # Apply resolution to each req individually (old yum repoquery allowed you
     # to specify multiple packages at once, but dnf repoquery only allows one
     # at a time).  Then concatenate all those lists of providers together
@@ -82,6 +259,10 @@ def resolve(reqs):
 
 def resolve_one(req):
     ''' Return the packages providing the req symbol. '''
+    index = _get_index(files=req.startswith('/'))
+    if index:
+        return list(index.whatprovides([req])[req])
+
     cmd = ['dnf', 'repoquery', '-C', '--whatprovides', req]
     Settings.get_logger().debug("Running: " + ' '.join(cmd))
 
@@ -108,27 +289,11 @@ def resolve_one(req):
 
 def list_dirs(pkg_filename):
     ''' Return list of directories in local pkg. '''
-
-    cmd = ['rpm', '-ql', '--dump', '-p', pkg_filename]
     try:
-        rpm = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    except OSError:
-        Settings.get_logger().warning("Cannot run " + " ".join(cmd))
+        return list(HeaderCache.get(pkg_filename).dirs)
+    except (OSError, rpm.error):
+        Settings.get_logger().warning("Cannot read " + pkg_filename)
         return []
-    dirs = []
-    while True:
-        try:
-            line = rpm.stdout.next().strip()
-        except StopIteration:
-            return dirs
-        try:
-            path, mode = line.rsplit(None, 10)[0:5:4]
-        except ValueError:
-            # E. g., when given '(contains no files)'
-            continue
-        mode = int(mode, 8)
-        if mode & 040000:
-            dirs.append(path)
 
 
 def list_owners(paths):
@@ -155,6 +320,11 @@ def list_owners(paths):
             continue
         paths_to_exam.remove(paths[i])
         owners.extend(path_owners)
+    index = _get_index(files=True)
+    if index and paths_to_exam:
+        for path_owners in index.file_owners(paths_to_exam).itervalues():
+            owners.extend(list(path_owners))
+        return owners
     for path in paths_to_exam:
         cmd = ['dnf', 'repoquery', '-C', '--quiet', '--file', path]
         Settings.get_logger().debug("Running: " + ' '.join(cmd))
@@ -172,6 +342,61 @@ def list_owners(paths):
     return owners
 
 
+def _repo_owners(paths):
+    '''
+    Return dict of lists of repo packages owning each path without
+    the repo index: a single dnf repoquery --file for all paths, and
+    a file listing of each owner found to map owners to paths.
+    '''
+    owners = dict([(p, []) for p in paths])
+    cmd = ['dnf', 'repoquery', '-C', '--quiet', '--file'] + list(paths)
+    Settings.get_logger().debug("Running: dnf repoquery -C --quiet --file"
+                                " (%d paths)" % len(paths))
+    try:
+        lines = check_output(cmd).split()
+    except (subprocess.CalledProcessError, OSError):
+        Settings.get_logger().error("Cannot run dnf repoquery --file")
+        return owners
+    lines = [l.rsplit('.', 2)[0] for l in lines if l.strip()]
+    names = set([l.rsplit('-', 2)[0] for l in lines])
+    by_path = {}
+    for path in paths:
+        by_path.setdefault(path.rstrip('/') or '/', []).append(path)
+    for name in names:
+        for owned in set(list_paths(name)):
+            for path in by_path.get(owned.rstrip('/') or '/', []):
+                owners[path].append(name)
+    return owners
+
+
+def list_owners_bulk(paths):
+    '''
+    Return dict of lists of packages owning each path. Installed owners
+    are looked up in a single rpmdb transaction, the remaining paths in
+    one query against the repo index, or if not available in one dnf
+    repoquery plus a file listing for each owner found.
+    '''
+    owners = {}
+    ts = rpm.TransactionSet()
+    for path in paths:
+        try:
+            hdrs = ts.dbMatch('basenames', path.rstrip('/') or '/')
+        except rpm.error:
+            hdrs = []
+        owners[path] = list(set([h['name'] for h in hdrs]))
+    ts.closeDB()
+    misses = [p for p in paths if not owners[p]]
+    if not misses:
+        return owners
+    index = _get_index(files=True)
+    if index:
+        for path, path_owners in index.file_owners(misses).iteritems():
+            owners[path] = list(path_owners)
+    else:
+        owners.update(_repo_owners(misses))
+    return owners
+
+
 def list_paths(pkgs):
     ''' Return list of all files in pkgs (single name or list). '''
     if not pkgs:
@@ -179,6 +404,10 @@ def list_paths(pkgs):
     if not isinstance(pkgs, list):
         pkgs = [pkgs]
 
+    index = _get_index(files=True)
+    if index:
+        return index.file_list(set(pkgs))
+
     cmd = ['dnf', 'repoquery', '-C', '-l']
     cmd.extend(list(set(pkgs)))
 
@@ -191,33 +420,72 @@ def list_paths(pkgs):
     return paths.split()
 
 
+def list_owned(paths, pkgs):
+    '''
+    Return the subset of paths owned by any of the named pkgs in the
+    repos. Only the given paths are looked up when the repo index is
+    available, instead of the complete file lists of all pkgs.
+    '''
+    paths = set(paths)
+    if not paths or not pkgs:
+        return set()
+    index = _get_index(files=True)
+    if index:
+        pkgs = set(pkgs)
+        owners = index.file_owners(list(paths))
+        return set([p for p in paths if owners[p] & pkgs])
+    return paths.intersection(list_paths(list(pkgs)))
+
+
+class DirOwnership(object):
+    '''
+    Hashed set of the paths in a package, answering which ancestor
+    directories of its files are not owned by the package itself. Each
+    directory is visited once, so queries are linear in the number of
+    paths.
+    '''
+
+    def __init__(self, paths):
+        self.paths = set(paths)
+
+    def _walk(self, owned):
+        '''
+        Return set of ancestors not in self.paths, stopping at the
+        first one in owned (if given) on each path to root.
+        '''
+        found = set()
+        seen = set()
+        for p in self.paths:
+            path = p.rsplit('/', 1)[0]  # We own leaf, for sure.
+            while path and path not in seen:
+                seen.add(path)
+                if path not in self.paths:
+                    if owned is not None and path in owned:
+                        break
+                    found.add(path)
+                path = path.rsplit('/', 1)[0]
+        return found
+
+    def candidates(self):
+        ''' Return all ancestor dirs not owned by the package. '''
+        return self._walk(None)
+
+    def unowned(self, owned):
+        '''
+        Return ancestor dirs not owned by the package nor in owned. Dirs
+        above a dir in owned are not considered on that path.
+        '''
+        return self._walk(set(owned))
+
+
 def listpaths(pkg_filename):
     ''' Return lists of files and dirs in local pkg. '''
-
-    cmd = ['rpm', '-ql', '--dump', '-p', pkg_filename]
-    Settings.get_logger().debug("Running: " + ' '.join(cmd))
     try:
-        rpm = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    except OSError:
-        Settings.get_logger().warning("Cannot run " + " ".join(cmd))
-        return []
-    files = []
-    dirs = []
-    while True:
-        try:
-            line = rpm.stdout.next().strip()
-        except StopIteration:
-            return dirs, files
-        try:
-            path, mode = line.rsplit(None, 10)[0:5:4]
-        except ValueError:
-            # E. g., when given '(contains no files)'
-            continue
-        mode = int(mode, 8)
-        if mode & 040000:
-            dirs.append(path)
-        else:
-            files.append(path)
+        header = HeaderCache.get(pkg_filename)
+    except (OSError, rpm.error):
+        Settings.get_logger().warning("Cannot read " + pkg_filename)
+        return [], []
+    return list(header.dirs), list(header.files)
 
 
 class Deps(object):
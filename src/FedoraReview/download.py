@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Resumable, conditional http(s) downloads over reused connections.
+'''
+
+import hashlib
+import httplib
+import json
+import os
+import os.path
+import socket
+import threading
+
+from urlparse import urljoin, urlsplit
+
+from settings import Settings
+from xdg_dirs import XdgDirs
+
+_BLOCKSIZE = 32768
+_MAX_REDIRECTS = 10
+_REDIRECTS = [301, 302, 303, 307, 308]
+_TIMEOUT = 30
+
+
+class HttpError(IOError):
+    ''' Failed http request, code is http status or None. '''
+
+    def __init__(self, code, url):
+        IOError.__init__(self, 'HTTP status %s: %s' % (str(code), url))
+        self.code = code
+
+
+class _Validators(object):
+    '''
+    ETag and Last-Modified headers for downloaded files, keyed by local
+    path and stored in the XDG cache dir. An entry is only valid while
+    the file keeps the recorded size and mtime (partial .part files are
+    checked against url only, since they are appended to).
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _path():
+        ''' Path to the storage file. '''
+        return os.path.join(XdgDirs.app_cachedir, 'http-validators.json')
+
+    def _load(self):
+        ''' Return stored validators as a dict. '''
+        try:
+            with open(self._path()) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def get(self, url, path, check_stat=True):
+        ''' Return validators dict for url stored at path, or None. '''
+        with self._lock:
+            entry = self._load().get(os.path.realpath(path))
+        if not entry or entry['url'] != url or not os.path.exists(path):
+            return None
+        if check_stat:
+            st = os.stat(path)
+            if [st.st_size, st.st_mtime] != [entry['size'], entry['mtime']]:
+                return None
+        return entry
+
+    def set(self, url, path, response):
+        '''
+        Store validators in response for url at path, or remove entry if
+        response is None or has no validators.
+        '''
+        key = os.path.realpath(path)
+        with self._lock:
+            data = self._load()
+            etag = response.getheader('etag') if response else None
+            modified = \
+                response.getheader('last-modified') if response else None
+            if etag or modified:
+                st = os.stat(path)
+                data[key] = {'url': url, 'etag': etag,
+                             'last_modified': modified,
+                             'size': st.st_size, 'mtime': st.st_mtime}
+            elif key in data:
+                del data[key]
+            else:
+                return
+            tmp_path = '%s.%d-%d.tmp' % \
+                (self._path(), os.getpid(), threading.current_thread().ident)
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(data, f)
+                os.rename(tmp_path, self._path())
+            except (IOError, OSError):
+                Settings.get_logger().debug(
+                    'Cannot save http validators', exc_info=True)
+
+
+class _Fetcher(object):
+    '''
+    Downloads http(s) urls to files, reusing keep-alive connections
+    for each host. A partial download is kept in <path>.part and is
+    resumed using a Range request if the server supports it. An
+    existing file is revalidated using its stored ETag/Last-Modified
+    headers and not downloaded again if unchanged.
+    '''
+
+    def __init__(self):
+        self.log = Settings.get_logger()
+        self._lock = threading.Lock()
+        self._idle = {}
+        self.validators = _Validators()
+
+    @staticmethod
+    def _new_connection(scheme, netloc):
+        ''' Return a new, not yet connected connection to host. '''
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=_TIMEOUT)
+        return httplib.HTTPConnection(netloc, timeout=_TIMEOUT)
+
+    def _get_connection(self, scheme, netloc):
+        ''' Return (connection, True if reused) for scheme and host. '''
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+        return self._new_connection(scheme, netloc), False
+
+    def _release(self, scheme, netloc, conn, response, reuse):
+        ''' Return connection to pool if response is completely read. '''
+        if not reuse or response.will_close or not response.isclosed():
+            conn.close()
+            return
+        with self._lock:
+            self._idle.setdefault((scheme, netloc), []).append(conn)
+
+    def close(self):
+        ''' Close all idle connections. '''
+        with self._lock:
+            for conns in self._idle.itervalues():
+                for conn in conns:
+                    conn.close()
+            self._idle = {}
+
+    @staticmethod
+    def _send(conn, selector, headers):
+        ''' Send GET request on conn, return response. '''
+        conn.request('GET', selector, headers=headers)
+        return conn.getresponse()
+
+    def _request(self, url, headers):
+        '''
+        GET url following redirects. Return (response, release) where
+        release(reuse=True) gives the connection back to the pool after
+        reading response, or closes it.
+        '''
+        for i in range(_MAX_REDIRECTS):                # pylint: disable=W0612
+            parts = urlsplit(url)
+            if parts.scheme not in ['http', 'https']:
+                raise HttpError(None, url)
+            selector = parts.path if parts.path else '/'
+            if parts.query:
+                selector += '?' + parts.query
+            conn, reused = self._get_connection(parts.scheme, parts.netloc)
+            try:
+                response = self._send(conn, selector, headers)
+            except (httplib.HTTPException, socket.error) as err:
+                conn.close()
+                if not reused:
+                    raise HttpError(str(err), url)
+                # Server closed idle keep-alive connection, try again.
+                conn = self._new_connection(parts.scheme, parts.netloc)
+                try:
+                    response = self._send(conn, selector, headers)
+                except (httplib.HTTPException, socket.error) as err:
+                    conn.close()
+                    raise HttpError(str(err), url)
+
+            def release(reuse=True, conn=conn, response=response,
+                        parts=parts):
+                ''' Return connection to the pool or close it. '''
+                self._release(parts.scheme, parts.netloc,
+                              conn, response, reuse)
+
+            if response.status not in _REDIRECTS:
+                return response, release
+            location = response.getheader('location')
+            response.read()
+            release()
+            if not location:
+                raise HttpError(response.status, url)
+            url = urljoin(url, location)
+        raise HttpError('too many redirects', url)
+
+    def fetch(self, url, path, algorithm):
+        '''
+        Download url to path. Returns (downloaded, digest) where
+        downloaded is False if an existing path is still valid and
+        digest is the algorithm digest of the new file (None if not
+        downloaded). Raises IOError (possibly HttpError) on errors.
+        '''
+        part = path + '.part'
+        headers = {'Accept-Encoding': 'identity',
+                   'User-Agent': 'fedora-review'}
+        current = self.validators.get(url, path)
+        if current:
+            if current['etag']:
+                headers['If-None-Match'] = current['etag']
+            if current['last_modified']:
+                headers['If-Modified-Since'] = current['last_modified']
+        offset = 0
+        partial = self.validators.get(url, part, check_stat=False)
+        if partial:
+            offset = os.path.getsize(part)
+            headers['Range'] = 'bytes=%d-' % offset
+            headers['If-Range'] = \
+                partial['etag'] if partial['etag'] \
+                else partial['last_modified']
+
+        response, release = self._request(url, headers)
+        if response.status == 304:
+            response.read()
+            release()
+            self.log.debug('Not modified: ' + url)
+            return False, None
+        if response.status == 416 and offset:
+            response.read()
+            release()
+            os.unlink(part)
+            self.validators.set(url, part, None)
+            return self.fetch(url, path, algorithm)
+        if response.status not in [200, 206]:
+            response.read()
+            release()
+            raise HttpError(response.status, url)
+
+        ck = hashlib.new(algorithm)
+        if response.status == 206 and offset:
+            self.log.debug('Resuming %s at %d' % (url, offset))
+            with open(part, 'rb') as f:
+                for chunk in iter(lambda: f.read(_BLOCKSIZE), ''):
+                    ck.update(chunk)
+            mode = 'ab'
+        else:
+            mode = 'wb'
+        complete = False
+        try:
+            with open(part, mode) as f:
+                if mode == 'wb':
+                    self.validators.set(url, part, response)
+                while True:
+                    octets = response.read(_BLOCKSIZE)
+                    if not octets:
+                        break
+                    f.write(octets)
+                    ck.update(octets)
+            # A positive length means the server closed the connection
+            # before sending everything.
+            complete = not response.length
+        except httplib.HTTPException as err:
+            raise HttpError(str(err), url)
+        finally:
+            release(complete)
+        if not complete:
+            raise HttpError('incomplete read', url)
+        self.validators.set(url, part, None)
+        os.rename(part, path)
+        self.validators.set(url, path, response)
+        return True, ck.hexdigest()
+
+
+Fetcher = _Fetcher()
+
+# vim: set expandtab ts=4 sw=4:
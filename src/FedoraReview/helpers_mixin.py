@@ -20,15 +20,29 @@
 Tools for helping Fedora package reviewers
 '''
 
-import logging
+import os
 import os.path
 import re
 import urllib
 from subprocess import Popen, PIPE
+from urlparse import urlparse
 import hashlib
 
+from download import Fetcher
 from settings import Settings
+from review_dirs import ReviewDirs
 from review_error import ReviewError
+from source_cache import SourceCache
+
+
+# Digests computed while downloading, by (path, mtime, size, algorithm).
+_known_checksums = {}
+
+
+def _checksum_key(path, algorithm):
+    ''' Return _known_checksums key for current state of file at path. '''
+    st = os.stat(path)
+    return (os.path.realpath(path), st.st_mtime, st.st_size, algorithm)
 
 
 class DownloadError(ReviewError):
@@ -51,7 +65,7 @@ class HelpersMixin(object):
         ''' Run a command using using subprocess, return output. '''
         self.log.debug(header + ': ' + cmd)
         cmd = cmd.split(' ')
-        proc = Popen(cmd, stdout=PIPE, stderr=PIPE)
+        proc = Popen(cmd, stdout=PIPE, stderr=PIPE, cwd=ReviewDirs.root)
         output, error = '', 'undefined'
         try:
             output, error = proc.communicate()
@@ -63,25 +77,50 @@ class HelpersMixin(object):
     @staticmethod
     def _checksum(path):
         ''' get the checksum for a path using algorithm set by configuration
-        (default: md5)
+        (default: md5). Digests computed while downloading the file are
+        reused.
 
         :arg path: the path to get the the checksum for
         :return: checksum
         '''
+        key = _checksum_key(path, Settings.checksum)
+        if key in _known_checksums:
+            return _known_checksums[key]
         ck = hashlib.new(Settings.checksum)
         with open(path, 'rb') as f:
             for chunk in iter(lambda: f.read(8192), ''):
                 ck.update(chunk)
         return ck.hexdigest()
 
+    @staticmethod
+    def _remember_checksum(path, algorithm, digest):
+        ''' Record digest of file at path, reused by _checksum(). '''
+        _known_checksums[_checksum_key(path, algorithm)] = digest
+
     @staticmethod
     def urlretrieve(url, path):
-        ''' Similar to urllib.urlretrieve, raises DownloadError. '''
+        '''
+        Similar to urllib.urlretrieve, raises DownloadError. Returns
+        the Settings.checksum digest of the file, computed while
+        downloading. http(s) downloads are resumed if interrupted, and
+        an existing path is only downloaded again if changed upstream.
+        '''
+        if urlparse(url).scheme in ['http', 'https']:
+            try:
+                downloaded, digest = \
+                    Fetcher.fetch(url, path, Settings.checksum)
+            except IOError as err:
+                raise DownloadError(str(err), url)
+            if not downloaded:
+                return HelpersMixin._checksum(path)
+            HelpersMixin._remember_checksum(path, Settings.checksum, digest)
+            return digest
         try:
             # we need to timeout eventually if there are problems
             import socket
             socket.setdefaulttimeout(30)
 
+            ck = hashlib.new(Settings.checksum)
             istream = urllib.FancyURLopener().open(url)
             if istream.getcode() and istream.getcode() != 200:
                 raise DownloadError(istream.getcode(), url)
@@ -89,23 +128,42 @@ class HelpersMixin(object):
                 octets = istream.read(32767)
                 while octets != '':
                     ostream.write(octets)
+                    ck.update(octets)
                     octets = istream.read(32767)
         except IOError as err:
             raise DownloadError(str(err), url)
+        digest = ck.hexdigest()
+        HelpersMixin._remember_checksum(path, Settings.checksum, digest)
+        return digest
 
-    def _get_file(self, link, directory, logger=None):
-        ''' Download a file in link to directory. '''
+    def _get_file(self, link, directory, logger=None, shared_cache=False):
+        '''
+        Download a file in link to directory. If shared_cache is True,
+        the file is also looked up and stored in the SourceCache shared
+        by all reviews.
+        '''
         fname = link.rsplit('/', 1)[1]
         path = os.path.join(directory, fname)
         if os.path.exists(path) and Settings.cache:
             if logger:
                 logger(True)
-            logging.debug('Using cached source: ' + fname)
+            self.log.debug('Using cached source: ' + fname)
             return path
+        if shared_cache:
+            digest = SourceCache.get(link, path)
+            if digest:
+                if logger:
+                    logger(True)
+                self.log.debug('Using shared cache for: ' + link)
+                self._remember_checksum(path, 'sha256', digest)
+                return path
         self.log.debug("  --> %s : %s" % (directory, link))
         if logger:
             logger(False)
-        self.urlretrieve(link, path)
+        digest = self.urlretrieve(link, path)
+        if shared_cache:
+            SourceCache.put(link, path,
+                            digest if Settings.checksum == 'sha256' else None)
         return path
 
     @staticmethod
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Compare a new revision of spec and srpm with the previous one kept by
+--incremental, write the delta report.
+'''
+
+import difflib
+import os
+import os.path
+
+from helpers_mixin import HelpersMixin
+from review_dirs import ReviewDirs, SRPM_UNPACKED
+from settings import Settings
+
+DELTA_REPORT = 'review-delta.txt'
+
+
+def _list_files(topdir):
+    ''' Return set of paths relative to topdir for all files below it. '''
+    found = set()
+    for root, dirs, files in os.walk(topdir):    # pylint: disable=W0612
+        for f in files:
+            found.add(os.path.relpath(os.path.join(root, f), topdir))
+    return found
+
+
+class Delta(HelpersMixin):
+    '''
+    Differences between the previous revision of a bug's spec and
+    srpm, if any, and the current one.
+    '''
+
+    def __init__(self, bug):
+        HelpersMixin.__init__(self)
+        self.log = Settings.get_logger()
+        previous = bug.get_previous()
+        self.old_spec, self.old_srpm = previous if previous else (None, None)
+        self.new_spec = bug.spec_file
+        self.new_srpm = bug.srpm_file
+
+    is_available = property(lambda self: bool(self.old_srpm))
+
+    def srpm_changed(self):
+        ''' Return True unless old and new srpm have same content. '''
+        if not self.is_available:
+            return True
+        return self._checksum(self.old_srpm) != \
+            self._checksum(self.new_srpm)
+
+    def spec_diff(self):
+        ''' Return unified diff old -> new spec, a list of lines. '''
+        with open(self.old_spec) as f:
+            old_lines = f.readlines()
+        with open(self.new_spec) as f:
+            new_lines = f.readlines()
+        return list(difflib.unified_diff(
+            old_lines, new_lines,
+            os.path.basename(self.old_spec), os.path.basename(self.new_spec)))
+
+    def srpm_changes(self):
+        '''
+        Compare unpacked srpms, return (added, removed, modified)
+        sorted lists of paths relative to the srpm root.
+        '''
+        old_dir = os.path.join(ReviewDirs.previous, SRPM_UNPACKED)
+        new_dir = ReviewDirs.srpm_unpacked
+        old_files = _list_files(old_dir)
+        new_files = _list_files(new_dir)
+        modified = []
+        for path in old_files & new_files:
+            old_path = os.path.join(old_dir, path)
+            new_path = os.path.join(new_dir, path)
+            if os.path.getsize(old_path) != os.path.getsize(new_path) or \
+                    self._checksum(old_path) != self._checksum(new_path):
+                modified.append(path)
+        return (sorted(new_files - old_files),
+                sorted(old_files - new_files),
+                sorted(modified))
+
+    @staticmethod
+    def state_changes(checks, previous_states):
+        '''
+        Return list of (name, old state, new state) for checks which
+        changed state since previous run. States are 'pass', 'fail',
+        'pending', 'na' or None for checks not run.
+        '''
+        changes = []
+        names = set(previous_states.iterkeys())
+        names |= set([c.name for c in checks.checkdict.itervalues()
+                      if c.is_run])
+        for name in sorted(names):
+            check = checks.checkdict.get(name)
+            new = None
+            if check and check.is_run:
+                new = check.state if check.state else 'na'
+            old = previous_states.get(name)
+            if old != new:
+                changes.append((name, old, new))
+        return changes
+
+    def _write_changes(self, f):
+        ''' Write changed srpm files and spec diff to f. '''
+        added, removed, modified = self.srpm_changes()
+        for header, paths in [('Added files in srpm', added),
+                              ('Removed files in srpm', removed),
+                              ('Modified files in srpm', modified)]:
+            if paths:
+                f.write('\n%s:\n' % header)
+                for p in paths:
+                    f.write('    ' + p + '\n')
+        diff = self.spec_diff()
+        if diff:
+            f.write('\nSpec file changes:\n')
+            f.writelines(diff)
+
+    def write_report(self, checks, previous_states, path):
+        ''' Write the delta report to path. '''
+        with open(path, 'w') as f:
+            f.write('Delta review: %s -> %s\n' %
+                    (os.path.basename(self.old_srpm),
+                     os.path.basename(self.new_srpm)))
+            f.write('\nChanged checks:\n')
+            for name, old, new in self.state_changes(checks,
+                                                     previous_states):
+                f.write('    %s: %s -> %s\n' % (name, old, new))
+            if not self.srpm_changed():
+                f.write('\nThe srpm is unchanged.\n')
+            else:
+                self._write_changes(f)
+        self.log.debug('Wrote delta report: ' + path)
+
+
+# vim: set expandtab ts=4 sw=4:
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Built-in license detection, an alternative to licensecheck: find the
+license in the head and tail of each source file using a few combined
+regexes, in a pool of worker processes. Output lines and license names
+are as from licensecheck.
+'''
+
+import mmap
+import multiprocessing
+import os
+import os.path
+import re
+
+# Files checked, as by licensecheck's default --check and --ignore.
+_CHECK_RE = re.compile(r'\.(c(c|pp|xx)?|h(h|pp|xx)?|f(77|90)?|go|p(l|m)|xs'
+                       r'|sh|php|py(|x)|rb|java|js|vala|el|sc(i|e)|cs|pas'
+                       r'|inc|dtd|xsl|mod|m|tex|mli?|(c|l)?hs)$')
+_IGNORE_RE = re.compile(r'(^|/)(\.bzr|\.git|\.hg|\.svn|CVS|_darcs|\.pc'
+                        r'|debian)(/|$)|(^|/)(config\.(guess|sub)'
+                        r'|ltmain\.sh)$')
+
+_HEAD = 16384               # Bytes scanned at start of file...
+_TAIL = 5000                # ...and at the end.
+_CHUNKSIZE = 64             # Files handed to a worker at a time.
+
+# Comment markers and whitespace, replaced by a single space.
+_CLEAN_RE = re.compile(r'(?:[\s*#/;!%]|\bdnl\b|--|\bREM\b)+')
+
+# All license families, as named groups in a single regex. Alternatives
+# matching at the same position are tried in order, so LGPL and AGPL
+# come before GPL.
+_FAMILY_RE = re.compile(
+    '|'.join([
+        r'(?P<lgpl>(?:GNU )?(?:Lesser|Library) General Public License'
+        r'|\bLGPL\b)',
+        r'(?P<agpl>(?:GNU )?Affero General Public License|\bAGPL\b)',
+        r'(?P<gpl>GNU General Public License|General Public License'
+        r'|\bGPL\b)',
+        r'(?P<apache>Apache License)',
+        r'(?P<mpl>Mozilla Public License)',
+        r'(?P<epl>Eclipse Public License)',
+        r'(?P<cddl>Common Development and Distribution License)',
+        r'(?P<boost>Boost Software License)',
+        r'(?P<mit>Permission is hereby granted, free of charge, to any'
+        r' person obtaining a copy|\bMIT License\b)',
+        r'(?P<isc>Permission to use, copy, modify, and(?: or)? distribute'
+        r' this software for any purpose with or without fee is hereby'
+        r' granted)',
+        r'(?P<bsd>Redistribution and use in source and binary forms)',
+        r'(?P<zlib>This software is provided .as.is., without any express'
+        r' or implied warranty. In no event will the authors be held'
+        r' liable)',
+        r'(?P<perl>under the same terms as Perl itself)',
+        r'(?P<artistic>Artistic License)',
+        r'(?P<pd>(?:is|are|been|placed|put|released|dedicated)'
+        r' (?:in|into|to) the public domain)',
+        r'(?P<generated>(?:automatically generated|generated automatically'
+        r'|generated by|autogenerated)\b.{0,80}\bdo not (?:edit|modify))']),
+    re.IGNORECASE)
+
+# Version details following a license name.
+_VERSION_RE = re.compile(r'(?:version |\bv\.? ?|(?<=[a-z])-)'
+                         r'(?P<version>\d+(?:\.\d+)?)'
+                         r'|(?P<later>any later version|or[ -]later)',
+                         re.IGNORECASE)
+
+# Clauses telling BSD variants apart.
+_BSD_RE = re.compile(r'(?P<four>All advertising materials mentioning)'
+                     r'|(?P<three>Neither the name|endorse or promote)',
+                     re.IGNORECASE)
+
+_NAMES = {'lgpl': 'LGPL',
+          'agpl': 'AGPL',
+          'gpl': 'GPL',
+          'apache': 'Apache',
+          'mpl': 'MPL',
+          'epl': 'EPL',
+          'cddl': 'CDDL',
+          'boost': 'BSL',
+          'mit': 'MIT/X11 (BSD like)',
+          'isc': 'ISC',
+          'zlib': 'zlib/libpng',
+          'perl': 'Perl',
+          'artistic': 'Artistic',
+          'pd': 'Public domain',
+          'generated': 'GENERATED FILE'}
+
+_VERSIONED = ['lgpl', 'agpl', 'gpl', 'apache', 'mpl', 'epl', 'cddl']
+
+
+def is_checked(path):
+    ''' Return True if licensecheck -r checks path (a relative path). '''
+    return bool(_CHECK_RE.search(path)) and not _IGNORE_RE.search(path)
+
+
+def _read(path):
+    ''' Return head and tail of file at path, using mmap. '''
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return ''
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if size <= _HEAD + _TAIL:
+                return mm[:]
+            return mm[:_HEAD] + '\n' + mm[size - _TAIL:]
+        finally:
+            mm.close()
+
+
+def _version(family, text, pos):
+    ''' Return the version suffix for license family at pos in text. '''
+    version = None
+    later = False
+    for m in _VERSION_RE.finditer(text, pos, pos + 300):
+        if m.group('version') and not version:
+            version = m.group('version')
+        elif m.group('later'):
+            later = True
+    if not version:
+        return ''
+    if family == 'apache' and '.' not in version:
+        version += '.0'
+    elif family in ['gpl', 'lgpl', 'agpl'] and version.endswith('.0'):
+        version = version[:-2]
+    return ' (v%s%s)' % (version, ' or later' if later else '')
+
+
+def detect(text):
+    ''' Return license for text, as licensecheck would name it. '''
+    text = _CLEAN_RE.sub(' ', text)
+    families = []
+    names = {}
+    for m in _FAMILY_RE.finditer(text):
+        family = m.lastgroup
+        if family in names and names[family] != _NAMES.get(family):
+            continue
+        if family == 'bsd':
+            clauses = [c.lastgroup for c in _BSD_RE.finditer(text, m.end())]
+            if 'four' in clauses:
+                name = 'BSD (4 clause)'
+            elif 'three' in clauses:
+                name = 'BSD (3 clause)'
+            else:
+                name = 'BSD (2 clause)'
+        elif family in _VERSIONED:
+            name = _NAMES[family] + _version(family, text, m.end())
+        else:
+            name = _NAMES[family]
+        if family not in names:
+            families.append(family)
+        names[family] = name
+    if 'generated' in names:
+        return names['generated']
+    if not families:
+        return 'UNKNOWN'
+    return ' and/or '.join([names[f] for f in families])
+
+
+def _detect_file(path):
+    ''' Return (path, license) for file at path, license None if error. '''
+    try:
+        return path, detect(_read(path))
+    except (IOError, OSError, ValueError):
+        return path, None
+
+
+class LicenseDetector(object):
+    '''
+    Scan a source tree like licensecheck -r does, yielding the same
+    'path: license' lines. Files are checked by a pool of worker
+    processes, each regex pass covering all known licenses.
+    '''
+
+    def __init__(self, topdir):
+        self.topdir = os.path.normpath(topdir)
+
+    def _get_files(self):
+        '''
+        Return list of paths for all files licensecheck checks, skipping
+        unreadable and non-regular files e. g., fifos.
+        '''
+        paths = []
+        # pylint: disable=W0612
+        for root, dirs, files in os.walk(self.topdir):
+            for name in files:
+                path = os.path.join(root, name)
+                if is_checked(path) and os.path.isfile(path) and \
+                        os.access(path, os.R_OK):
+                    paths.append(path)
+        return paths
+
+    def scan(self):
+        ''' Generate 'path: license' lines for all files in topdir. '''
+        paths = self._get_files()
+        if not paths:
+            return
+        pool = multiprocessing.Pool(min(multiprocessing.cpu_count(),
+                                        len(paths)))
+        try:
+            for path, license_ in pool.imap_unordered(_detect_file,
+                                                      paths,
+                                                      _CHUNKSIZE):
+                if license_:
+                    yield '%s: %s\n' % (path, license_)
+            pool.close()
+        except:                                  # pylint: disable=W0702
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+
+# vim: set expandtab ts=4 sw=4:
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Run licensecheck -r on a source tree split in shards, scanned in place
+by a pool of licensecheck processes. Results are cached by file content,
+so files already scanned in another review are not scanned again.
+'''
+
+import json
+import multiprocessing
+import os
+import os.path
+import sys
+import threading
+
+from Queue import Queue, Empty
+from subprocess import Popen, PIPE, CalledProcessError
+
+from license_detect import is_checked
+from review_context import ContextThread
+from settings import Settings
+from tree_diff import hash_files
+from xdg_dirs import XdgDirs
+
+CACHE = 'licensecheck-cache.json'
+_SHARD_SIZE = 1000              # Files scanned by each licensecheck run.
+_MAX_ENTRIES = 500000           # Cache size triggering cleanup.
+
+
+def _cache_path():
+    ''' Path to the cached licensecheck results. '''
+    return os.path.join(XdgDirs.app_cachedir, CACHE)
+
+
+def _to_str(value):
+    ''' Undo the latin-1 decoding done by _save_cache(). '''
+    return value.encode('latin-1') if value is not None else None
+
+
+def _load_cache():
+    ''' Return dict of license (None if not checked) by cache key. '''
+    try:
+        with open(_cache_path()) as f:
+            cache = json.load(f)
+        return dict([(_to_str(k), _to_str(v)) for k, v in cache.iteritems()])
+    except (IOError, ValueError, AttributeError, UnicodeError):
+        return {}
+
+
+def _save_cache(cache):
+    '''
+    Write cache, ignoring errors. Strings are stored as latin-1 so
+    any file name can be round-tripped.
+    '''
+    tmp_path = '%s.%d' % (_cache_path(), os.getpid())
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(cache, f, encoding='latin-1')
+        os.rename(tmp_path, _cache_path())
+    except (IOError, OSError, TypeError, ValueError):
+        Settings.get_logger().debug('Cannot write license cache',
+                                    exc_info=True)
+
+
+def _dirs(relpath):
+    ''' Return the directories containing relpath, topdir ('') first. '''
+    parts = relpath.split('/')[:-1]
+    return ['/'.join(parts[:i]) for i in range(len(parts) + 1)]
+
+
+class LicenseScanner(object):
+    '''
+    Scan a source tree using licensecheck -r, yielding the same
+    'path: license' lines. Files not found in the cache are scanned
+    in place in shards of about _SHARD_SIZE files by a pool of
+    workers: directories small enough are scanned by licensecheck -r,
+    files directly in larger directories are passed by name if
+    licensecheck -r checks them (see license_detect.is_checked).
+    Since that decision depends on the file name, results are cached
+    by content digest and basename.
+    '''
+
+    def __init__(self, topdir):
+        self.topdir = os.path.normpath(topdir)
+        self.log = Settings.get_logger()
+
+    def _get_files(self):
+        '''
+        Return list of relative paths for all files in topdir, skipping
+        unreadable and non-regular files e. g., fifos.
+        '''
+        relpaths = []
+        # pylint: disable=W0612
+        for root, dirs, files in os.walk(self.topdir):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.isfile(path) and os.access(path, os.R_OK):
+                    relpaths.append(os.path.relpath(path, self.topdir))
+                else:
+                    self.log.debug('Not scanning for license: ' + path)
+        return relpaths
+
+    def _abspath(self, relpath):
+        ''' Return path to relpath (possibly '') in topdir. '''
+        return os.path.join(self.topdir, relpath) if relpath \
+            else self.topdir
+
+    def _run_shard(self, cmd, relpaths, done):
+        '''
+        Run licensecheck cmd, None if there is nothing to check.
+        Put (relpaths, dict of license by relpath) in done.
+        '''
+        if not cmd:
+            done.put((relpaths, {}))
+            return
+        proc = Popen(cmd, stdout=PIPE)
+        prefix = self.topdir + '/'
+        found = {}
+        for line in proc.stdout:
+            if not line.startswith(prefix) or ': ' not in line:
+                continue
+            relpath, license_ = line[len(prefix):].rsplit(': ', 1)
+            found[relpath] = license_.rstrip('\n')
+        if proc.wait() != 0:
+            raise CalledProcessError(proc.returncode, ' '.join(cmd[:2]))
+        done.put((relpaths, found))
+
+    def _start_workers(self, shards, done):
+        '''
+        Scan all (cmd, relpaths) in shards using a pool of
+        threads, each running licensecheck. Return the list where
+        errors are added.
+        '''
+        todo = list(shards)
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            ''' Scan shards until todo is empty or there's an error. '''
+            while True:
+                with lock:
+                    if not todo or errors:
+                        return
+                    cmd, relpaths = todo.pop(0)
+                try:
+                    self._run_shard(cmd, relpaths, done)
+                except Exception:                # pylint: disable=W0703
+                    with lock:
+                        errors.append(sys.exc_info())
+                    return
+
+        workers = min(multiprocessing.cpu_count(), len(todo))
+        threads = [ContextThread(target=worker) for i in range(workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        return errors
+
+    def _make_shards(self, relpaths, todo):
+        '''
+        Return [(cmd, relpaths)] scanning the todo paths, relpaths are
+        all files in topdir. Each todo path is scanned using
+        licensecheck -r on its topmost directory holding at most
+        _SHARD_SIZE files, these are combined up to _SHARD_SIZE files
+        per cmd. Paths directly in larger directories are passed to
+        licensecheck by name instead.
+        '''
+        counts = {}
+        for relpath in relpaths:
+            for dirname in _dirs(relpath):
+                counts[dirname] = counts.get(dirname, 0) + 1
+        todo_by_dir = {}
+        loose_by_dir = {}
+        for relpath in todo:
+            for dirname in _dirs(relpath):
+                if counts[dirname] <= _SHARD_SIZE:
+                    todo_by_dir.setdefault(dirname, []).append(relpath)
+                    break
+            else:
+                loose_by_dir.setdefault(os.path.dirname(relpath), []) \
+                    .append(relpath)
+        shards = []
+        dirs, size, shard = [], 0, []
+        for dirname in sorted(todo_by_dir):
+            if dirs and size + counts[dirname] > _SHARD_SIZE:
+                shards.append((['licensecheck', '-r'] + dirs, shard))
+                dirs, size, shard = [], 0, []
+            dirs.append(self._abspath(dirname))
+            size += counts[dirname]
+            shard.extend(todo_by_dir[dirname])
+        if dirs:
+            shards.append((['licensecheck', '-r'] + dirs, shard))
+        for dirname in sorted(loose_by_dir):
+            loose = loose_by_dir[dirname]
+            for start in range(0, len(loose), _SHARD_SIZE):
+                shard = loose[start:start + _SHARD_SIZE]
+                paths = [self._abspath(p) for p in shard if is_checked(p)]
+                shards.append((['licensecheck'] + paths if paths else None,
+                               shard))
+        return shards
+
+    def scan(self):
+        '''
+        Generate licensecheck output lines for all files in topdir,
+        cached results first, then as shards are scanned. Raises
+        OSError or CalledProcessError if licensecheck fails, IOError if
+        a file cannot be read.
+        '''
+        relpaths = self._get_files()
+        digests = hash_files([os.path.join(self.topdir, p)
+                              for p in relpaths])
+        cache = _load_cache()
+        keys = {}
+        todo = []
+        for relpath in relpaths:
+            path = os.path.join(self.topdir, relpath)
+            key = digests[path] + ':' + os.path.basename(relpath)
+            keys[relpath] = key
+            if key not in cache:
+                todo.append(relpath)
+            elif cache[key] is not None:
+                yield '%s: %s\n' % (path, cache[key])
+        self.log.debug('License cache: %d files found, %d to scan'
+                       % (len(relpaths) - len(todo), len(todo)))
+        if todo:
+            for line in self._scan_files(relpaths, todo, keys, cache):
+                yield line
+        if len(cache) > _MAX_ENTRIES:
+            used = set(keys.itervalues())
+            cache = dict([(k, v) for k, v in cache.iteritems() if k in used])
+        _save_cache(cache)
+
+    def _scan_files(self, relpaths, todo, keys, cache):
+        ''' Scan todo paths using licensecheck, update cache. '''
+        shards = self._make_shards(relpaths, todo)
+        done = Queue()
+        errors = self._start_workers(shards, done)
+        for i in range(len(shards)):                 # pylint: disable=W0612
+            item = None
+            while not item:
+                if errors:
+                    raise errors[0][0], errors[0][1], errors[0][2]
+                try:
+                    item = done.get(True, 1)
+                except Empty:
+                    pass
+            shard, found = item
+            for relpath in shard:
+                cache[keys[relpath]] = found.get(relpath)
+                if relpath in found:
+                    yield '%s: %s\n' % (os.path.join(self.topdir, relpath),
+                                        found[relpath])
+
+
+# vim: set expandtab ts=4 sw=4:
@@ -20,11 +20,16 @@
 Tools for helping Fedora package reviewers
 '''
 
+import atexit
+import json
 import logging
 import os
 import os.path
 import re
 import shlex
+import threading
+import uuid
+import weakref
 
 from glob import glob
 from subprocess import call, Popen, PIPE, STDOUT, CalledProcessError
@@ -35,23 +40,20 @@ except ImportError:
     from FedoraReview.el_compat import check_output
 
 from helpers_mixin import HelpersMixin
+from review_context import ContextProxy
 from review_dirs import ReviewDirs
 from settings import Settings
 from review_error import ReviewError
+from xdg_dirs import XdgDirs
 
 
-_RPMLINT_SCRIPT = " mock  @config@ --chroot " \
-    """ "echo 'rpmlint:'; rpmlint @rpm_names@; echo 'rpmlint-done:'" """
+_MACRO_CACHE = 'mock-macros.json'
 
+# Macro files from rpm and redhat-rpm-config, relative to chroot.
+_MACRO_FILES = ['usr/lib/rpm/macros', 'usr/lib/rpm/redhat/macros']
 
-def _run_script(script):
-    """ Run a script,  return (ok, output). """
-    try:
-        p = Popen(script, stdout=PIPE, stderr=STDOUT, shell=True)
-        output, error = p.communicate()
-    except OSError as e:
-        return False, e.strerror + ' stderr: ' + error
-    return True, output
+_RPMLINT_SCRIPT = \
+    "echo 'rpmlint:'; rpmlint @rpm_names@; echo 'rpmlint-done:'"
 
 
 def _get_tag(paths):
@@ -110,10 +112,107 @@ def _add_buildarch_macros(macros, paths):
     return buildarch, macros
 
 
+class _ShellSession(object):
+    """
+    A long-lived 'mock --shell' process running commands in the chroot.
+    Each request is a shell script written on stdin, followed by an
+    echo of a unique marker and the exit code. The response is all
+    output up to this marker. The session holds the mock buildroot lock,
+    so it must be closed before running any other mock command.
+    """
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.log = Settings.get_logger()
+        self._proc = None
+        self._marker = '@fedora-review-' + uuid.uuid4().hex + '@'
+        self._lock = threading.Lock()
+
+    is_alive = property(lambda self: bool(self._proc) and
+                        self._proc.poll() is None)
+
+    def _read_reply(self):
+        """ Read output up to marker, return (exitcode, output). """
+        lines = []
+        while True:
+            line = self._proc.stdout.readline()
+            if not line:
+                raise IOError('mock shell session: unexpected EOF')
+            if line.startswith(self._marker):
+                output = ''.join(lines)
+                return int(line.split()[1]), output[:-1]
+            lines.append(line)
+
+    def _send(self, script):
+        """ Run script in session, return (exitcode, output). """
+        self._proc.stdin.write(script + ' </dev/null\n')
+        self._proc.stdin.write("printf '\\n%s %%d\\n' $?\n" % self._marker)
+        self._proc.stdin.flush()
+        return self._read_reply()
+
+    def start(self):
+        """ Start the mock shell, return True if usable. """
+        self.log.debug('Starting mock shell session: ' + ' '.join(self.cmd))
+        try:
+            with open(os.devnull, 'w') as devnull:
+                self._proc = Popen(self.cmd, stdin=PIPE, stdout=PIPE,
+                                   stderr=devnull)
+            self._send('true')
+        except (OSError, IOError, ValueError):
+            self.log.debug('Cannot start mock shell session', exc_info=True)
+            self.close()
+            return False
+        return True
+
+    def run(self, script):
+        """
+        Run script in the chroot, return (exitcode, output) or None
+        if the session is dead.
+        """
+        with self._lock:
+            if not self.is_alive:
+                return None
+            try:
+                return self._send(script)
+            except (OSError, IOError, ValueError):
+                self.log.debug('mock shell session died', exc_info=True)
+                self.close()
+                return None
+
+    def close(self):
+        """ Terminate the session, if running. """
+        if not self._proc:
+            return
+        proc = self._proc
+        self._proc = None
+        try:
+            if proc.poll() is None:
+                proc.stdin.write('exit\n')
+                proc.stdin.close()
+            proc.wait()
+        except (OSError, IOError):
+            pass
+        self.log.debug('Closed mock shell session')
+
+
+_LIVE_MOCKS = weakref.WeakSet()
+
+
+def _end_sessions():
+    ''' Close the shell sessions of all live _Mock instances. '''
+    for mock in list(_LIVE_MOCKS):
+        mock._end_session()                      # pylint: disable=W0212
+
+
+atexit.register(_end_sessions)
+
+
 class _Mock(HelpersMixin):
     """ Some basic operations on the mock chroot env, a singleton. """
     # pylint: disable=R0904
 
+    available = None      # Cached is_available() result.
+
     def __init__(self):
         HelpersMixin.__init__(self)
         self.log = Settings.get_logger()
@@ -122,16 +221,16 @@ class _Mock(HelpersMixin):
         self._rpmlint_output = None
         self._topdir = None
         self._macros = None
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._chroot_lock = threading.RLock()
+        _LIVE_MOCKS.add(self)
 
     def _get_default_macros(self):
-        ''' Evaluate macros using rpm in mock. '''
-        tags = '%dist %fedora %epel %buildarch %_libdir %_isa %arch'
-        macros = {}
-        values = self._rpm_eval(tags).split()
-        taglist = tags.split()
-        for i in range(0, len(taglist)):
-            macros[taglist[i]] = values[i]
-        return macros
+        ''' Evaluate macros using rpm in mock, all SpecFile needs. '''
+        tags = '%dist %rhel %fedora %epel %buildarch %_build_arch' \
+               ' %_arch %_libdir %_isa %arch'
+        return self.eval_macros(tags.split())
 
     def _get_prebuilt_macros(self, spec, flags):
         ''' Evaluate macros based on prebuilt packages (#208).'''
@@ -150,14 +249,73 @@ class _Mock(HelpersMixin):
             raise ReviewError("Can't build x86_64 on i86 host")
         return macros
 
-    def _get_root(self):
-        ''' Return mock's root according to Settings. '''
+    @staticmethod
+    def _get_config_path():
+        ''' Return path to mock configuration file according to Settings. '''
         config = 'default'
         if Settings.mock_config:
             config = Settings.mock_config
         mockdir = Settings.configdir if Settings.configdir \
             else '/etc/mock'
-        path = os.path.join(mockdir, config + '.cfg')
+        return os.path.join(mockdir, config + '.cfg')
+
+    def get_config_stamp(self):
+        '''
+        Return list identifying the mock config and the rpm setup in
+        its chroot: config file realpath and mtime, and mtimes of the
+        rpm and redhat-rpm-config macro files in the chroot. Missing
+        files are stamped None.
+        '''
+        path = os.path.realpath(self._get_config_path())
+        if not os.path.exists(path):
+            return [path, None]
+        stamp = [path, os.path.getmtime(path)]
+        if not self.mock_root:
+            self._get_root()
+        rootdir = os.path.join('/var/lib/mock', self.mock_root, 'root')
+        for macro_file in _MACRO_FILES:
+            path = os.path.join(rootdir, macro_file)
+            stamp.append(os.path.getmtime(path)
+                         if os.path.exists(path) else None)
+        return stamp
+
+    def _get_cached_macros(self):
+        """
+        Return (cache, key) where cache is the on-disk macro cache as a
+        dict and cache[key]['macros'] holds macros for current mock
+        config, cleared unless cache[key]['stamp'] matches
+        get_config_stamp() i. e., when the config or the macro files
+        in the chroot have changed. key is None if there is no usable
+        config file.
+        """
+        stamp = self.get_config_stamp()
+        if stamp[1] is None:
+            return {}, None
+        try:
+            with open(os.path.join(XdgDirs.app_cachedir, _MACRO_CACHE)) as f:
+                cache = json.load(f)
+        except (IOError, ValueError):
+            cache = {}
+        path = stamp[0]
+        entry = cache.get(path)
+        if not isinstance(entry, dict) or entry.get('stamp') != stamp:
+            cache[path] = {'stamp': stamp, 'macros': {}}
+        return cache, path
+
+    def _save_cached_macros(self, cache):
+        ''' Write the macro cache to disk, ignoring errors. '''
+        path = os.path.join(XdgDirs.app_cachedir, _MACRO_CACHE)
+        tmp_path = '%s.%d' % (path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(cache, f)
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            self.log.debug('Cannot write macro cache ' + path, exc_info=True)
+
+    def _get_root(self):
+        ''' Return mock's root according to Settings. '''
+        path = self._get_config_path()
 
         config_opts = {}
         with open(path) as f:
@@ -188,8 +346,9 @@ class _Mock(HelpersMixin):
     def _get_rpmlint_output(self):
         ''' Return output from last rpmlint, list of lines. '''
         if not self._rpmlint_output:
-            if os.path.exists('rpmlint.txt'):
-                with open('rpmlint.txt') as f:
+            path = os.path.join(ReviewDirs.root, 'rpmlint.txt')
+            if os.path.exists(path):
+                with open(path) as f:
                     self._rpmlint_output = f.readlines()
         return self._rpmlint_output
 
@@ -201,6 +360,47 @@ class _Mock(HelpersMixin):
         cmd.extend(shlex.split(self.get_mock_options()))
         return cmd
 
+    def _end_session(self):
+        ''' Close the shell session, releasing the buildroot lock. '''
+        if self._session:
+            self._session.close()
+            self._session = None
+
+    def _run_in_chroot(self, script, stderr=True):
+        """
+        Run shell script in chroot, return (exitcode, output). Uses the
+        persistent mock shell session if possible, else a one-shot
+        'mock --chroot' command. If stderr is False, stderr is discarded
+        instead of being merged into output. Raises OSError if mock
+        cannot be run. Commands from different threads are serialized.
+        """
+        with self._chroot_lock:
+            return self._run_script(script, stderr)
+
+    def _run_script(self, script, stderr):
+        ''' _run_in_chroot() body, called with _chroot_lock held. '''
+        script = '{ ' + script + '\n} '
+        script += '2>&1' if stderr else '2>/dev/null'
+        with self._session_lock:
+            if self._session is None:
+                session = _ShellSession(self._mock_cmd() + ['-q', '--shell'])
+                self._session = session if session.start() else False
+            session = self._session
+        reply = session.run(script) if session else None
+        if reply is not None:
+            return reply
+        if session:
+            self.log.info('Mock shell session died, running commands'
+                          ' using mock --chroot')
+            self._session = False
+        cmd = self._mock_cmd()
+        cmd.extend(['-q', '--chroot', '--', script])
+        self.log.debug('Chroot command: ' + ' '.join(cmd))
+        with open(os.devnull, 'w') as devnull:
+            p = Popen(cmd, stdout=PIPE, stderr=devnull)
+            output = p.communicate()[0]
+        return p.returncode, output
+
     def _run_cmd(self, cmd, header='Mock'):
 
         def log_text(out, err):
@@ -209,26 +409,27 @@ class _Mock(HelpersMixin):
 
         header = header if header else ""
         self.log.debug(header + ' command: ' + ', '.join(cmd))
-        try:
-            p = Popen(cmd, stdout=PIPE, stderr=STDOUT)
-            output, error = p.communicate()
-            logging.debug(log_text(output, error), exc_info=True)
-        except OSError:
-            logging.error("Command failed", exc_info=True)
-            return "Command utterly failed. See logs for details"
+        with self._chroot_lock:
+            self._end_session()
+            try:
+                p = Popen(cmd, stdout=PIPE, stderr=STDOUT,
+                          cwd=ReviewDirs.root)
+                output, error = p.communicate()
+                self.log.debug(log_text(output, error), exc_info=True)
+            except OSError:
+                self.log.error("Command failed", exc_info=True)
+                return "Command utterly failed. See logs for details"
         if p.returncode != 0 and header:
-            logging.info(header + " command returned error code %i",
-                         p.returncode)
+            self.log.info(header + " command returned error code %i",
+                          p.returncode)
         return None if p.returncode == 0 else str(output)
 
     def _get_topdir(self):
         ''' Update _topdir to reflect %_topdir in current mock config. '''
         if self._topdir:
             return
-        cmd = self._mock_cmd()
-        cmd.extend(['-q', '--chroot', '--', 'rpm --eval %_topdir'])
         try:
-            self._topdir = check_output(cmd).strip()
+            self._topdir = self._rpm_eval('%_topdir')
             self.log.debug("_topdir: " + str(self._topdir))
         except (CalledProcessError, OSError):
             self.log.info("Cannot evaluate %topdir in mock, using"
@@ -251,9 +452,11 @@ class _Mock(HelpersMixin):
 
     def _rpm_eval(self, arg):
         ''' Run rpm --eval <arg> inside mock, return output. '''
-        cmd = self._mock_cmd()
-        cmd.extend(['--quiet', '--chroot', '--', 'rpm --eval "' + arg + '"'])
-        return check_output(cmd).decode('utf-8').strip()
+        script = 'rpm --eval "' + arg + '"'
+        rc, output = self._run_in_chroot(script, stderr=False)
+        if rc != 0:
+            raise CalledProcessError(rc, script, output)
+        return output.decode('utf-8').strip()
 
 # Last (cached?) output from rpmlint, list of lines.
     rpmlint_output = property(_get_rpmlint_output)
@@ -273,8 +476,14 @@ class _Mock(HelpersMixin):
 
     def reset(self):
         """ Clear all persistent state. """
+        self._end_session()
+        self._session = None
         if self.mock_root:
             self.mock_root = None
+        self._rpmlint_output = None
+        self._topdir = None
+        self._macros = None
+        self.build_failed = None
 
     def get_resultdir(self):                     # pylint: disable=R0201
         ''' Return resultdir used by mock. '''
@@ -339,15 +548,59 @@ class _Mock(HelpersMixin):
         p = self._get_dir(os.path.join('root', self._topdir[1:]))
         return os.path.join(p, subdir) if subdir else p
 
-    def get_macro(self, macro, spec, flags):
-        ''' Return value of one of the system-defined rpm macros. '''
+    def eval_macros(self, macros):
+        """
+        Evaluate a list of macros using a single rpm --eval in mock,
+        return dict of expanded values by macro. Undefined macros are
+        returned as-is. Values are cached on disk, keyed by the mock
+        config file and valid while it and the rpm macro files in the
+        chroot are unchanged (see get_config_stamp()), so the chroot is
+        only entered for macros not seen before using the same setup.
+        """
+        macros = [m if m.startswith('%') else '%' + m for m in macros]
+        cache, key = self._get_cached_macros()
+        cached = cache[key]['macros'] if key else {}
+        missing = [m for m in macros if m not in cached]
+        if missing:
+            script = 'rpm ' + ' '.join(["--eval '" + m + "'" for m in missing])
+            rc, output = self._run_in_chroot(script, stderr=False)
+            if rc != 0:
+                raise CalledProcessError(rc, script, output)
+            output = output.decode('utf-8')
+            if output.endswith('\n'):
+                output = output[:-1]
+            values = output.split('\n')
+            if len(values) != len(missing):
+                self.log.warning('Cannot evaluate macros in mock: '
+                                 + ', '.join(missing))
+                return dict([(m, cached.get(m, m).encode('utf-8'))
+                             for m in macros])
+            for macro, value in zip(missing, values):
+                cached[macro] = value.strip()
+            if key:
+                # Stamp again, entering the chroot might have created it.
+                cache[key] = {'stamp': self.get_config_stamp(),
+                              'macros': cached}
+                self._save_cached_macros(cache)
+        return dict([(m, cached[m].encode('utf-8')) for m in macros])
+
+    def get_macros(self, macros, spec, flags):
+        ''' Return dict of values for a list of system-defined macros. '''
         if not self._macros:
             if Settings.prebuilt:
                 self._macros = self._get_prebuilt_macros(spec, flags)
             else:
                 self._macros = self._get_default_macros()
-        key = macro if macro.startswith('%') else '%' + macro
-        return self._macros[key] if key in self._macros else macro
+        keys = [m if m.startswith('%') else '%' + m for m in macros]
+        missing = [k for k in keys if k not in self._macros]
+        if missing and not Settings.prebuilt:
+            self._macros.update(self.eval_macros(missing))
+        return dict([(m, self._macros.get(k, m))
+                     for m, k in zip(macros, keys)])
+
+    def get_macro(self, macro, spec, flags):
+        ''' Return value of one of the system-defined rpm macros. '''
+        return self.get_macros([macro], spec, flags)[macro]
 
     @staticmethod
     def get_mock_options():
@@ -364,31 +617,33 @@ class _Mock(HelpersMixin):
 
     def clear_builddir(self):
         ''' Remove all sources installed in BUILD. '''
-        cmd = self._mock_cmd()
-        cmd += ['--chroot', '--']
-        cmd.append('rm -rf $(rpm --eval %_builddir)/*')
-        errmsg = self._run_cmd(cmd)
-        if errmsg:
-            self.log.debug('Cannot clear build area: ' + errmsg +
+        try:
+            rc, output = \
+                self._run_in_chroot('rm -rf $(rpm --eval %_builddir)/*')
+        except OSError as err:
+            rc, output = -1, str(err)
+        if rc != 0:
+            self.log.debug('Cannot clear build area: ' + output +
                            ' (ignored)')
         return None
 
     @staticmethod
     def is_available():
-        ''' Test if mock command is installed and usable. '''
-        try:
-            check_output(['mock', '--version'])
-            return True
-        except (CalledProcessError, OSError):
-            return False
+        ''' Test if mock command is installed and usable, once. '''
+        if _Mock.available is None:
+            try:
+                check_output(['mock', '--version'])
+                _Mock.available = True
+            except (CalledProcessError, OSError):
+                _Mock.available = False
+        return _Mock.available
 
     def is_installed(self, package):
         ''' Return true iff package is installed in mock chroot. '''
-        cmd = self._mock_cmd()
-        cmd += ('--chroot', '--')
-        cmd.append('"rpm -q ' + package + '" &>/dev/null')
-        cmd = ' '.join(cmd)
-        rc = call(cmd, shell=True)
+        try:
+            rc = self._run_in_chroot('rpm -q ' + package + ' >/dev/null')[0]
+        except OSError:
+            rc = -1
         self.log.debug('is_installed: Tested ' + package +
                        ', result: ' + str(rc))
         return rc == 0
@@ -404,18 +659,21 @@ class _Mock(HelpersMixin):
         if errmsg:
             self.log.warning("Cannot run mock --copyin: " + errmsg)
             return errmsg
-        cmd = self._mock_cmd()
-        cmd += ['--chroot', '--']
         script = 'rpm -i ' + os.path.basename(srpm.filename) + '; '
         script += 'rpmbuild --nodeps -bp $(rpm --eval %_specdir)/' \
                   + srpm.name + '.spec;'
         script += 'chmod -R  go+r  $(rpm --eval %_builddir)/* || :'
-        cmd.append(script)
-        errmsg = self._run_cmd(cmd)
-        if errmsg:
+        self.log.debug('Chroot script: ' + script)
+        try:
+            rc, output = self._run_in_chroot(script)
+        except OSError:
+            self.log.error("Command failed", exc_info=True)
+            rc, output = -1, "Command utterly failed. See logs for details"
+        self.log.debug('rpmbuild -bp output: ' + output)
+        if rc != 0:
             self.log.warning("Cannot run mock --chroot rpmbuild -bp: "
-                             + errmsg)
-            return errmsg
+                             + output)
+            return output
         return None
 
     def build(self, filename):
@@ -424,7 +682,6 @@ class _Mock(HelpersMixin):
         Raises ReviewError on build errors, return
         nothing.
         """
-        self.clear_builddir()
         mock_cmd = ['"' + s + '"' for s in self._mock_cmd()]
         cmd = ' '.join(mock_cmd)
         if Settings.log_level > logging.INFO:
@@ -434,11 +691,14 @@ class _Mock(HelpersMixin):
         if not Settings.verbose and ' -q' not in cmd:
             cmd += ' | egrep "Results and/or logs|ERROR" '
         self.log.debug('Build command: %s' % cmd)
-        rc = call(cmd, shell=True)
+        with self._chroot_lock:
+            self.clear_builddir()
+            self._end_session()
+            rc = call(cmd, shell=True, cwd=ReviewDirs.root)
         self.builddir_cleanup()
         rc = str(rc)
         try:
-            with open('build.log') as f:
+            with open(os.path.join(ReviewDirs.root, 'build.log')) as f:
                 log = '\n'.join(f.readlines())
                 if 'ERROR' in log:
                     rc = 'Build error(s)'
@@ -488,6 +748,16 @@ class _Mock(HelpersMixin):
         cmd.extend(rpms)
         return self._run_cmd(cmd, 'Install')
 
+    def install_builddeps(self, srpm_path):
+        """
+        Install the BuildRequires of srpm in the chroot using
+        'mock --installdeps', return None if OK, else the output.
+        """
+        self._clear_rpm_db()
+        cmd = self._mock_cmd()
+        cmd.extend(['--installdeps', srpm_path])
+        return self._run_cmd(cmd, 'Installdeps')
+
     def init(self, force=False):
         """ Run a mock --init command. """
         if not force:
@@ -533,20 +803,15 @@ class _Mock(HelpersMixin):
         if error:
             return False, error
 
-        script = _RPMLINT_SCRIPT
         basenames = [os.path.basename(r) for r in rpms]
         names = [r.rsplit('-', 2)[0] for r in basenames]
         rpm_names = ' '.join(list(set(names)))
-
-        config = ''
-        if Settings.mock_config:
-            config = '-r ' + Settings.mock_config
-        script = script.replace('@config@', config)
-        script = script.replace('@rpm_names@', rpm_names)
-        ok, output = _run_script(script)
+        script = _RPMLINT_SCRIPT.replace('@rpm_names@', rpm_names)
+        try:
+            output = self._run_in_chroot(script)[1]
+        except OSError as e:
+            return False, e.strerror + '\n'
         self.log.debug("Script output: " + output)
-        if not ok:
-            return False, output + '\n'
         ok, err_msg = self.check_rpmlint_errors(output, self.log)
         if err_msg:
             return False, err_msg
@@ -569,6 +834,6 @@ class _Mock(HelpersMixin):
                 os.unlink(p)
 
 
-Mock = _Mock()
+Mock = ContextProxy('mock', _Mock())
 
 # vim: set expandtab ts=4 sw=4:
@@ -67,11 +67,17 @@ class AbstractRegistry(object):
     or 'generic'. The group property reflects that group, and the
     is_applicable method returns if a given test is valid for current
     srpm.
+
+    file_patterns: dict of lists of glob patterns or compiled regexes
+    keyed by data source ('rpms', 'sources' or 'buildsrc'), declared
+    up front and matched in a single pass over each data source. Get
+    matching files using checks.<source>.get_matches(pattern).
     """
     # pylint: disable=R0201,W0613
 
     group = 'Undefined'
     external_plugin = False
+    file_patterns = {}
     version = __version__
     build_id = BUILD_ID
 
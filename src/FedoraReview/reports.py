@@ -66,9 +66,14 @@ Legend:
 """
 
 
+def _get_topdir():
+    ' Return review directory, or startdir if not yet created. '
+    return ReviewDirs.root if ReviewDirs.is_inited else ReviewDirs.startdir
+
+
 def _get_specfile():
     ' Return a (specfile, sha224sum) tuple. '
-    spec = glob('srpm-unpacked/*.spec')
+    spec = glob(os.path.join(_get_topdir(), 'srpm-unpacked', '*.spec'))
     if len(spec) != 1:
         return '?', '?'
     path = spec[0].strip()
@@ -203,5 +208,5 @@ def write_xml_report(spec, results):
             root = add_xml_result(root, result)
     dom = xml.dom.minidom.parseString(ET.tostring(root))
     prettyxml = dom.toprettyxml(indent='    ', encoding='utf-8')
-    with open('report.xml', 'w') as f:
+    with open(os.path.join(_get_topdir(), 'report.xml'), 'w') as f:
         f.write(prettyxml)
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Results of earlier runs, replayed for checks with unchanged inputs.
+'''
+
+import hashlib
+import json
+import os
+import os.path
+import threading
+import time
+
+import deps
+from helpers_mixin import HelpersMixin
+from mock import Mock
+from review_context import ContextProxy
+from review_dirs import ReviewDirs
+from review_error import ReviewError
+from settings import Settings
+from version import __version__
+from xdg_dirs import XdgDirs
+
+_ALL_DATA = ['spec', 'srpm', 'sources', 'rpms', 'buildsrc']
+
+# Stored results not used for this long are removed, seconds.
+_MAX_AGE = 30 * 24 * 3600
+
+
+def _utf8(value):
+    ''' Return unicode value from json as utf-8 str, else as-is. '''
+    return value.encode('utf-8') if isinstance(value, unicode) else value
+
+
+class _ResultCache(HelpersMixin):
+    '''
+    Check results from earlier runs, one file per review directory in
+    the XDG cache dir. Entries are keyed by check name, check and plugin
+    version and digests of the data the check uses as declared in
+    needs_data. The key also covers the mock config and the rpm macros
+    in its chroot (the spec is parsed using these), and for checks
+    using all data (needs_data None, e. g. checks querying deps) the
+    dnf repo metadata. Active when using --cache (or --no-build) and
+    --incremental: a check whose key is unchanged since last run is
+    not run, its result and attachments are replayed instead.
+
+    The state of all checks is also saved, previous_states is the
+    dict of states by check name from the last run.
+    '''
+
+    def __init__(self):
+        HelpersMixin.__init__(self)
+        self.log = Settings.get_logger()
+        self._lock = threading.Lock()
+        self._entries = None
+        self._states = {}
+        self._replay = False
+        self._digests = {}
+        self._replayed = 0
+        self.previous_states = {}
+
+    @staticmethod
+    def _path():
+        ''' Path to the storage file for current review directory. '''
+        topdir = os.path.join(XdgDirs.app_cachedir, 'check-results')
+        if not os.path.exists(topdir):
+            os.makedirs(topdir)
+        name = hashlib.sha1(ReviewDirs.root).hexdigest() + '.json'
+        return os.path.join(topdir, name)
+
+    def _evict(self):
+        ''' Remove stored results not updated in _MAX_AGE seconds. '''
+        topdir = os.path.dirname(self._path())
+        for name in os.listdir(topdir):
+            path = os.path.join(topdir, name)
+            try:
+                if time.time() - os.path.getmtime(path) > _MAX_AGE:
+                    os.unlink(path)
+            except OSError:
+                self.log.debug('Cannot remove ' + path, exc_info=True)
+
+    def _file_digest(self, path):
+        ''' Checksum of file at path or None if not existing. '''
+        if not path or not os.path.exists(path):
+            return None
+        return self._checksum(path)
+
+    def _compute_digests(self, checks, data):
+        '''
+        Return list of digests for data, a needs_data item or one of
+        'chroot' (mock config and macros) and 'repos' (repo metadata).
+        '''
+        if data == 'spec':
+            return [self._file_digest(checks.spec.filename)]
+        elif data == 'srpm':
+            return [self._file_digest(checks.srpm.filename)]
+        elif data == 'sources':
+            digests = []
+            for tag in sorted(checks.sources.get_all()):
+                source = checks.sources.get(tag)
+                path = getattr(source, 'filename', None)
+                digests.append([tag, source.url, source.downloaded,
+                                self._file_digest(path)])
+            return digests
+        elif data == 'rpms':
+            paths = Mock.get_package_rpm_paths(checks.spec)
+            return [self._file_digest(p) for p in sorted(paths)]
+        elif data == 'buildsrc':
+            return [self._file_digest(checks.srpm.filename),
+                    getattr(Settings, 'mock_config', None),
+                    getattr(Settings, 'mock_options', None)]
+        elif data == 'chroot':
+            return [Mock.get_config_stamp(),
+                    getattr(Settings, 'mock_options', None)]
+        elif data == 'repos':
+            return deps.metadata_stamp()
+        raise ValueError('Unknown data: ' + data)
+
+    def _get_digests(self, checks, data):
+        ''' Return list of digests for data, computed once per run. '''
+        with self._lock:
+            if data not in self._digests:
+                self._digests[data] = self._compute_digests(checks, data)
+            return self._digests[data]
+
+    def _get_key(self, check):
+        '''
+        Return key for check's current inputs, or None if it cannot
+        be computed e. g., when built packages are missing.
+        '''
+        checks = check.checks
+        flags = sorted([(f.name, str(f)) for f in checks.flags.itervalues()])
+        registry = check.registry
+        key = [check.name, check.version, __version__,
+               getattr(registry, 'version', None),
+               getattr(registry, 'build_id', None),
+               self._file_digest(check.defined_in), flags]
+        if check.needs_data is not None:
+            data = ['chroot'] + check.needs_data
+        else:
+            data = ['chroot', 'repos'] + _ALL_DATA
+        try:
+            for name in sorted(data):
+                key.append(self._get_digests(checks, name))
+            return hashlib.sha1(json.dumps(key)).hexdigest()
+        except (ReviewError, IOError, OSError, UnicodeDecodeError):
+            self.log.debug('No cache key for ' + check.name, exc_info=True)
+            return None
+
+    @staticmethod
+    def _replay_entry(check, entry):
+        ''' Restore check's result from entry. '''
+        check.text = _utf8(entry['text'])
+        check.type = _utf8(entry['type'])
+        attachments = [check.Attachment(_utf8(a[0]), _utf8(a[1]), a[2])
+                       for a in entry['attachments']]
+        check.set_passed(_utf8(entry['state']),
+                         _utf8(entry['output_extra']),
+                         attachments)
+
+    def _store(self, check, key):
+        ''' Save check's result using key. '''
+        result = check.result
+        entry = {'key': key,
+                 'text': check.text,
+                 'type': check.type,
+                 'state': result.result if result else None,
+                 'output_extra': result.output_extra if result else None,
+                 'attachments': [[a.header, a.text, a.order_hint]
+                                  for a in check.attachments]}
+        try:
+            json.dumps(entry)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            self.log.debug('Cannot cache result for ' + check.name)
+            return
+        with self._lock:
+            self._entries[check.name] = entry
+
+    def load(self):
+        ''' Start a new run, reading stored results. '''
+        self._digests = {}
+        self._replayed = 0
+        self._states = {}
+        if not ReviewDirs.is_inited:
+            self._entries = None
+            self.previous_states = {}
+            return
+        self._replay = bool(Settings.cache or Settings.incremental)
+        try:
+            with open(self._path()) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            data = {}
+        self._entries = data.get('entries', {})
+        self.previous_states = data.get('states', {})
+
+    def save(self):
+        ''' Write results from current run. '''
+        if self._entries is None:
+            return
+        self.log.debug('Replayed %d cached check results' % self._replayed)
+        tmp_path = self._path() + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'entries': self._entries,
+                           'states': self._states}, f)
+            os.rename(tmp_path, self._path())
+            self._evict()
+        except (IOError, OSError):
+            self.log.debug('Cannot save check results', exc_info=True)
+
+    def _run(self, check):
+        ''' Run check or replay its result, see run(). '''
+        if not self._replay:
+            check.run()
+            return
+        if not getattr(check, 'cacheable', False):
+            check.run()
+            # E. g., a build might have changed the rpms.
+            with self._lock:
+                self._digests = {}
+            return
+        key = self._get_key(check)
+        entry = self._entries.get(check.name)
+        if key and entry and entry['key'] == key:
+            self.log.debug('Replaying cached result: ' + check.name)
+            self._replay_entry(check, entry)
+            with self._lock:
+                self._replayed += 1
+            return
+        check.run()
+        if key and check.is_run:
+            self._store(check, key)
+
+    def run(self, check):
+        '''
+        Run check, or replay its stored result if inputs are unchanged.
+        '''
+        if self._entries is None:
+            check.run()
+            return
+        self._run(check)
+        if check.is_run:
+            with self._lock:
+                self._states[check.name] = \
+                    check.state if check.state else 'na'
+
+
+ResultCache = ContextProxy('result_cache', _ResultCache())
+
+# vim: set expandtab ts=4 sw=4:
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Client side of --daemon: submit a review request over the daemon's Unix
+socket and stream back the output. Only uses the standard library, so
+it starts fast.
+
+The request is a json line with argv, cwd and environment. The reply
+is the review's console output followed by exit_trailer(): a newline,
+always added, and a line EXIT_MARKER <code>. The marker thus starts a
+line even if the output doesn't end with a newline, and the client
+drops the last newline before it.
+'''
+
+import json
+import os
+import os.path
+import socket
+import sys
+
+from xdg_dirs import XdgDirs
+
+SOCKET_NAME = 'fedora-review.sock'
+EXIT_MARKER = '@fedora-review-exit@'
+
+
+def socket_path(path=None):
+    ''' Return path, or the default daemon socket path if None. '''
+    if path:
+        return os.path.abspath(path)
+    return os.path.join(XdgDirs.runtimedir, SOCKET_NAME)
+
+
+def make_request(argv):
+    ''' Return the request line for fedora-review options argv. '''
+    env = dict([(k, v) for k, v in os.environ.iteritems()
+                if k.startswith('REVIEW_')])
+    return json.dumps({'argv': argv,
+                       'cwd': os.getcwd(),
+                       'env': env}) + '\n'
+
+
+def exit_trailer(rcode):
+    ''' Return data sent after the output, ending a reply. '''
+    return '\n%s %d\n' % (EXIT_MARKER, rcode)
+
+
+def stream_reply(f, out):
+    '''
+    Copy the reply in file f to out until the exit marker, return the
+    exit code. The newline ending each line is held back until next
+    line is read, so the one added by exit_trailer() is dropped.
+    '''
+    newline = False
+    for line in iter(f.readline, ''):
+        if newline and line.startswith(EXIT_MARKER):
+            return int(line.split()[1])
+        if newline:
+            out.write('\n')
+        newline = line.endswith('\n')
+        out.write(line[:-1] if newline else line)
+        out.flush()
+    if newline:
+        out.write('\n')
+    out.write('Connection to fedora-review daemon lost\n')
+    return 1
+
+
+def main(argv):
+    '''
+    Run a review in the daemon using argv, without program name. An
+    initial --socket <path> selects the socket. Return exit code.
+    '''
+    path = None
+    if len(argv) > 1 and argv[0] == '--socket':
+        path = argv[1]
+        argv = argv[2:]
+    path = socket_path(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error as err:
+        sys.stderr.write('Cannot connect to fedora-review daemon at %s: %s\n'
+                         % (path, err))
+        return 2
+    try:
+        sock.sendall(make_request(argv))
+        return stream_reply(sock.makefile('rb'), sys.stdout)
+    finally:
+        sock.close()
+
+
+# vim: set expandtab ts=4 sw=4:
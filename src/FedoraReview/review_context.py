@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Per-review state, making it possible to run several reviews one after
+another in one process, each using its own settings, directories, mock
+and logger.
+'''
+
+import itertools
+import threading
+
+from contextlib import contextmanager
+
+from review_error import ReviewError
+
+_local = threading.local()
+_active_lock = threading.Lock()
+_active = None                  # The ReviewContext active in any thread...
+_active_count = 0               # ...and its number of activations.
+_serial = itertools.count(1)
+
+
+def get_context():
+    ''' Return the ReviewContext active in current thread, or None. '''
+    return getattr(_local, 'context', None)
+
+
+class ContextProxy(object):
+    '''
+    A module-level singleton such as Settings or ReviewDirs. Attributes
+    are looked up in the instance owned by the ReviewContext active in
+    current thread, or in the default instance if there is none.
+    '''
+
+    def __init__(self, attr, default):
+        object.__setattr__(self, '_attr', attr)
+        object.__setattr__(self, '_default', default)
+
+    @property
+    def target(self):
+        ''' The instance currently proxied. '''
+        context = get_context()
+        if context:
+            return getattr(context, self._attr)
+        return self._default
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.target, name, value)
+
+    def __delattr__(self, name):
+        delattr(self.target, name)
+
+
+class ContextThread(threading.Thread):
+    '''
+    A thread running in the ReviewContext active when it was created,
+    used for all threads started on behalf of a review.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        threading.Thread.__init__(self, *args, **kwargs)
+        self.context = get_context()
+
+    def run(self):
+        if not self.context:
+            threading.Thread.run(self)
+            return
+        with self.context.activate():
+            threading.Thread.run(self)
+
+
+class ReviewContext(object):
+    '''
+    State for one review: settings, review directories, mock and
+    the check result cache, plus the logger. Within activate() the
+    Settings, ReviewDirs, Mock and ResultCache singletons refer to this
+    context's instances, also in ContextThreads started from there.
+    Checks, sources and plugins thus see only their own review, and all
+    paths are absolute i. e., independent of the current directory.
+
+    A new context starts with a copy of the current settings and an
+    uninitiated review directory using startdir (defaults to current
+    startdir). Its logger writes to the session log and to stderr as
+    it was when the context was created.
+
+    The rpm macro context can't be shared, so only one context can be
+    active at a time in a process. It can be active in any number of
+    ContextThreads. The macros are reset to rpm's defaults the first
+    time a context is activated.
+    '''
+
+    class BusyError(ReviewError):
+        ''' Another ReviewContext is active in this process. '''
+        def __init__(self):
+            ReviewError.__init__(self, 'Another review is running in this'
+                                 ' process')
+
+    def __init__(self, startdir=None):
+        from mock import _Mock
+        from result_cache import _ResultCache
+        from review_dirs import ReviewDirs
+        from settings import Settings
+
+        self.settings = Settings.target.clone()
+        self.settings.use_own_logger('fedora-review.%d' % next(_serial))
+        self.dirs = ReviewDirs.target.__class__()
+        self.dirs.reset(startdir if startdir else ReviewDirs.startdir)
+        self.mock = _Mock()
+        self.mock.log = self.settings.get_logger()
+        self.result_cache = _ResultCache()
+        self._macros_reset = False
+
+    log = property(lambda self: self.settings.get_logger())
+
+    def _reset_macros(self):
+        ''' Drop macros defined by previous reviews, once. '''
+        import rpm
+
+        if not self._macros_reset:
+            rpm.reloadConfig()
+            self._macros_reset = True
+
+    @contextmanager
+    def activate(self):
+        '''
+        Make this the current context while in the with block. Raises
+        BusyError if another context is active.
+        '''
+        global _active, _active_count            # pylint: disable=W0603
+        with _active_lock:
+            if _active is not None and _active is not self:
+                raise self.BusyError()
+            _active = self
+            _active_count += 1
+        previous = get_context()
+        _local.context = self
+        try:
+            self._reset_macros()
+            yield self
+        finally:
+            _local.context = previous
+            with _active_lock:
+                _active_count -= 1
+                if _active_count == 0:
+                    _active = None
+
+
+# vim: set expandtab ts=4 sw=4:
@@ -22,14 +22,14 @@
 Tools for helping Fedora package reviewers
 '''
 
-import logging
 import os
 import os.path
 import shutil
 import tempfile
 
-from review_error import ReviewError
-from settings     import Settings
+from review_context import ContextProxy
+from review_error   import ReviewError
+from settings       import Settings
 
 SRPM              = 'srpm'
 SRPM_UNPACKED     = 'srpm-unpacked'
@@ -37,6 +37,7 @@ UPSTREAM          = 'upstream'
 UPSTREAM_UNPACKED = 'upstream-unpacked'
 RESULTS           = 'results'
 DEPENDENCIES      = 'dependencies'
+PREVIOUS          = 'previous'
 
 
 class _ReviewDirs(object):
@@ -66,70 +67,107 @@ class _ReviewDirs(object):
 
     def __init__(self):
         self.startdir = os.getcwd()
+        self._topdir = None
         self.wdir = None
 
-    def reset(self, startdir=None):
-        ''' Clear persistent state (test tool). '''
+    def reset(self, startdir=None, topdir=None):
+        '''
+        Clear persistent state. startdir is where local files are
+        looked for, topdir where the review directory is created
+        (defaults to startdir).
+        '''
         self.wdir = None
+        self._topdir = topdir
         if startdir:
             self.startdir = startdir
 
-    @staticmethod
-    def report_path():
+    def report_path(self):
         ''' Return path for report. '''
-        return os.path.abspath('./review.txt')
+        return os.path.join(self.wdir, 'review.txt')
+
+    @staticmethod
+    def _keep_previous(wd, cache):
+        """
+        Move spec, srpm and report of the previous revision in wd to
+        the PREVIOUS dir in cache (--incremental).
+        """
+        previous = os.path.join(cache, PREVIOUS)
+        os.mkdir(previous)
+        for d in [SRPM, SRPM_UNPACKED]:
+            shutil.move(os.path.join(cache, d), previous)
+        if os.path.exists(os.path.join(wd, 'review.txt')):
+            shutil.move(os.path.join(wd, 'review.txt'), previous)
+
+    def retire_results(self):
+        '''
+        Move the results dir of the previous revision to PREVIOUS,
+        leaving an empty one for the new build (--incremental).
+        '''
+        if not os.path.exists(self.previous):
+            os.mkdir(self.previous)
+        old = os.path.join(self.previous, RESULTS)
+        if os.path.exists(old):
+            shutil.rmtree(old)
+        shutil.move(self.results, old)
+        os.mkdir(self.results)
 
     def _create_and_copy_wd(self, wd, reuse_old):
         ''' Create wd, possibly filled with cached data. '''
         if os.path.exists(wd) and not reuse_old:
-            if Settings.cache:
-                cache = tempfile.mkdtemp(dir='.')
+            keep = Settings.cache or Settings.incremental
+            if keep:
+                cache = tempfile.mkdtemp(dir=os.path.dirname(wd))
                 for d in self.WD_DIRS:
                     shutil.move(os.path.join(wd, d), cache)
                 try:
                     buildlink = os.readlink(os.path.join(wd, 'BUILD'))
                 except OSError:
                     buildlink = None
-            logging.info("Clearing old review directory: " + wd)
+                if Settings.incremental:
+                    self._keep_previous(wd, cache)
+            Settings.get_logger().info("Clearing old review directory: "
+                                       + wd)
             shutil.rmtree(wd)
             os.mkdir(wd)
-            if Settings.cache:
-                for d in self.WD_DIRS:
-                    shutil.move(os.path.join(cache, d), wd)
+            if keep:
+                for d in self.WD_DIRS + [PREVIOUS]:
+                    if os.path.exists(os.path.join(cache, d)):
+                        shutil.move(os.path.join(cache, d), wd)
                 if buildlink:
-                    oldwd = os.getcwd()
-                    os.chdir(wd)
-                    os.symlink(buildlink, 'BUILD')
-                    os.chdir(oldwd)
+                    os.symlink(buildlink, os.path.join(wd, 'BUILD'))
                 shutil.rmtree(cache)
         if not os.path.exists(wd):
             os.mkdir(wd)
 
     def workdir_setup(self, wd, reuse_old=False):
-        ''' Initiate a new review directory, or re-use an old one. '''
-        reuse = reuse_old or Settings.cache
+        '''
+        Initiate a new review directory, or re-use an old one. A
+        relative wd is relative to topdir.
+        '''
+        reuse = reuse_old or Settings.cache or Settings.incremental
+        wd = os.path.normpath(os.path.join(self.topdir, wd))
         if not reuse and os.path.exists(wd):
-            d = ''.join(wd.split(os.getcwd(), 1))
-            raise self.ReviewDirExistsError(d)
-        wd = os.path.abspath(wd)
+            raise self.ReviewDirExistsError(wd)
         if self.wdir:
             if self.wdir != wd and not reuse_old:
                 raise self.ReviewDirChangeError('Old dir ' + self.wdir +
                                                 ' new dir: ' + wd)
         self._create_and_copy_wd(wd, reuse_old)
-        os.chdir(wd)
-        logging.info("Using review directory: " + wd)
+        Settings.get_logger().info("Using review directory: " + wd)
         self.wdir = wd
         for d in self.WD_DIRS:
-            if not os.path.exists(d):
-                os.mkdir(d)
+            if not os.path.exists(os.path.join(wd, d)):
+                os.mkdir(os.path.join(wd, d))
 
     is_inited = property(lambda self: bool(self.wdir))
+    topdir = property(lambda self:
+                      self._topdir if self._topdir else self.startdir)
     root = property(lambda self: self.wdir)
 
     srpm = property(lambda self: os.path.join(self.wdir, SRPM))
     srpm_unpacked = property(lambda self: os.path.join(self.wdir,
                                                        SRPM_UNPACKED))
+    previous = property(lambda self: os.path.join(self.wdir, PREVIOUS))
     upstream = property(lambda self: os.path.join(self.wdir, UPSTREAM))
     upstream_unpacked = property(lambda self:
                                  os.path.join(self.wdir, UPSTREAM_UNPACKED))
@@ -145,6 +183,7 @@ class _ReviewDirsFixture(_ReviewDirs):
         ''' Setup.... '''
         self.wdir = None
         self.startdir = None
+        self._topdir = None
 
     def init(self, workdir, startdir):
         '''
@@ -176,15 +215,15 @@ class _ReviewDirsFixture(_ReviewDirs):
         if reuse == 'testing':
             self.init(wd, os.getcwd())
 
-    def reset(self, startdir=None):
+    def reset(self, startdir=None, topdir=None):
         ''' Ignored while testing. '''
         pass
 
 
 try:
     import test_env   # pylint: disable=W0611,F0401
-    ReviewDirs = _ReviewDirsFixture()
+    ReviewDirs = ContextProxy('dirs', _ReviewDirsFixture())
 except ImportError:
-    ReviewDirs = _ReviewDirs()
+    ReviewDirs = ContextProxy('dirs', _ReviewDirs())
 
 # vim: set expandtab ts=4 sw=4:
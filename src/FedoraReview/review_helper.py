@@ -27,13 +27,21 @@ import os.path
 import sys
 import time
 
+from glob import glob
+
+from batch import BatchReview
 from bugzilla_bug import BugzillaBug
 from check_base import SimpleTestResult
-from checks import Checks, ChecksLister
+from check_manifest import CheckManifest
+from checks import Checks
+from daemon import ReviewDaemon
+from incremental import Delta, DELTA_REPORT
 from mock import Mock
 from name_bug import NameBug
+from review_context import ContextThread
 from review_dirs import ReviewDirs
 from review_error import ReviewError, SpecParseReviewError
+from result_cache import ResultCache
 from settings import Settings
 from url_bug import UrlBug
 from version import __version__, BUILD_FULL
@@ -56,21 +64,87 @@ class _Nvr(object):
         self.release = release
 
 
+def _init_mock():
+    '''
+    Init the mock chroot and evaluate the macros SpecFile needs, so
+    parsing the spec does not wait for the chroot while build
+    dependencies are installed.
+    '''
+    Mock.init()
+    if not Settings.prebuilt:
+        Mock.get_macros([], None, None)
+
+
+def _reuses_build():
+    ''' Return True if CheckBuild will reuse rpms in resultdir. '''
+    if Settings.prebuilt:
+        return True
+    if not Settings.nobuild:
+        return False
+    rpms = glob(os.path.join(Mock.resultdir, '*.rpm'))
+    return bool([p for p in rpms if not p.endswith('.src.rpm')])
+
+
+class _Stage(ContextThread):
+    """
+    A startup stage running func(*args) in the background, so that
+    e. g. mock chroot setup can overlap with downloads. wait() logs
+    the elapsed time and re-raises any exception from func.
+    """
+
+    def __init__(self, name, func, *args):
+        ContextThread.__init__(self, name=name, target=self._run)
+        self.daemon = True
+        self.func = func
+        self.args = args
+        self.result = None
+        self.elapsed = None
+        self._exc_info = None
+        self.start()
+
+    def _run(self):
+        ''' Run func, saving result or exception. '''
+        # pylint: disable=bare-except
+        clock = time.time()
+        try:
+            self.result = self.func(*self.args)
+        except:
+            self._exc_info = sys.exc_info()
+        self.elapsed = time.time() - clock
+
+    def wait(self):
+        ''' Wait for stage to complete, return func's result. '''
+        clock = time.time()
+        self.join()
+        Settings.get_logger().debug(
+            "%s completed: %.3f (waited %.3f)"
+            % (self.name, self.elapsed, time.time() - clock))
+        if self._exc_info:
+            exc_info = self._exc_info
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return self.result
+
+
 class ReviewHelper(object):
-    ''' Make most of the actual work doing the review. '''
+    '''
+    Make most of the actual work doing the review. If given, the review
+    runs in context, a ReviewContext, else using the global state.
+    '''
 
     class HelperError(ReviewError):
         ''' Error while processing bug. '''
         def __init__(self, msg):
             ReviewError.__init__(self, msg)
 
-    def __init__(self):
+    def __init__(self, context=None):
+        self.context = context
         self.bug = None
         self.checks = None
         self.log = Settings.get_logger()
         self.verbose = False
         self.outfile = None
         self.prebuilt = False
+        self.delta = None
 
     def _do_report(self, outfile=None):
         ''' Create a review report'''
@@ -88,24 +162,60 @@ class ReviewHelper(object):
         if not ReviewDirs.is_inited:
             wd = self.bug.get_dirname()
             ReviewDirs.workdir_setup(wd)
+        mock_init = None
         if Mock.is_available():
-            Mock.init()
+            mock_init = _Stage('Mock init', _init_mock)
 
         if not self.bug.download_files():
             raise self.HelperError('Cannot download .spec and .srpm')
         self.log.debug("Url download completed: %.3f" % (time.time() - clock))
+        if Settings.incremental:
+            self._setup_delta()
 
-        Settings.name = self.bug.get_name()
-        self._run_checks(self.bug.spec_file, self.bug.srpm_file, outfile)
+        builddeps = None
+        if mock_init:
+            mock_init.wait()
+            if not _reuses_build():
+                builddeps = _Stage('BuildRequires install',
+                                   Mock.install_builddeps,
+                                   self.bug.srpm_file)
 
-    def _run_checks(self, spec, srpm, outfile=None):
-        ''' Register and run all checks. '''
+        Settings.name = self.bug.get_name()
+        self._run_checks(self.bug.spec_file, self.bug.srpm_file, outfile,
+                         builddeps)
+
+    def _setup_delta(self):
+        ''' Compare with previous revision, reuse build if possible. '''
+        self.delta = Delta(self.bug)
+        if not self.delta.is_available:
+            self.log.info('No previous revision found, doing full review')
+            self.delta = None
+        elif not self.delta.srpm_changed():
+            self.log.info('srpm unchanged, reusing previous build')
+            Settings.nobuild = True
+            return
+        if not Settings.resultdir:
+            ReviewDirs.retire_results()
+
+    def _run_checks(self, spec, srpm, outfile=None, builddeps=None):
+        """
+        Register and run all checks. builddeps is an optional _Stage
+        installing build dependencies while sources are downloaded.
+        """
 
         def apply_color(s, formatter):
             ''' Return s formatted by formatter or plain s. '''
             return formatter(s) if Settings.use_colors else s
 
+        clock = time.time()
         self.checks = Checks(spec, srpm)
+        self.log.debug("Spec, srpm and sources setup completed: %.3f"
+                       % (time.time() - clock))
+        if builddeps:
+            error = builddeps.wait()
+            if error:
+                self.log.warning('Cannot install build dependencies: '
+                                 + error)
         if outfile:
             self.outfile = outfile
         elif Settings.no_report:
@@ -116,6 +226,12 @@ class ReviewHelper(object):
             self.log.info('Running checks and generating report')
             self.checks.run_checks(output=output,
                                    writedown=not Settings.no_report)
+        if self.delta:
+            path = os.path.join(ReviewDirs.root, DELTA_REPORT)
+            self.delta.write_report(self.checks,
+                                    ResultCache.previous_states, path)
+            print apply_color("Changes since previous revision in: "
+                              + path, ansi.green)
         if not Settings.no_report:
             print apply_color("Review template in: " + self.outfile,
                               ansi.green)
@@ -124,14 +240,14 @@ class ReviewHelper(object):
     @staticmethod
     def _list_flags():
         ''' List all flags in simple, user-friendly format. '''
-        checks_lister = ChecksLister()
+        checks_lister = CheckManifest()
         for flag in checks_lister.flags.itervalues():
             print flag.name + ': ' + flag.doc
 
     @staticmethod
     def _list_plugins():
         ''' --display-plugins implementation. '''
-        checks_lister = ChecksLister()
+        checks_lister = CheckManifest()
         plugins = checks_lister.get_plugins()
         print ', '.join(plugins)
 
@@ -164,7 +280,7 @@ class ReviewHelper(object):
                         print '    %s: %s' % (c.name, c.text)
                 print
 
-        checks_lister = ChecksLister()
+        checks_lister = CheckManifest()
         checks_list = list(checks_lister.get_checks().itervalues())
         files = list(set([c.defined_in for c in checks_list]))
         list_data_by_file(files, checks_list)
@@ -189,17 +305,25 @@ class ReviewHelper(object):
         # pylint: disable=superfluous-parens
         print('fedora-review version ' + __version__ + ' ' + BUILD_FULL)
         print('external plugins:')
-        checks_lister = ChecksLister()
+        checks_lister = CheckManifest()
         for registry in checks_lister.groups.itervalues():
             if registry.external_plugin:
                 print "{r.group} version {r.version} {r.build_id}".format(
                     r=registry)
 
     def _do_run(self, outfile=None):
-        ''' Initiate, download url:s, run checks a write report. '''
+        '''
+        Initiate, download url:s, run checks a write report. Return
+        exit code from --batch or --daemon, else None.
+        '''
         Settings.init()
         make_report = True
-        if Settings.list_checks:
+        if Settings.batch:
+            self.log.info("Processing batch file: " + Settings.batch)
+            return BatchReview(Settings.batch).run()
+        elif Settings.daemon:
+            return ReviewDaemon(Settings.socket).run()
+        elif Settings.list_checks:
             self._list_checks()
             make_report = False
         elif Settings.list_flags:
@@ -224,17 +348,26 @@ class ReviewHelper(object):
             if not Mock.is_available() and not Settings.prebuilt:
                 raise ReviewError("Mock unavailable, --prebuilt must be used.")
             self._do_report(outfile)
+        return None
 
     def run(self, outfile=None):
         ''' Load urls, run checks and make report, '''
+        if not self.context:
+            return self._run(outfile)
+        with self.context.activate():
+            return self._run(outfile)
+
+    def _run(self, outfile):
+        ''' run() body, called with context activated. '''
         # pylint: disable=bare-except
         started_at = time.time()
         self.log.debug('fedora-review ' + __version__ + ' ' +
                        BUILD_FULL + ' started')
         self.log.debug("Command  line: " + ' '.join(sys.argv))
         try:
-            rcode = 0
-            self._do_run(outfile)
+            rcode = self._do_run(outfile)
+            if rcode is None:
+                rcode = 0
         except ReviewError as err:
             if isinstance(err, SpecParseReviewError):
                 nvr = _Nvr(self.bug.get_name())
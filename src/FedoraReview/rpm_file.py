@@ -20,12 +20,79 @@ Binary rpm file management.
 '''
 
 import os
+import stat
+import threading
+
 import rpm
 
 from mock import Mock
 from settings import Settings
 
 
+class RpmHeader(object):
+    '''
+    A parsed rpm header, with file attributes precomputed as lists
+    indexed like filenames.
+    '''
+
+    def __init__(self, header):
+        self.header = header
+        self.filenames = header[rpm.RPMTAG_FILENAMES]
+        self.filesizes = header[rpm.RPMTAG_FILESIZES]
+        self.filemodes = [m & 0xffff for m in header[rpm.RPMTAG_FILEMODES]]
+        self.filedigests = header[rpm.RPMTAG_FILEDIGESTS]
+        self.fileflags = header[rpm.RPMTAG_FILEFLAGS]
+
+        def flagged(flag):
+            ''' Return list of files with flag set. '''
+            return [f for f, fl in zip(self.filenames, self.fileflags)
+                    if fl & flag]
+
+        self.doc_files = flagged(rpm.RPMFILE_DOC)
+        # RPMFILE_LICENSE is missing in EPEL5/EPEL6 rpm.
+        self.license_files = flagged(getattr(rpm, 'RPMFILE_LICENSE', 0))
+        self.config_files = flagged(rpm.RPMFILE_CONFIG)
+        self.dirs = [f for f, m in zip(self.filenames, self.filemodes)
+                     if stat.S_ISDIR(m)]
+        self.files = [f for f, m in zip(self.filenames, self.filemodes)
+                      if not stat.S_ISDIR(m)]
+
+
+class _HeaderCache(object):
+    '''
+    Parsed rpm headers keyed by path, mtime and size, so each rpm is
+    read once and shared by all RpmFile instances and checks.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._headers = {}
+
+    def get(self, path):
+        ''' Return RpmHeader for rpm file at path. '''
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        key = (path, st.st_mtime, st.st_size)
+        with self._lock:
+            if key in self._headers:
+                return self._headers[key]
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            header = RpmHeader(rpm.TransactionSet().hdrFromFdno(fd))
+        finally:
+            os.close(fd)
+        with self._lock:
+            return self._headers.setdefault(key, header)
+
+    def clear(self):
+        ''' Drop all cached headers. '''
+        with self._lock:
+            self._headers = {}
+
+
+HeaderCache = _HeaderCache()
+
+
 class RpmFile(object):
     '''
     Wrapper class for getting information from a binary RPM file
@@ -41,6 +108,7 @@ class RpmFile(object):
         self.release = release
         self.filename = None
         self.header = None
+        self._header = None
 
     def _format_deps(self, names, versions, sense):
         """ Format a set of deps to spec file syntax. """
@@ -71,9 +139,8 @@ class RpmFile(object):
         if self._inited:
             return
         self.filename = Mock.get_package_rpm_path(self)
-        fd = os.open(self.filename, os.O_RDONLY)
-        self.header = rpm.TransactionSet().hdrFromFdno(fd)
-        os.close(fd)
+        self._header = HeaderCache.get(self.filename)
+        self.header = self._header.header
         self._inited = True
 
     # RPMTAG_POSTTRANSPROG are given as list on F18, but not before
@@ -136,7 +203,43 @@ class RpmFile(object):
     def filelist(self):
         ''' List of files in this rpm (expanded). '''
         self.init()
-        return self.header[rpm.RPMTAG_FILENAMES]
+        return self._header.filenames
+
+    @property
+    def filesizes(self):
+        ''' List of file sizes, indexed like filelist. '''
+        self.init()
+        return self._header.filesizes
+
+    @property
+    def filemodes(self):
+        ''' List of file modes, indexed like filelist. '''
+        self.init()
+        return self._header.filemodes
+
+    @property
+    def filedigests(self):
+        ''' List of file digests, indexed like filelist. '''
+        self.init()
+        return self._header.filedigests
+
+    @property
+    def doc_files(self):
+        ''' List of files marked as %doc (rpm -qd). '''
+        self.init()
+        return self._header.doc_files
+
+    @property
+    def license_files(self):
+        ''' List of files marked as %license (rpm -qL). '''
+        self.init()
+        return self._header.license_files
+
+    @property
+    def config_files(self):
+        ''' List of files marked as %config (rpm -qc). '''
+        self.init()
+        return self._header.config_files
 
     @property
     def requires(self):
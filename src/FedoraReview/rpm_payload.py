@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Read the cpio payload of rpms and srpms without rpm2cpio | cpio: list
+members, extract all or selected ones.
+'''
+
+import bz2
+import os
+import os.path
+import stat
+import struct
+import sys
+import threading
+import zlib
+
+from subprocess import Popen, PIPE
+
+from review_context import ContextThread
+from review_error import ReviewError
+from settings import Settings
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma               # pylint: disable=E0611
+    except ImportError:
+        lzma = None
+try:
+    import zstandard                             # pylint: disable=F0401
+except ImportError:
+    zstandard = None
+
+_LEAD_SIZE = 96
+_HEADER_MAGIC = '\x8e\xad\xe8\x01'
+_PAYLOADFORMAT = 1124
+_PAYLOADCOMPRESSOR = 1125
+_CPIO_MAGIC = ['070701', '070702']
+_CPIO_HEADER_SIZE = 110
+_TRAILER = 'TRAILER!!!'
+_CHUNK = 65536
+_UNPACK_WORKERS = 4
+
+# Command line tools used when there is no python module.
+_TOOLS = {'xz': ['xz', '-dc'], 'lzma': ['xz', '-dc'],
+          'zstd': ['zstd', '-dcq']}
+
+
+def _read_header(f):
+    ''' Read rpm header at current position in f, return dict of tags. '''
+    intro = f.read(16)
+    if len(intro) != 16 or intro[:4] != _HEADER_MAGIC:
+        raise ReviewError('Bad rpm header in ' + f.name)
+    count, size = struct.unpack('>II', intro[8:])
+    index = f.read(count * 16)
+    data = f.read(size)
+    tags = {}
+    for i in range(count):
+        tag, kind, offset = struct.unpack('>III', index[i * 16:i * 16 + 12])
+        if kind == 6:                           # RPM_STRING_TYPE
+            tags[tag] = data[offset:data.index('\0', offset)]
+    return tags, 16 + count * 16 + size
+
+
+class _Decompressor(object):
+    '''
+    The decompressed payload of an open rpm file, positioned at the
+    payload. Uses zlib, bz2, lzma and zstandard modules if available,
+    else xz or zstd as a filter process.
+    '''
+
+    def __init__(self, f, compressor):
+        self._f = f
+        self._buf = ''
+        self._pos = 0
+        self._proc = None
+        self._obj = None
+        if compressor == 'gzip':
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif compressor == 'bzip2':
+            self._obj = bz2.BZ2Decompressor()
+        elif compressor in ['xz', 'lzma'] and lzma:
+            self._obj = lzma.LZMADecompressor()
+        elif compressor == 'zstd' and zstandard:
+            self._obj = zstandard.ZstdDecompressor().decompressobj()
+        elif compressor in _TOOLS:
+            f.seek(f.tell())                    # Sync OS file offset.
+            try:
+                self._proc = Popen(_TOOLS[compressor], stdin=f, stdout=PIPE)
+            except OSError:
+                raise ReviewError('Cannot decompress %s payload in %s,'
+                                  ' %s not found'
+                                  % (compressor, f.name,
+                                     _TOOLS[compressor][0]))
+        else:
+            raise ReviewError('Unsupported payload compressor %s in %s'
+                              % (compressor, f.name))
+
+    def _fill(self, size):
+        ''' Make sure at least size bytes are buffered, unless at EOF. '''
+        if len(self._buf) - self._pos >= size:
+            return
+        chunks = [self._buf[self._pos:]]
+        have = len(chunks[0])
+        while have < size:
+            if self._proc:
+                chunk = self._proc.stdout.read(_CHUNK)
+            else:
+                data = self._f.read(_CHUNK)
+                if not data:
+                    break
+                try:
+                    chunk = self._obj.decompress(data)
+                except EOFError:
+                    break
+            if not chunk and self._proc:
+                break
+            chunks.append(chunk)
+            have += len(chunk)
+        self._buf = ''.join(chunks)
+        self._pos = 0
+
+    def read(self, size):
+        ''' Return next size bytes, fewer at EOF. '''
+        self._fill(size)
+        data = self._buf[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+    def copy(self, size, out):
+        ''' Copy next size bytes to file out, or skip them if None. '''
+        while size > 0:
+            data = self.read(min(size, _CHUNK))
+            if not data:
+                raise ReviewError('Truncated rpm payload in ' + self._f.name)
+            if out:
+                out.write(data)
+            size -= len(data)
+
+    def close(self):
+        ''' Release resources, stops a filter process. '''
+        if self._proc:
+            self._proc.stdout.close()
+            if self._proc.poll() is None:
+                self._proc.terminate()
+            self._proc.wait()
+
+
+def _normpath(name):
+    ''' Member name as a relative path, None if unsafe. '''
+    while name.startswith('./'):
+        name = name[2:]
+    name = name.lstrip('/')
+    if not name or name == '.' or '..' in name.split('/'):
+        return None
+    return name
+
+
+def _is_inside(root, path):
+    '''
+    Return True if path's directory resolves to somewhere below root,
+    a realpath, i. e. path isn't written through a symlink leading
+    out of root.
+    '''
+    parent = os.path.realpath(os.path.dirname(path))
+    return parent == root or parent.startswith(root + os.sep)
+
+
+class RpmPayload(object):
+    '''
+    The cpio payload of an rpm or srpm, streamed through the proper
+    decompressor. Member names are relative paths i. e., without
+    leading './' or '/'. Regular files, directories and symlinks are
+    handled, other file types are ignored.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.log = Settings.get_logger()
+
+    def _open(self):
+        ''' Return (file, decompressor) for the payload. '''
+        f = open(self.path, 'rb')
+        try:
+            f.seek(_LEAD_SIZE)
+            size = _read_header(f)[1]
+            f.seek(_LEAD_SIZE + size + (8 - size % 8) % 8)
+            tags = _read_header(f)[0]
+            if tags.get(_PAYLOADFORMAT, 'cpio') != 'cpio':
+                raise ReviewError('Unsupported payload format %s in %s'
+                                  % (tags[_PAYLOADFORMAT], self.path))
+            compressor = tags.get(_PAYLOADCOMPRESSOR, 'gzip')
+            return f, _Decompressor(f, compressor)
+        except:                                  # pylint: disable=W0702
+            f.close()
+            raise
+
+    def _entries(self, stream):
+        '''
+        Generate (name, mode, size, mtime, link_key) for all members,
+        leaving the member's data as next size bytes in stream unless
+        the caller reads them.
+        '''
+        while True:
+            header = stream.read(_CPIO_HEADER_SIZE)
+            if len(header) != _CPIO_HEADER_SIZE or \
+                    header[:6] not in _CPIO_MAGIC:
+                raise ReviewError('Bad cpio payload in ' + self.path)
+            fields = [int(header[i:i + 8], 16)
+                      for i in range(6, _CPIO_HEADER_SIZE, 8)]
+            ino, mode, nlink, mtime, size = \
+                fields[0], fields[1], fields[4], fields[5], fields[6]
+            namesize = fields[11]
+            name = stream.read(namesize)[:-1]
+            stream.read((4 - (_CPIO_HEADER_SIZE + namesize) % 4) % 4)
+            if name == _TRAILER:
+                return
+            key = (fields[7], fields[8], ino) if nlink > 1 else None
+            yield name, mode, size, mtime, key
+            stream.read((4 - size % 4) % 4)
+
+    def list(self):
+        ''' Return list of all member names. '''
+        f, stream = self._open()
+        names = []
+        try:
+            for entry in self._entries(stream):
+                stream.copy(entry[2], None)
+                name = _normpath(entry[0])
+                if name:
+                    names.append(name)
+        finally:
+            stream.close()
+            f.close()
+        return names
+
+    def _write_file(self, stream, path, size, mode, mtime):
+        ''' Write next size bytes in stream to path. '''
+        if os.path.lexists(path):
+            os.unlink(path)
+        with open(path, 'wb') as out:
+            stream.copy(size, out)
+        os.chmod(path, stat.S_IMODE(mode))
+        os.utime(path, (mtime, mtime))
+
+    def _extract(self, stream, destdir, members):
+        ''' Do extract() using stream. '''
+        # pylint: disable=R0912
+        root = os.path.realpath(destdir)
+        done = []
+        dirs = []
+        pending = {}     # Hard links waiting for the data, by link key.
+        for name, mode, size, mtime, key in self._entries(stream):
+            name = _normpath(name)
+            wanted = name and (members is None or name in members)
+            if key and stat.S_ISREG(mode) and not size:
+                if wanted:
+                    pending.setdefault(key, []).append(name)
+                continue
+            links = pending.pop(key, []) if key else []
+            if not wanted and not links:
+                stream.copy(size, None)
+                if members is not None and not pending and \
+                        len(done) == len(members):
+                    break
+                continue
+            targets = ([name] if wanted else []) + links
+            unsafe = [t for t in targets
+                      if not _is_inside(root, os.path.join(destdir, t))]
+            if unsafe:
+                self.log.warning('Not extracting %s in %s: symlink in path'
+                                 % (', '.join(unsafe), self.path))
+                targets = [t for t in targets if t not in unsafe]
+                if not targets:
+                    stream.copy(size, None)
+                    continue
+            paths = [os.path.join(destdir, t) for t in targets]
+            for path in paths:
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+            if stat.S_ISDIR(mode):
+                if os.path.islink(paths[0]):
+                    os.unlink(paths[0])
+                if not os.path.isdir(paths[0]):
+                    os.mkdir(paths[0])
+                dirs.append((paths[0], mode, mtime))
+            elif stat.S_ISLNK(mode):
+                target = stream.read(size)
+                if os.path.lexists(paths[0]):
+                    os.unlink(paths[0])
+                os.symlink(target, paths[0])
+            elif stat.S_ISREG(mode):
+                self._write_file(stream, paths[0], size, mode, mtime)
+                for path in paths[1:]:
+                    if os.path.lexists(path):
+                        os.unlink(path)
+                    os.link(paths[0], path)
+            else:
+                self.log.debug('Ignoring special file %s in %s'
+                               % (name, self.path))
+                stream.copy(size, None)
+                continue
+            done.extend(targets)
+        for names in pending.itervalues():
+            for name in names:
+                path = os.path.join(destdir, name)
+                if not _is_inside(root, path):
+                    continue
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                open(path, 'w').close()
+                done.append(name)
+        for path, mode, mtime in reversed(dirs):
+            os.chmod(path, stat.S_IMODE(mode) | stat.S_IRWXU)
+            os.utime(path, (mtime, mtime))
+        return done
+
+    def extract(self, destdir, members=None):
+        '''
+        Extract members (a list of names, all if None) into destdir,
+        creating directories as required and overwriting existing
+        files. Modes and modification times are preserved. Members
+        below a symlink leading out of destdir are skipped. Stops
+        reading as soon as all members are found. Return list of
+        extracted names.
+        '''
+        if members is not None:
+            members = set([_normpath(m) for m in members])
+        f, stream = self._open()
+        try:
+            return self._extract(stream, destdir, members)
+        except (IOError, OSError) as err:
+            raise ReviewError('Cannot unpack %s: %s' % (self.path, err))
+        finally:
+            stream.close()
+            f.close()
+
+
+def unpack_rpms(paths, topdir):
+    '''
+    Unpack all rpms in paths into topdir, each in a directory named
+    as the rpm file, using a pool of threads. Raise ReviewError if
+    any rpm can't be unpacked.
+    '''
+    todo = list(paths)
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        ''' Unpack rpms until todo is empty or there's an error. '''
+        while True:
+            with lock:
+                if not todo or errors:
+                    return
+                path = todo.pop(0)
+            destdir = os.path.join(topdir, os.path.basename(path))
+            try:
+                if not os.path.exists(destdir):
+                    os.makedirs(destdir)
+                RpmPayload(path).extract(destdir)
+            except Exception:                    # pylint: disable=W0703
+                with lock:
+                    errors.append(sys.exc_info())
+                return
+
+    threads = [ContextThread(target=worker)
+               for i in range(min(_UNPACK_WORKERS, len(todo)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(1)       # Plain join() blocks KeyboardInterrupt.
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+
+# vim: set expandtab ts=4 sw=4:
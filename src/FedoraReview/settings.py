@@ -20,6 +20,7 @@
 
 
 import argparse
+import copy
 import grp
 import logging
 import errno
@@ -29,6 +30,7 @@ import re
 import sys
 
 import ansi
+from review_context import ContextProxy
 from review_error import ReviewError
 from xdg_dirs import XdgDirs
 
@@ -65,6 +67,12 @@ def _add_modes(modes):
                        metavar='<url>',
                        help='Use another bugzilla, using complete'
                        ' url to bug page.')
+    modes.add_argument('--batch', metavar='<file>', default=None,
+                       help='Review all bugs, urls or srpm paths listed'
+                       ' one per line in <file> (- for stdin).')
+    modes.add_argument('--daemon', default=False, action='store_true',
+                       help='Serve reviews requested using'
+                       ' fedora-review-client on a Unix socket.')
     modes.add_argument('-d', '--display-checks', default=False,
                        action='store_true', dest='list_checks',
                        help='List all available checks.')
@@ -87,10 +95,33 @@ def _add_optionals(optional):
     optional.add_argument('-B', '--no-colors', action='store_false',
                           help='No colors in output',
                           default=True, dest='use_colors')
+    optional.add_argument('--batch-jobs', metavar='<jobs>', type=int,
+                          default=2, dest='batch_jobs',
+                          help='Number of packages reviewed in parallel'
+                          ' using --batch, defaults to 2.')
+    optional.add_argument('--batch-summary', metavar='<file>',
+                          default='batch-summary.json', dest='batch_summary',
+                          help='Summary written by --batch, xml if <file>'
+                          ' ends with .xml, else json. Defaults to'
+                          ' batch-summary.json')
     optional.add_argument('-c', '--cache', action='store_true',
                           dest='cache',
                           help='Do not redownload files from bugzilla,'
                           ' use the ones in the cache.')
+    optional.add_argument('--diff-size', metavar='<KiB>', type=int,
+                          default=1024, dest='diff_size',
+                          help='Max size of the diffs in diff.txt when sources'
+                          ' differ from upstream, 0 means no limit.'
+                          ' Defaults to 1024')
+    optional.add_argument('-I', '--incremental', action='store_true',
+                          dest='incremental',
+                          help='Review a new revision in an existing review'
+                          ' directory, re-running only what is affected'
+                          ' by the changes. Writes a delta report.')
+    optional.add_argument('-j', '--jobs', metavar='<jobs>', type=int,
+                          default=1, dest='jobs',
+                          help='Number of checks to run in parallel,'
+                          ' defaults to 1.')
     optional.add_argument('-D', '--define', metavar='<flag>',
                           action='append', dest='flags', default=[],
                           help='Define a flag like --define EPEL5 or '
@@ -99,6 +130,11 @@ def _add_optionals(optional):
                           dest='repo',
                           help='directory with rpms to install together with'
                           ' reviewed package during build and install phases.')
+    optional.add_argument('--license-scanner', dest='license_scanner',
+                          default='licensecheck',
+                          choices=['licensecheck', 'builtin'],
+                          help='Tool finding licenses in sources, defaults'
+                          ' to licensecheck.')
     optional.add_argument('-m', '--mock-config', metavar='<config>',
                           dest='mock_config',
                           help='Configuration to use for the mock build,'
@@ -134,6 +170,13 @@ def _add_optionals(optional):
                           dest='rpm_spec', default=False,
                           help='Take spec file from srpm instead of separate'
                           'url.')
+    optional.add_argument('--socket', metavar='<path>', default=None,
+                          help='Unix socket used by --daemon, defaults to'
+                          ' fedora-review.sock in $XDG_RUNTIME_DIR.')
+    optional.add_argument('--source-cache-size', metavar='<MiB>', type=int,
+                          default=4096, dest='source_cache_size',
+                          help='Max size of upstream sources cache shared'
+                          ' by all reviews, 0 disables. Defaults to 4096')
     optional.add_argument('-v', '--verbose', action='store_true',
                           help='Show more output.', default=False,
                           dest='verbose')
@@ -229,17 +272,29 @@ class _Settings(object):                         # pylint: disable=R0902
             setattr(self, key, value)
         self._dict = self.defaults
         self.log = None
+        self.logger_name = ''
         self._con_handler = None
         self._log_config_done = None
         self.cache = None
+        self.incremental = False
+        self.batch = None
+        self.batch_jobs = 2
+        self.batch_summary = 'batch-summary.json'
+        self.daemon = False
+        self.socket = None
         self.resultdir = None
         self.init_done = None
         self.uniqueext = None
+        self.root_tag = None
         self.configdir = None
         self.log_level = None
         self.verbose = False
         self.name = None
         self.use_colors = False
+        self.jobs = 1
+        self.source_cache_size = 4096
+        self.diff_size = 1024
+        self.license_scanner = 'licensecheck'
         self.session_log = SESSION_LOG
 
     def __getitem__(self, key):
@@ -270,6 +325,17 @@ class _Settings(object):                         # pylint: disable=R0902
         if not re.search('clean($|[ ])', self.mock_options):
             self.mock_options += ' --no-clean'
 
+    def add_uniqueext(self, tag):
+        '''
+        Give mock a root of its own, appending tag to any --uniqueext
+        in mock_options. Used when reviews build in parallel.
+        '''
+        options = self.mock_options if self.mock_options else ''
+        options = ' '.join(re.sub(r'--uniqueext=[^ ]+', '', options).split())
+        ext = self.uniqueext[1:] + '-' if self.uniqueext else ''
+        self.mock_options = '%s --uniqueext=%s%s' % (options, ext, tag)
+        self._fix_mock_options()
+
     def init(self, force=False):
         ''' Delayed setup, to be called when sys.argv is ok...'''
 
@@ -300,11 +366,23 @@ class _Settings(object):                         # pylint: disable=R0902
         self.do_logger_setup(logging.DEBUG if args.verbose else None)
         if self.nobuild:
             self.cache = True
+        if self.jobs < 1:
+            self.jobs = 1
         if not self.prebuilt:
             _check_mock_grp()
         self._fix_mock_options()
+        if self.root_tag:
+            self.add_uniqueext(self.root_tag)
         self.init_done = True
 
+    def clone(self):
+        ''' Return a copy, sharing the logger with this instance. '''
+        settings = copy.copy(self)
+        for key, value in vars(self).iteritems():
+            if isinstance(value, (list, dict)):
+                setattr(settings, key, copy.copy(value))
+        return settings
+
     def add_args(self, args):
         """ Load all command line options in args. """
         var_dict = vars(args)
@@ -360,7 +438,15 @@ class _Settings(object):                         # pylint: disable=R0902
         self.log_level = lvl
         if lvl == logging.DEBUG:
             self.verbose = True
-        self.log = logging.getLogger('')
+        self.log = logging.getLogger(self.logger_name)
+        if self.logger_name:
+            # Own console handler, session log shared with root logger.
+            self.log.propagate = False
+            self.log.setLevel(logging.DEBUG)
+            for handler in logging.getLogger('').handlers:
+                if isinstance(handler, logging.FileHandler) and \
+                        handler not in self.log.handlers:
+                    self.log.addHandler(handler)
         # define a Handler which writes INFO  or higher to sys.stderr
         console = logging.StreamHandler()
         console.setLevel(lvl)
@@ -376,6 +462,15 @@ class _Settings(object):                         # pylint: disable=R0902
             self.log.warning(msg)
         return True
 
+    def use_own_logger(self, name):
+        '''
+        Log using logger name instead of the root logger, with a
+        console handler of its own writing to current stderr.
+        '''
+        self.logger_name = name
+        self._con_handler = None
+        self.do_logger_setup(self.log_level)
+
     def get_logger(self):
         ''' Return the application logger instance. '''
         if not self.log:
@@ -383,6 +478,6 @@ class _Settings(object):                         # pylint: disable=R0902
         return self.log
 
 
-Settings = _Settings()
+Settings = ContextProxy('settings', _Settings())
 
 # vim: set expandtab ts=4 sw=4:
@@ -25,6 +25,7 @@ import shutil
 
 from urlparse import urlparse
 
+from archive_index import list_archive
 from helpers_mixin import HelpersMixin, DownloadError
 from review_dirs import ReviewDirs
 from review_error import ReviewError
@@ -78,7 +79,8 @@ class Source(HelpersMixin):
             try:
                 self.filename = self._get_file(url,
                                                ReviewDirs.upstream,
-                                               my_logger)
+                                               my_logger,
+                                               shared_cache=True)
             except DownloadError as ex:
                 self.log.debug('Download error on %s, : %s' % (url, str(ex)),
                                exc_info=True)
@@ -132,11 +134,7 @@ class Source(HelpersMixin):
             could be extracted e. g., plain files are copied to the
             extract-dir.
         '''
-        if not os.path.isfile(self.filename):
-            raise ReviewError("%s file %s is missing in src.rpm."
-                              " Conditional source inclusion?" %
-                              (self.tag, self.filename))
-
+        self._check_file()
         self.extract_dir = os.path.join(ReviewDirs.upstream_unpacked,
                                         self.tag)
         if os.path.exists(self.extract_dir):
@@ -146,6 +144,32 @@ class Source(HelpersMixin):
             if not self.rpmdev_extract(self.filename, self.extract_dir):
                 shutil.copy(self.filename, self.extract_dir)
 
+    def _check_file(self):
+        ''' Raise ReviewError unless the source file exists. '''
+        if not os.path.isfile(self.filename):
+            raise ReviewError("%s file %s is missing in src.rpm."
+                              " Conditional source inclusion?" %
+                              (self.tag, self.filename))
+
+    def get_filelist(self):
+        '''
+        Return list of paths for all files in source as placed by
+        extract(). Tar and zip archives not yet extracted are listed
+        by reading the archive headers only, other sources are
+        extracted.
+        '''
+        topdir = os.path.join(ReviewDirs.upstream_unpacked, self.tag)
+        if self.downloaded and not os.path.exists(topdir):
+            self._check_file()
+            members = list_archive(self.filename)
+            if members is not None:
+                return [os.path.join(topdir, m) for m in members]
+        all_ = []
+        # pylint: disable=W0612
+        for root, dirs, files in os.walk(self.get_source_topdir()):
+            all_.extend([os.path.join(root, f) for f in files])
+        return all_
+
     def get_source_topdir(self):
         """
         Return the top directory of the unpacked source.
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Content-addressed cache of upstream sources shared by all reviews.
+'''
+
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import os.path
+import shutil
+import threading
+import time
+
+from settings import Settings
+from xdg_dirs import XdgDirs
+
+_FICLONE = 0x40049409         # linux/fs.h: _IOW(0x94, 9, int)
+
+
+def _sha256(path):
+    ''' Return sha256 hex digest of file at path. '''
+    ck = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), ''):
+            ck.update(chunk)
+    return ck.hexdigest()
+
+
+def link_file(src, dst):
+    '''
+    Make dst a copy of src using a hardlink if possible, else a reflink
+    (copy-on-write clone) and as last resort a plain copy.
+    '''
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    with open(src, 'rb') as fsrc:
+        with open(dst, 'wb') as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+                return
+            except IOError:
+                shutil.copyfileobj(fsrc, fdst)
+
+
+class _SourceCache(object):
+    '''
+    Upstream sources stored by sha256 under the XDG cache dir, with an
+    index mapping urls to digests and digests to size and last use.
+    Files are linked into the review directories. Hits are verified by
+    checksum, and least recently used files are evicted when the total
+    size exceeds Settings.source_cache_size MiB.
+    '''
+
+    def __init__(self):
+        self.log = Settings.get_logger()
+        self._lock = threading.Lock()
+
+    @property
+    def topdir(self):
+        ''' Cache root, created if required. '''
+        path = os.path.join(XdgDirs.app_cachedir, 'sources')
+        if not os.path.exists(os.path.join(path, 'objects')):
+            try:
+                os.makedirs(os.path.join(path, 'objects'))
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+        return path
+
+    enabled = property(lambda self: Settings.source_cache_size > 0)
+
+    def _object_path(self, digest):
+        ''' Return path to cached file with given sha256 digest. '''
+        return os.path.join(self.topdir, 'objects', digest)
+
+    def _update_index(self, update):
+        '''
+        Run update(index) with the index locked also against other
+        processes, write back the possibly modified index and return
+        update's return value.
+        '''
+        index_path = os.path.join(self.topdir, 'index.json')
+        with self._lock:
+            with open(index_path + '.lock', 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    with open(index_path) as f:
+                        index = json.load(f)
+                except (IOError, ValueError):
+                    index = {}
+                index.setdefault('urls', {})
+                index.setdefault('objects', {})
+                result = update(index)
+                with open(index_path + '.tmp', 'w') as f:
+                    json.dump(index, f)
+                os.rename(index_path + '.tmp', index_path)
+        return result
+
+    def _evict(self, index):
+        ''' Remove least recently used objects until below size limit. '''
+        limit = Settings.source_cache_size * 1024 * 1024
+        objects = index['objects']
+        total = sum([o['size'] for o in objects.itervalues()])
+        by_age = sorted(objects.iterkeys(), key=lambda d: objects[d]['used'])
+        for digest in by_age:
+            if total <= limit:
+                break
+            self.log.debug('Evicting cached source ' + digest)
+            total -= objects[digest]['size']
+            del objects[digest]
+            try:
+                os.unlink(self._object_path(digest))
+            except OSError:
+                pass
+        known = set(objects.iterkeys())
+        for url, digest in index['urls'].items():
+            if digest not in known:
+                del index['urls'][url]
+
+    def lookup(self, url=None, digest=None):
+        '''
+        Return sha256 digest of a verified cached file for url or
+        digest, or None.
+        '''
+        if not self.enabled:
+            return None
+
+        def touch(index):
+            ''' Find digest, update its last use time. '''
+            key = digest if digest else index['urls'].get(url)
+            if key not in index['objects']:
+                return None
+            index['objects'][key]['used'] = time.time()
+            return key
+
+        key = self._update_index(touch)
+        if not key:
+            return None
+        path = self._object_path(key)
+        if os.path.exists(path) and _sha256(path) == key:
+            return key
+        self.log.warning('Dropping corrupt cached source for '
+                         + (url if url else key))
+        self.forget(key)
+        return None
+
+    def get(self, url, path):
+        '''
+        Link the cached file for url to path if available, return
+        its sha256 digest if done, else None.
+        '''
+        key = self.lookup(url=url)
+        if not key:
+            return None
+        link_file(self._object_path(key), path)
+        return key
+
+    def put(self, url, path, digest=None):
+        '''
+        Add downloaded file at path as url's content. digest is the
+        file's sha256 digest, computed if not given.
+        '''
+        if not self.enabled:
+            return
+        if not digest:
+            digest = _sha256(path)
+        obj_path = self._object_path(digest)
+        if not os.path.exists(obj_path):
+            tmp_path = '%s.%d-%d.tmp' % \
+                (obj_path, os.getpid(), threading.current_thread().ident)
+            link_file(path, tmp_path)
+            os.rename(tmp_path, obj_path)
+
+        def add(index):
+            ''' Register object and url, evict old objects. '''
+            index['urls'][url] = digest
+            index['objects'][digest] = {'size': os.path.getsize(obj_path),
+                                        'used': time.time()}
+            self._evict(index)
+
+        self._update_index(add)
+
+    def forget(self, digest):
+        ''' Remove object with digest and all urls pointing to it. '''
+
+        def remove(index):
+            ''' Drop digest from index. '''
+            index['objects'].pop(digest, None)
+            for url, url_digest in index['urls'].items():
+                if url_digest == digest:
+                    del index['urls'][url]
+
+        self._update_index(remove)
+        try:
+            os.unlink(self._object_path(digest))
+        except OSError:
+            pass
+
+
+SourceCache = _SourceCache()
+
+# vim: set expandtab ts=4 sw=4:
@@ -61,8 +61,9 @@ class SpecFile(object):
         def update_macros():
             ''' Update build macros from mock target configuration. '''
             macros = ['%dist', '%rhel', '%fedora', '%_build_arch', '%_arch']
+            values = Mock.get_macros(macros, self, flags)
             for macro in macros:
-                expanded = Mock.get_macro(macro, self, flags)
+                expanded = values[macro]
                 if not expanded.startswith('%'):
                     rpm.delMacro(macro[1:])
                     rpm.addMacro(macro[1:], expanded)
@@ -24,10 +24,11 @@ import os.path
 import shutil
 
 from glob import glob
-from subprocess import call
 
 from helpers_mixin import HelpersMixin
 from review_dirs import ReviewDirs
+from review_error import ReviewError
+from rpm_payload import RpmPayload
 from settings import Settings
 
 
@@ -44,46 +45,55 @@ class SRPMFile(HelpersMixin):
         self.unpack()
 
     def unpack(self, src=None):
-        """ Local unpack using rpm2cpio. """
+        """ Local unpack of the srpm payload. """
         if self._unpacked_src:
             return
 
         wdir = ReviewDirs.srpm_unpacked
-        oldpwd = os.getcwd()
-        os.chdir(wdir)
-        src = src if src else self.filename
-        cmd = 'rpm2cpio ' + src + ' | cpio -u -i -m --quiet'
-        rc = call(cmd, shell=True)
-        if rc != 0:
+        src = os.path.join(wdir, src if src else self.filename)
+        try:
+            RpmPayload(src).extract(wdir)
+        except (ReviewError, IOError) as err:
             self.log.warn(
                 "Cannot unpack %s into %s" % (self.filename, wdir))
+            self.log.debug(str(err))
         else:
             self._unpacked_src = wdir
-        os.chdir(oldpwd)
+
+    def _extract_member(self, filename):
+        """ Extract filename from the srpm only, return path or None. """
+        wdir = ReviewDirs.srpm_unpacked
+        try:
+            RpmPayload(self.filename).extract(wdir, [filename])
+        except (ReviewError, IOError) as err:
+            self.log.debug("Cannot extract %s: %s" % (filename, err))
+        path = os.path.join(wdir, filename)
+        return path if os.path.exists(path) else None
 
     def extract(self, path):
-        """ Extract a named source and return containing directory. """
-        self.filename = os.path.basename(path)
-        self.unpack(path)
-        files = glob(os.path.join(self._unpacked_src, '*'))
-        if self.filename not in [os.path.basename(f) for f in files]:
+        """
+        Extract a named source and return containing directory. Only
+        this source is taken from the srpm if it isn't unpacked.
+        """
+        filename = os.path.basename(path)
+        src = os.path.join(ReviewDirs.srpm_unpacked, filename)
+        if not os.path.exists(src):
+            src = self._extract_member(filename)
+        if not src:
             self.log.error(
                 'Trying to unpack non-existing source: ' + path)
             return None
-        extract_dir = os.path.join(self._unpacked_src,
-                                   self.filename + '-extract')
+        extract_dir = os.path.join(ReviewDirs.srpm_unpacked,
+                                   filename + '-extract')
         if os.path.exists(extract_dir):
             return extract_dir
         else:
             os.mkdir(extract_dir)
-        rv = self.rpmdev_extract(os.path.join(self._unpacked_src,
-                                              self.filename),
-                                 extract_dir)
+        rv = self.rpmdev_extract(src, extract_dir)
         if not rv:
             self.log.debug("Cannot unpack %s, so probably not an "
-                           "archive. Copying instead" % self.filename)
-            shutil.copy(os.path.join(self._unpacked_src, self.filename),
-                        extract_dir)
+                           "archive. Copying instead" % filename)
+            shutil.copy(src, extract_dir)
         return extract_dir
 
     def check_source_checksum(self, path):
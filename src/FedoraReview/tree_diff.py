@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+Compare two source trees, or two archives without extracting them:
+find added, removed and changed files using digests, and write unified
+diffs of changed text files.
+'''
+
+import difflib
+import hashlib
+import os
+import os.path
+import sys
+import threading
+
+from subprocess import Popen, PIPE
+
+from archive_index import archive_digests
+from review_context import ContextThread
+
+_HASH_WORKERS = 4
+_CHUNK = 65536
+_CONTEXT_LINES = 2
+_MAX_DIFFLIB_SIZE = 1024 * 1024     # Larger files are diffed by diff(1).
+
+
+class TreeDelta(object):
+    '''
+    Differences between an old and a new tree, as sorted lists of
+    relative paths: added (only in new), removed (only in old) and
+    changed.
+    '''
+
+    def __init__(self, old_files, new_files, changed):
+        self.added = sorted(set(new_files) - set(old_files))
+        self.removed = sorted(set(old_files) - set(new_files))
+        self.changed = sorted(changed)
+
+    def __nonzero__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def summary(self, old_label, new_label):
+        ''' Return list of lines describing all differences. '''
+        lines = ['Only in %s: %s' % (old_label, p) for p in self.removed]
+        lines.extend(['Only in %s: %s' % (new_label, p) for p in self.added])
+        lines.extend(['Differs: ' + p for p in self.changed])
+        return lines
+
+
+def _walk(topdir):
+    ''' Return dict of path by relative path for all files in topdir. '''
+    files = {}
+    # pylint: disable=W0612
+    for root, dirs, names in os.walk(topdir):
+        for name in names:
+            path = os.path.join(root, name)
+            files[os.path.relpath(path, topdir)] = path
+    return files
+
+
+def _digest(path):
+    ''' Return digest of file content, or of the target if dangling. '''
+    if not os.path.exists(path):
+        return 'link:' + os.readlink(path)
+    ck = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK), ''):
+            ck.update(chunk)
+    return ck.hexdigest()
+
+
+def hash_files(paths):
+    '''
+    Return dict of digest by path for all paths, hashed by a pool of
+    threads. hashlib releases the GIL while hashing.
+    '''
+    todo = list(paths)
+    digests = {}
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        ''' Hash files until todo is empty or there's an error. '''
+        while True:
+            with lock:
+                if not todo or errors:
+                    return
+                path = todo.pop()
+            try:
+                digest = _digest(path)
+            except Exception:                    # pylint: disable=W0703
+                with lock:
+                    errors.append(sys.exc_info())
+                return
+            with lock:
+                digests[path] = digest
+
+    threads = [ContextThread(target=worker)
+               for i in range(min(_HASH_WORKERS, len(todo)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(1)       # Plain join() blocks KeyboardInterrupt.
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return digests
+
+
+def compare_trees(old_dir, new_dir):
+    '''
+    Return TreeDelta for files in old_dir and new_dir. Files with
+    equal size are compared using digests, computed in parallel.
+    '''
+    old_files = _walk(old_dir)
+    new_files = _walk(new_dir)
+    common = set(old_files.iterkeys()) & set(new_files.iterkeys())
+    changed = []
+    to_hash = []
+    for relpath in common:
+        old_path, new_path = old_files[relpath], new_files[relpath]
+        if os.path.exists(old_path) and os.path.exists(new_path) and \
+                os.path.getsize(old_path) != os.path.getsize(new_path):
+            changed.append(relpath)
+        else:
+            to_hash.extend([old_path, new_path])
+    digests = hash_files(to_hash)
+    for relpath in common:
+        old_path, new_path = old_files[relpath], new_files[relpath]
+        if old_path in digests and \
+                digests[old_path] != digests[new_path]:
+            changed.append(relpath)
+    return TreeDelta(old_files.keys(), new_files.keys(), changed)
+
+
+def compare_archives(old_path, new_path):
+    '''
+    Return TreeDelta for the members of two tar or zip archives,
+    reading them without extracting. Return None if any of them can't
+    be read this way.
+    '''
+    old_digests = archive_digests(old_path)
+    if old_digests is None:
+        return None
+    new_digests = archive_digests(new_path)
+    if new_digests is None:
+        return None
+    changed = [p for p in old_digests.iterkeys()
+               if p in new_digests and old_digests[p] != new_digests[p]]
+    return TreeDelta(old_digests.keys(), new_digests.keys(), changed)
+
+
+def _is_text(path):
+    ''' Return True unless path looks like a binary file. '''
+    with open(path, 'rb') as f:
+        return '\0' not in f.read(8192)
+
+
+def _diff_cmd_lines(old_path, new_path):
+    '''
+    Generate unified diff lines for two large files using diff(1),
+    which unlike difflib neither reads all lines into memory nor
+    runs in near quadratic time.
+    '''
+    try:
+        proc = Popen(['diff', '-U', str(_CONTEXT_LINES), old_path,
+                      new_path],
+                     stdout=PIPE)
+    except OSError:
+        yield 'Files %s and %s differ (too large to diff)\n' \
+            % (old_path, new_path)
+        return
+    try:
+        for line in proc.stdout:
+            yield line
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.terminate()
+        proc.wait()
+
+
+def _diff_lines(old_path, new_path):
+    ''' Generate unified diff lines for two changed files. '''
+    if not os.path.isfile(old_path) or not os.path.isfile(new_path):
+        yield 'File %s differs from %s\n' % (new_path, old_path)
+        return
+    if not _is_text(old_path) or not _is_text(new_path):
+        yield 'Binary files %s and %s differ\n' % (old_path, new_path)
+        return
+    if os.path.getsize(old_path) > _MAX_DIFFLIB_SIZE or \
+            os.path.getsize(new_path) > _MAX_DIFFLIB_SIZE:
+        for line in _diff_cmd_lines(old_path, new_path):
+            yield line
+        return
+    with open(old_path) as old, open(new_path) as new:
+        old_lines = old.readlines()
+        new_lines = new.readlines()
+    for line in difflib.unified_diff(old_lines, new_lines,
+                                     old_path, new_path,
+                                     n=_CONTEXT_LINES):
+        if not line.endswith('\n'):
+            line += '\n\\ No newline at end of file\n'
+        yield line
+
+
+def write_diffs(trees, f, max_size=0):
+    '''
+    Write unified diffs for all changed text files to file f, a line
+    for binary ones. trees is a list of (delta, old_dir, new_dir).
+    Stop after max_size bytes unless max_size is 0. Return True if
+    output was truncated.
+    '''
+    written = 0
+    for delta, old_dir, new_dir in trees:
+        for relpath in delta.changed:
+            for line in _diff_lines(os.path.join(old_dir, relpath),
+                                    os.path.join(new_dir, relpath)):
+                if max_size and written + len(line) > max_size:
+                    f.write('\n[Diff truncated at %d bytes]\n' % max_size)
+                    return True
+                f.write(line)
+                written += len(line)
+    return False
+
+
+# vim: set expandtab ts=4 sw=4:
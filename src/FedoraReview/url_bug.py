@@ -17,12 +17,15 @@
 Tools handling resources identified with an url (download only).
 No xmlrpc involved, for better or worse.
 '''
+import hashlib
+import os
 import os.path
 import urllib
 
 from BeautifulSoup import BeautifulSoup
 
 from abstract_bug import AbstractBug
+from xdg_dirs import XdgDirs
 
 
 class UrlBug(AbstractBug):
@@ -44,6 +47,14 @@ class UrlBug(AbstractBug):
         """
         if self.bug_url.startswith('file://'):
             tmpfile = self.bug_url.replace('file://', '')
+        elif self.bug_url.startswith('http'):
+            # Kept in cache, revalidated instead of downloaded each time.
+            pagedir = os.path.join(XdgDirs.app_cachedir, 'pages')
+            if not os.path.exists(pagedir):
+                os.makedirs(pagedir)
+            tmpfile = os.path.join(pagedir,
+                                   hashlib.sha1(self.bug_url).hexdigest())
+            self.urlretrieve(self.bug_url, tmpfile)
         else:
             tmpfile = urllib.urlretrieve(self.bug_url)[0]
         soup = BeautifulSoup(open(tmpfile))
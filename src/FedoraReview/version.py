@@ -27,10 +27,11 @@ class VersionError(ReviewError):
     pass
 
 
-def _setup():
-    ''' Setup  the 'version' file from version.tmpl. '''
+def _setup(here):
+    ''' Setup  the 'version' file in here from version.tmpl. '''
     try:
-        octets = check_output(['git', 'log', '--pretty=format:%h %ci', '-1'])
+        octets = check_output(['git', 'log', '--pretty=format:%h %ci', '-1'],
+                              cwd=here)
     except:
         raise VersionError("No version file and git not available.")
     line = octets.decode('utf-8')
@@ -39,7 +40,7 @@ def _setup():
     date = words.pop(0)
     time = ' '.join(words)
     try:
-        with open('version.tmpl') as f:
+        with open(os.path.join(here, 'version.tmpl')) as f:
             template = f.read()
     except:
         raise VersionError('Cannot read version.tmpl')
@@ -49,7 +50,7 @@ def _setup():
     template = template.replace('@commit@', commit)
     template = template.replace('@host@', socket.gethostname())
     try:
-        with open('version', 'w') as f:
+        with open(os.path.join(here, 'version'), 'w') as f:
             f.write(template)
     except:
         raise VersionError('Cannot write to version file')
@@ -57,15 +58,12 @@ def _setup():
 
 def _init():
     ''' Possibly create version file, read and export it. '''
-    old_wd = os.getcwd()
     here = os.path.dirname(os.path.realpath(__file__))
-    os.chdir(here)
     version_path = os.path.join(here, 'version')
     if not os.path.exists(version_path):
-        _setup()
+        _setup(here)
     with open(version_path) as f:
         version_script = f.read()
-    os.chdir(old_wd)
     return version_script
 
 
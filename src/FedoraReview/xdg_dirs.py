@@ -60,6 +60,15 @@ class _XdgDirs(object):
             path = os.path.expanduser('~/.local/share')
         return self._get_dir(path, app_dir)
 
+    def get_runtimedir(self):
+        '''
+        Return XDG runtime dir for sockets and such, falling back to the
+        app cache dir if undefined.
+        '''
+        if 'XDG_RUNTIME_DIR' in os.environ:
+            return os.environ['XDG_RUNTIME_DIR']
+        return self.get_cachedir(True)
+
     datadir = property(lambda self: self.get_datadir())
     cachedir = property(lambda self: self.get_cachedir())
     configdir = property(lambda self: self.get_configdir())
@@ -68,6 +77,8 @@ class _XdgDirs(object):
     app_cachedir = property(lambda self: self.get_cachedir(True))
     app_configdir = property(lambda self: self.get_configdir(True))
 
+    runtimedir = property(lambda self: self.get_runtimedir())
+
 
 XdgDirs = _XdgDirs()
 
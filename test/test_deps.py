@@ -83,8 +83,69 @@ class TestDeps(unittest.TestCase):
             owners.remove('generic-release')
         self.assertEqual(set(owners), OWNERS_OK)
 
+    @unittest.skipIf(not FEDORA, 'Fedora-only test')
+    def test_list_owners_bulk(self):
+        ''' Test bulk listing of file owner(s). '''
+        paths = ['/var/lib/rpm', '/etc/yum.repos.d/', '/no/such/file']
+        owners = deps.list_owners_bulk(paths)
+        self.assertEqual(set(owners.keys()), set(paths))
+        self.assertEqual(owners['/var/lib/rpm'], ['rpm'])
+        self.assertEqual(owners['/no/such/file'], [])
+
+    def test_dir_ownership(self):
+        ''' Test unowned ancestor dirs lookup. '''
+        index = deps.DirOwnership(['/usr/share/foo',
+                                   '/usr/share/foo/bar/a',
+                                   '/usr/share/foo/bar/b',
+                                   '/opt/x/y/z'])
+        self.assertEqual(index.candidates(),
+                         set(['/usr', '/usr/share', '/usr/share/foo/bar',
+                              '/opt', '/opt/x', '/opt/x/y']))
+        self.assertEqual(index.unowned(['/usr/share', '/opt/x']),
+                         set(['/usr/share/foo/bar', '/opt/x/y']))
+
     @unittest.skipIf(not FEDORA, 'Fedora-only test')
     def test_list_paths(self):
         ''' test list_paths method. '''
         paths = deps.list_paths('fedora-release')
         self.assertTrue('/etc/fedora-release' in paths)
+
+    def test_index_filelists(self):
+        ''' File queries don't use an index without file lists. '''
+        # pylint: disable=C0111,W0212
+
+        class IndexMockup(object):
+            has_filelists = False
+
+        deps._index = IndexMockup()
+        try:
+            self.assertEqual(deps._get_index(files=True), None)
+            self.assertTrue(deps._get_index())
+            deps._index.has_filelists = True
+            self.assertTrue(deps._get_index(files=True))
+        finally:
+            deps._index = None
+
+    @unittest.skipIf(not FEDORA, 'Fedora-only test')
+    def test_repo_index(self):
+        ''' Compare repo index answers with dnf repoquery. '''
+        index = deps._get_index()
+        self.assertTrue(index)
+        pkgs = deps.resolve(['config(rpm)', 'perl'])
+        paths = deps.list_paths('fedora-release')
+        deps._index = False
+        try:
+            self.assertEqual(set(pkgs),
+                             set(deps.resolve(['config(rpm)', 'perl'])))
+            self.assertEqual(set(paths),
+                             set(deps.list_paths('fedora-release')))
+            repo_owners = deps._repo_owners(['/etc/fedora-release',
+                                             '/no/such'])
+        finally:
+            deps._index = None
+        owners = index.file_owners(['/etc/fedora-release', '/no/such'])
+        self.assertEqual(owners['/no/such'], set())
+        self.assertTrue('fedora-release' in owners['/etc/fedora-release'])
+        self.assertEqual(repo_owners['/no/such'], [])
+        self.assertEqual(set(repo_owners['/etc/fedora-release']),
+                         owners['/etc/fedora-release'])
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#    MA  02110-1301 USA.
+#
+# pylint: disable=C0103,R0904,R0913,W0212
+'''
+Unit tests for the http download layer, using a local http server.
+'''
+
+import hashlib
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+import unittest2 as unittest
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+import srcpath                                   # pylint: disable=W0611
+from FedoraReview.download import Fetcher, HttpError
+
+DATA = ''.join([chr(i % 251) for i in range(200000)])
+ETAG = '"v1"'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    ''' Serves DATA on /data with ETag and Range support. '''
+
+    protocol_version = 'HTTP/1.1'
+    requests = []
+    connections = set()
+    cut_at = None                  # Drop connection after cut_at bytes.
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        ''' Handle a GET request. '''
+        _Handler.requests.append(dict(self.headers))
+        _Handler.connections.add(self.client_address)
+        if self.path == '/moved':
+            self.send_response(302)
+            self.send_header('Location', '/data')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path != '/data':
+            self.send_error(404)
+            return
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.send_header('ETag', ETAG)
+            self.end_headers()
+            return
+        start = 0
+        rng = self.headers.get('Range')
+        if rng and self.headers.get('If-Range') == ETAG:
+            start = int(rng.split('=')[1].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                             (start, len(DATA) - 1, len(DATA)))
+        else:
+            self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(DATA) - start))
+        self.end_headers()
+        if _Handler.cut_at:
+            self.wfile.write(DATA[start:_Handler.cut_at])
+            _Handler.cut_at = None
+            self.close_connection = 1
+            return
+        self.wfile.write(DATA[start:])
+
+
+class TestDownload(unittest.TestCase):
+    ''' Test Fetcher against a local http server. '''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.tmpdir, 'cache')
+        _Handler.requests = []
+        _Handler.connections = set()
+        _Handler.cut_at = None
+        self.server = HTTPServer(('127.0.0.1', 0), _Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.path = os.path.join(self.tmpdir, 'data')
+
+    def tearDown(self):
+        Fetcher.close()
+        self.server.shutdown()
+        self.server.server_close()
+        if self.cache_home:
+            os.environ['XDG_CACHE_HOME'] = self.cache_home
+        else:
+            del os.environ['XDG_CACHE_HOME']
+        shutil.rmtree(self.tmpdir)
+
+    def test_fetch(self):
+        ''' Plain download, redirect and keep-alive reuse. '''
+        downloaded, digest = \
+            Fetcher.fetch(self.url + '/moved', self.path, 'md5')
+        self.assertTrue(downloaded)
+        self.assertEqual(digest, hashlib.md5(DATA).hexdigest())
+        with open(self.path) as f:
+            self.assertEqual(f.read(), DATA)
+        self.assertEqual(len(_Handler.requests), 2)
+        self.assertEqual(len(_Handler.connections), 1)
+        self.assertRaises(HttpError,
+                          Fetcher.fetch,
+                          self.url + '/nothing', self.path + '2', 'md5')
+
+    def test_conditional(self):
+        ''' An unchanged file is not downloaded again. '''
+        Fetcher.fetch(self.url + '/data', self.path, 'md5')
+        downloaded, digest = \
+            Fetcher.fetch(self.url + '/data', self.path, 'md5')
+        self.assertFalse(downloaded)
+        self.assertEqual(digest, None)
+        self.assertEqual(_Handler.requests[-1].get('if-none-match'), ETAG)
+
+    def test_resume(self):
+        ''' An interrupted download is resumed using Range. '''
+        _Handler.cut_at = 70000
+        self.assertRaises(HttpError,
+                          Fetcher.fetch,
+                          self.url + '/data', self.path, 'md5')
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(os.path.getsize(self.path + '.part'), 70000)
+        downloaded, digest = \
+            Fetcher.fetch(self.url + '/data', self.path, 'md5')
+        self.assertTrue(downloaded)
+        self.assertEqual(digest, hashlib.md5(DATA).hexdigest())
+        self.assertEqual(_Handler.requests[-1].get('range'), 'bytes=70000-')
+        self.assertFalse(os.path.exists(self.path + '.part'))
+        with open(self.path) as f:
+            self.assertEqual(f.read(), DATA)
+
+# vim: set expandtab ts=4 sw=4:
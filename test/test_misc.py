@@ -22,15 +22,21 @@ Unit tests for bugzilla bug handling
 '''
 
 import glob
+import json
 import logging
 import shutil
 import os
 import os.path
 import re
 import rpm
+import StringIO
 import subprocess
 import sys
+import tempfile
+import threading
 import unittest2 as unittest
+import xml.etree.ElementTree as ET
+import zlib
 
 try:
     from subprocess import check_output          # pylint: disable=E0611
@@ -41,22 +47,95 @@ import srcpath                                   # pylint: disable=W0611
 from FedoraReview import AbstractCheck, Mock, ReviewDirs
 from FedoraReview import ReviewError, Settings
 
-from FedoraReview.checks import Checks
+from FedoraReview.checks import Checks, ChecksLister
+from FedoraReview.check_manifest import CheckManifest, DisabledRegistry
+from FedoraReview.daemon import ReviewDaemon, _init_request
 from FedoraReview.datasrc import BuildFilesSource, RpmDataSource
 from FedoraReview.bugzilla_bug import BugzillaBug
-from FedoraReview.check_base import AbstractCheck
-from FedoraReview.checks import _CheckDict
+from FedoraReview.batch import read_jobs, write_summary
+from FedoraReview.check_base import AbstractCheck, GenericCheck
+from FedoraReview.check_base import needs_for_data
+from FedoraReview.checks import _CheckDict, _ParallelRunner
 from FedoraReview.helpers_mixin import HelpersMixin
+from FedoraReview.incremental import Delta
+from FedoraReview.license_detect import LicenseDetector, detect
+from FedoraReview.license_scan import CACHE, LicenseScanner
+from FedoraReview.mock import _ShellSession
 from FedoraReview.name_bug import NameBug
-from FedoraReview.review_helper import ReviewHelper
+from FedoraReview.result_cache import ResultCache
+from FedoraReview.review_client import EXIT_MARKER, make_request
+from FedoraReview.review_client import exit_trailer, stream_reply
+from FedoraReview.review_context import ContextThread, ReviewContext
+from FedoraReview.review_helper import ReviewHelper, _reuses_build
+from FedoraReview.rpm_payload import RpmPayload, unpack_rpms
 from FedoraReview.source import Source
+from FedoraReview.source_cache import SourceCache
 from FedoraReview.spec_file import SpecFile
-from FedoraReview.rpm_file import RpmFile
+from FedoraReview.rpm_file import RpmFile, HeaderCache
 from FedoraReview.srpm_file import SRPMFile
+from FedoraReview.tree_diff import compare_trees, write_diffs
 
 from fr_testcase import FR_TestCase, FAST_TEST, NO_NET, VERSION, RELEASE
 
 
+class _RegistryMockup(object):
+    ''' Registry mockup, for checks run by _ParallelRunner. '''
+
+    def is_user_enabled(self):                   # pylint: disable=R0201
+        ''' No check is enabled by user. '''
+        return False
+
+
+class _ChecksMockup(object):
+    ''' Checks mockup, for _ParallelRunner. '''
+
+    def __init__(self):
+        self.checkdict = _CheckDict()
+
+    def deprecate(self):
+        ''' No deprecations. '''
+        pass
+
+
+class _RunnerCheck(AbstractCheck):
+    ''' Check mockup, appends its name to started when run. '''
+    registry = _RegistryMockup()
+
+    def __init__(self, name, needs, started=None):
+        AbstractCheck.__init__(self, 'a-sourcefile')
+        self.name = name
+        self.needs = needs
+        self.started = started if started is not None else []
+
+    def run(self):
+        self.started.append(self.name)
+        self.result = None                       # pylint: disable=W0201
+
+
+def _write_rpm(path, members):
+    '''
+    Write a minimal rpm with a gzip'ed cpio payload to path, members
+    is a list of (name, mode, data) where data is the link target for
+    symlinks.
+    '''
+    def cpio_entry(ino, name, mode, data):
+        fields = [ino, mode, 0, 0, 1, 0, len(data), 0, 0, 0, 0,
+                  len(name) + 1, 0]
+        entry = '070701' + ''.join(['%08x' % f for f in fields])
+        entry += name + '\0'
+        entry += '\0' * ((4 - len(entry) % 4) % 4) + data
+        return entry + '\0' * ((4 - len(data) % 4) % 4)
+
+    cpio = ''.join([cpio_entry(i + 1, m[0], m[1], m[2])
+                    for i, m in enumerate(members)])
+    cpio += cpio_entry(0, 'TRAILER!!!', 0, '')
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    header = '\x8e\xad\xe8\x01' + '\0' * 12
+    with open(path, 'wb') as f:
+        f.write('\0' * 96 + header + header)
+        f.write(compressor.compress(cpio) + compressor.flush())
+
+
 class TestMisc(FR_TestCase):
     ''' Low-level, true unit tests. '''
 
@@ -73,6 +152,23 @@ class TestMisc(FR_TestCase):
         self.startdir = os.getcwd()
         Mock.reset()
 
+    def _tmp_cache_home(self):
+        ''' Use cache/ in a new tmpdir as XDG_CACHE_HOME, return tmpdir. '''
+        cache_home = os.environ.get('XDG_CACHE_HOME')
+        tmpdir = tempfile.mkdtemp()
+        os.environ['XDG_CACHE_HOME'] = os.path.join(tmpdir, 'cache')
+
+        def restore():
+            ''' Restore XDG_CACHE_HOME, remove tmpdir. '''
+            if cache_home:
+                os.environ['XDG_CACHE_HOME'] = cache_home
+            else:
+                del os.environ['XDG_CACHE_HOME']
+            shutil.rmtree(tmpdir)
+
+        self.addCleanup(restore)
+        return tmpdir
+
     def test_version(self):
         ''' Test version and update-version. '''
         vers_path = os.path.join(
@@ -100,8 +196,19 @@ class TestMisc(FR_TestCase):
         self.assertEqual(rpms, ['python-test'])
         rpm_pkg = src.get('python-test')
         self.assertEqual(rpm_pkg.header['name'], 'python-test')
+        self.assertEqual(len(rpm_pkg.filemodes), 11)
+        self.assertEqual(len(rpm_pkg.filedigests), 11)
+        self.assertTrue(HeaderCache.get(rpm_pkg.filename).header
+                        is rpm_pkg.header)
         all_files = src.find_all('*')
         self.assertEqual(len(all_files), 11)
+        self.assertTrue(src.get_filelist() is files)
+        self.assertEqual(src.find_all('*.py'),
+                         [f for f in files if f.endswith('.py')])
+        src.register_patterns(['*.py', re.compile('.*/python-test.*')])
+        self.assertEqual(src.get_matches('*.py'), src.find_all('*.py'))
+        self.assertEqual(src.get_matches(re.compile('.*/python-test.*')),
+                         src.find_all_re('.*/python-test.*'))
 
     def test_buildsrc(self):
         ''' Test a BuildFilesData  datasource. '''
@@ -399,6 +506,12 @@ class TestMisc(FR_TestCase):
         self.assertEqual(set(files), set(['setup.py', '__init__.py']))
         files = check.checks.sources.get_filelist()
         self.assertEqual(len(files), 10)
+        setup_py = [p for p in paths if p.endswith('/setup.py')]
+        self.assertFalse(os.path.exists(setup_py[0]))
+        check.checks.sources.extract(setup_py)
+        self.assertTrue(os.path.exists(setup_py[0]))
+        source = check.checks.sources.get('Source0')
+        self.assertEqual(sorted(source.get_filelist()), sorted(files))
 
     def test_review_helper(self):
         ''' Test review_helper error handling. '''
@@ -421,6 +534,22 @@ class TestMisc(FR_TestCase):
             os.environ['REVIEW_LOGLEVEL'] = loglevel
         self.assertEqual(rc, 2)
 
+    def test_reuses_build(self):
+        ''' BuildRequires are installed unless the build is reused. '''
+        tmpdir = tempfile.mkdtemp()
+        Settings.resultdir = tmpdir
+        try:
+            self.assertFalse(_reuses_build())
+            Settings.nobuild = True
+            open(os.path.join(tmpdir, 'foo-1-1.src.rpm'), 'w').close()
+            self.assertFalse(_reuses_build())
+            open(os.path.join(tmpdir, 'foo-1-1.noarch.rpm'), 'w').close()
+            self.assertTrue(_reuses_build())
+        finally:
+            Settings.resultdir = None
+            Settings.nobuild = False
+            shutil.rmtree(tmpdir)
+
     def test_review_dir(self):
         ''' Test ReviewDir setup functions. '''
         self.init_test('.', argv=['-n', 'python-test', '--no-build'])
@@ -432,10 +561,118 @@ class TestMisc(FR_TestCase):
         os.chdir('..')
         rd = _ReviewDirs()
         rd.workdir_setup('testdirs')
-        self.assertEqual(len(glob.glob('*')), 7)
-        self.assertEqual(os.path.basename(os.getcwd()), 'testdirs')
-        self.assertTrue(os.path.exists('results/dummy.rpm'))
-        self.assertEqual(glob.glob('BUILD/*'), ['BUILD/pkg-1.0'])
+        self.assertEqual(len(glob.glob(os.path.join(rd.root, '*'))), 7)
+        self.assertEqual(rd.root, os.path.abspath('testdirs'))
+        self.assertTrue(os.path.exists(os.path.join(rd.results,
+                                                    'dummy.rpm')))
+        self.assertEqual(glob.glob(os.path.join(rd.root, 'BUILD/*')),
+                         [os.path.join(rd.root, 'BUILD/pkg-1.0')])
+
+    def test_review_context(self):
+        ''' Settings, ReviewDirs and logger are private to each context. '''
+        default_name = Settings.name
+        contexts = [ReviewContext(), ReviewContext()]
+        seen = {}
+        busy = []
+
+        def review(i):
+            with contexts[i].activate():
+                Settings.name = 'pkg%d' % i
+                ReviewDirs.wdir = '/tmp/review-pkg%d' % i
+                rpm.addMacro('fr_test_macro', str(i))
+
+                def worker():
+                    seen[i] = (Settings.name, ReviewDirs.root,
+                               rpm.expandMacro('%{?fr_test_macro}'))
+
+                def other():
+                    try:
+                        with contexts[1 - i].activate():
+                            pass
+                    except ReviewContext.BusyError:
+                        busy.append(i)
+
+                for target in [worker, other]:
+                    thread = ContextThread(target=target)
+                    thread.start()
+                    thread.join()
+
+        for i in range(2):
+            thread = threading.Thread(target=review, args=(i,))
+            thread.start()
+            thread.join()
+        self.assertEqual(seen, {0: ('pkg0', '/tmp/review-pkg0', '0'),
+                                1: ('pkg1', '/tmp/review-pkg1', '1')})
+        self.assertEqual(busy, [0, 1])
+        self.assertEqual(contexts[1].settings.name, 'pkg1')
+        self.assertEqual(Settings.name, default_name)
+        self.assertTrue(Settings.target is not contexts[0].settings)
+        self.assertTrue(contexts[0].log is not contexts[1].log)
+        self.assertTrue(contexts[0].log is not Settings.get_logger())
+        self.assertTrue(contexts[0].mock.log is contexts[0].log)
+        with contexts[0].activate():
+            self.assertEqual(rpm.expandMacro('%{?fr_test_macro}'), '1')
+        with ReviewContext().activate():
+            self.assertEqual(rpm.expandMacro('%{?fr_test_macro}'), '')
+
+    def test_daemon_client(self):
+        ''' Request and reply format used by fedora-review-client. '''
+        os.environ['REVIEW_TEST'] = 'yes'
+        try:
+            request = json.loads(make_request(['-n', 'python-test']))
+        finally:
+            del os.environ['REVIEW_TEST']
+        self.assertEqual(request['argv'], ['-n', 'python-test'])
+        self.assertEqual(request['cwd'], os.getcwd())
+        self.assertEqual(request['env']['REVIEW_TEST'], 'yes')
+        self.assertNotIn('PATH', request['env'])
+        out = StringIO.StringIO()
+        reply = 'line 1\n\npartial\n%s 3\n' % EXIT_MARKER
+        self.assertEqual(stream_reply(StringIO.StringIO(reply), out), 3)
+        self.assertEqual(out.getvalue(), 'line 1\n\npartial')
+        out = StringIO.StringIO()
+        reply = 'line 1\n\n%s 0\n' % EXIT_MARKER
+        self.assertEqual(stream_reply(StringIO.StringIO(reply), out), 0)
+        self.assertEqual(out.getvalue(), 'line 1\n')
+        for output in ['', '\n', 'a\n\n', 'a\nb', 'a\nb\n']:
+            out = StringIO.StringIO()
+            reply = StringIO.StringIO(output + exit_trailer(4))
+            self.assertEqual(stream_reply(reply, out), 4)
+            self.assertEqual(out.getvalue(), output)
+        out = StringIO.StringIO()
+        self.assertEqual(stream_reply(StringIO.StringIO('died'), out), 1)
+        self.assertTrue(out.getvalue().startswith('died'))
+
+    def test_daemon_mock_roots(self):
+        ''' Overlapping daemon requests use different mock roots. '''
+        daemon = ReviewDaemon(os.path.join(tempfile.gettempdir(), 'sock'))
+        sleepers = [subprocess.Popen(['sleep', '60']) for i in range(2)]
+        try:
+            slots = []
+            for sleeper in sleepers:
+                slots.append(daemon._free_slot())
+                daemon.children[sleeper.pid] = slots[-1]
+            self.assertEqual(slots, [1, 2])
+            exts = []
+            for slot, options in [(1, []),
+                                  (2, ['-o', '--no-clean --uniqueext=x'])]:
+                _init_request(['-n', 'python-test', '--prebuilt'] + options,
+                              os.getcwd(), slot)
+                Settings.init()
+                exts.append(Settings.uniqueext)
+            self.assertEqual(exts, ['-daemon1', '-x-daemon2'])
+            self.assertIn('--uniqueext=x-daemon2', Settings.mock_options)
+            sleepers[0].kill()
+            sleepers[0].wait()
+            daemon._reap()
+            self.assertEqual(daemon._free_slot(), 1)
+        finally:
+            for sleeper in sleepers:
+                if sleeper.poll() is None:
+                    sleeper.kill()
+                    sleeper.wait()
+            Settings.root_tag = None
+            ReviewDirs.reset(self.startdir)
 
     def test_mock_configdir(self):
         ''' Test internal scanning of --configdir option. '''
@@ -460,6 +697,390 @@ class TestMisc(FR_TestCase):
         len2 = len(glob.glob(os.path.join(wdir, "*")))
         self.assertEqual(len2, len1)
 
+    def test_shell_settings(self):
+        ''' FR_SETTINGS in shell checks reflects current settings. '''
+        from plugins.shell_api import _settings_generator
+        Settings.prebuilt = True
+        try:
+            body = _settings_generator()
+        finally:
+            Settings.prebuilt = False
+        self.assertIn('FR_SETTINGS[prebuilt]="True"\n', body)
+        self.assertIn('FR_SETTINGS[name]=', body)
+        context = ReviewContext()
+        with context.activate():
+            Settings.name = 'python-test'
+            body = _settings_generator()
+        self.assertIn('FR_SETTINGS[name]="python-test"\n', body)
+
+    def test_mock_macro_cache(self):
+        ''' Cached macros are dropped when the chroot's macros change. '''
+        self._tmp_cache_home()
+        stamp = ['/etc/mock/test.cfg', 1000.0, 2000.0, 3000.0]
+        runs = []
+
+        def run_in_chroot(script, stderr=True):
+            ''' Pretend to run rpm --eval in mock. '''
+            runs.append(script)
+            return 0, '/usr/lib64\n'
+
+        Mock.get_config_stamp = lambda: list(stamp)
+        Mock._run_in_chroot = run_in_chroot
+        try:
+            self.assertEqual(Mock.eval_macros(['%_libdir']),
+                             {'%_libdir': '/usr/lib64'})
+            Mock.eval_macros(['%_libdir'])
+            self.assertEqual(len(runs), 1)
+            stamp[3] = 4000.0
+            Mock.eval_macros(['%_libdir'])
+            self.assertEqual(len(runs), 2)
+        finally:
+            del Mock.get_config_stamp
+            del Mock._run_in_chroot
+
+    def test_mock_shell_session(self):
+        ''' Test the shell session protocol using plain sh. '''
+        session = _ShellSession(['sh'])
+        self.assertTrue(session.start())
+        self.assertEqual(session.run('{ echo foo; printf bar\n} 2>&1'),
+                         (0, 'foo\nbar'))
+        self.assertEqual(session.run('false'), (1, ''))
+        self.assertEqual(session.run('exit 3'), None)
+        self.assertFalse(session.is_alive)
+        self.assertFalse(_ShellSession(['/no/such/shell']).start())
+
+    def test_urlretrieve_checksum(self):
+        ''' Test checksum computed while downloading. '''
+        tmpdir = tempfile.mkdtemp()
+        saved = getattr(Settings, 'checksum', None)
+        Settings.checksum = 'md5'
+        try:
+            src = os.path.join(tmpdir, 'src')
+            with open(src, 'w') as f:
+                f.write('upstream data')
+            dst = os.path.join(tmpdir, 'dst')
+            digest = HelpersMixin.urlretrieve('file://' + src, dst)
+            self.assertEqual(digest, 'df9c29ce5be040a11ba5b391f1e1fa41')
+            self.assertEqual(HelpersMixin._checksum(dst), digest)
+        finally:
+            Settings.checksum = saved
+            shutil.rmtree(tmpdir)
+
+    def test_source_cache(self):
+        ''' Test the shared, content-addressed source cache. '''
+        tmpdir = self._tmp_cache_home()
+        src = os.path.join(tmpdir, 'src.tar.gz')
+        with open(src, 'w') as f:
+            f.write('upstream data')
+        url = 'http://example.com/src.tar.gz'
+        SourceCache.put(url, src)
+        dst = os.path.join(tmpdir, 'dst.tar.gz')
+        self.assertTrue(SourceCache.get(url, dst))
+        with open(dst) as f:
+            self.assertEqual(f.read(), 'upstream data')
+        self.assertFalse(SourceCache.get(url + '.bad', dst))
+        digest = SourceCache.lookup(url=url)
+        # pylint: disable=W0212
+        with open(SourceCache._object_path(digest), 'w') as f:
+            f.write('tampered')
+        self.assertFalse(SourceCache.get(url, dst))
+
+    def test_check_manifest(self):
+        ''' Listing uses the manifest, disabled plugins aren't loaded. '''
+        self.init_test('test_misc',
+                       argv=['-n', 'python-test', '--prebuilt'])
+        self._tmp_cache_home()
+        try:
+            lister = ChecksLister()
+            manifest = CheckManifest()
+            self.assertEqual(sorted(manifest.get_checks().iterkeys()),
+                             sorted(lister.checkdict.iterkeys()))
+            self.assertEqual(manifest.flags['EPEL5'].doc,
+                             lister.flags['EPEL5'].doc)
+            self.assertEqual(sorted(manifest.get_plugins()),
+                             sorted(lister.get_plugins()))
+            Settings.plugins = {'Java': False}
+            lister = ChecksLister()
+            self.assertIsInstance(lister.groups['Java'], DisabledRegistry)
+            self.assertFalse(lister.groups['Java'].is_applicable())
+            self.assertNotIn('CheckJavaPlugin', lister.checkdict)
+        finally:
+            Settings.plugins = {}
+
+    def test_rpm_payload(self):
+        ''' Listing and extracting srpm members without rpm2cpio. '''
+        self.init_test('test_misc',
+                       argv=['-n', 'python-test', '--prebuilt'])
+        path = os.path.abspath('python-test-1.0-1.fc17.src.rpm')
+        payload = RpmPayload(path)
+        self.assertEqual(sorted(payload.list()),
+                         ['python-test-1.0.tar.gz', 'python-test.spec'])
+        tmpdir = tempfile.mkdtemp()
+        try:
+            done = payload.extract(tmpdir, ['python-test.spec'])
+            self.assertEqual(done, ['python-test.spec'])
+            self.assertEqual(os.listdir(tmpdir), ['python-test.spec'])
+            spec = open(os.path.join(tmpdir, 'python-test.spec')).read()
+            self.assertIn('Name:', spec)
+            topdir = os.path.join(tmpdir, 'rpms-unpacked')
+            unpack_rpms([path], topdir)
+            self.assertEqual(
+                sorted(os.listdir(os.path.join(topdir,
+                                               os.path.basename(path)))),
+                ['python-test-1.0.tar.gz', 'python-test.spec'])
+            bad_path = os.path.join(tmpdir, 'bad.rpm')
+            with open(bad_path, 'w') as f:
+                f.write('Not an rpm')
+            self.assertRaises(ReviewError, RpmPayload(bad_path).list)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_rpm_payload_symlink(self):
+        ''' Members are not written through symlinks out of destdir. '''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            outside = os.path.join(tmpdir, 'outside')
+            os.mkdir(outside)
+            path = os.path.join(tmpdir, 'evil.rpm')
+            _write_rpm(path, [('./a', 0120777, outside),
+                              ('./a/.bashrc', 0100644, 'rm -rf ~\n'),
+                              ('./b/c', 0100644, 'ok\n')])
+            destdir = os.path.join(tmpdir, 'dest')
+            done = RpmPayload(path).extract(destdir)
+            self.assertEqual(done, ['a', 'b/c'])
+            self.assertEqual(os.listdir(outside), [])
+            self.assertEqual(os.readlink(os.path.join(destdir, 'a')),
+                             outside)
+            with open(os.path.join(destdir, 'b', 'c')) as f:
+                self.assertEqual(f.read(), 'ok\n')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_result_cache(self):
+        ''' Check results are replayed while inputs are unchanged. '''
+        # pylint: disable=C0111,R0201
+
+        class SpecMockup(object):
+            filename = None
+
+        class ChecksMockup(object):
+            def __init__(self):
+                self.flags = {}
+                self.spec = SpecMockup()
+
+        class TestCheck(GenericCheck):
+            needs_data = ['spec']
+
+            def __init__(self, checks):
+                GenericCheck.__init__(self, checks, __file__)
+                self.runs = 0
+
+            def run(self):
+                self.runs += 1
+                self.set_passed(self.FAIL, 'Bad spec',
+                                [self.Attachment('Diff', 'some text')])
+
+        def run_check():
+            ResultCache.load()
+            check = TestCheck(checks)
+            ResultCache.run(check)
+            ResultCache.save()
+            return check
+
+        tmpdir = self._tmp_cache_home()
+        ReviewDirs.wdir = tmpdir
+        Settings.cache = True
+        Settings.configdir = tmpdir
+        config = os.path.join(tmpdir, 'default.cfg')
+        with open(config, 'w') as f:
+            f.write("config_opts['root'] = 'fedora-rawhide-x86_64'\n")
+        try:
+            checks = ChecksMockup()
+            checks.spec.filename = os.path.join(tmpdir, 'test.spec')
+            with open(checks.spec.filename, 'w') as f:
+                f.write('Name: test\n')
+            self.assertEqual(run_check().runs, 1)
+            check = run_check()
+            self.assertEqual(check.runs, 0)
+            self.assertTrue(check.is_failed)
+            self.assertEqual(check.result.output_extra, 'Bad spec')
+            self.assertEqual(check.attachments[0].text, 'some text')
+            with open(checks.spec.filename, 'w') as f:
+                f.write('Name: test2\n')
+            self.assertEqual(run_check().runs, 1)
+            os.utime(config, (1000, 1000))
+            self.assertEqual(run_check().runs, 1)
+            self.assertEqual(run_check().runs, 0)
+
+            old = os.path.join(os.path.dirname(ResultCache._path()),
+                               'old.json')
+            open(old, 'w').close()
+            os.utime(old, (1000, 1000))
+            run_check()
+            self.assertFalse(os.path.exists(old))
+            self.assertTrue(os.path.exists(ResultCache._path()))
+        finally:
+            Settings.cache = False
+            Settings.configdir = None
+            Mock.reset()
+            ReviewDirs.reset()
+
+    def test_delta(self):
+        ''' Compare a new revision with the previous one. '''
+        # pylint: disable=C0111,R0201
+
+        def write(path, text):
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(text)
+
+        class BugMockup(object):
+            def __init__(self, topdir):
+                self.spec_file = os.path.join(topdir, 'srpm', 'test.spec')
+                self.srpm_file = \
+                    os.path.join(topdir, 'srpm', 'test-1-2.src.rpm')
+                self.previous = \
+                    (os.path.join(topdir, 'previous/srpm/test.spec'),
+                     os.path.join(topdir, 'previous/srpm/test-1-1.src.rpm'))
+
+            def get_previous(self):
+                return self.previous
+
+        class CheckMockup(object):
+            def __init__(self, name, state):
+                self.name = name
+                self.state = state
+                self.is_run = True
+
+        class ChecksMockup(object):
+            def __init__(self, checks):
+                self.checkdict = dict([(c.name, c) for c in checks])
+
+        tmpdir = tempfile.mkdtemp()
+        ReviewDirs.wdir = tmpdir
+        try:
+            bug = BugMockup(tmpdir)
+            write(bug.previous[0], 'Release: 1\nLicense: MIT\n')
+            write(bug.previous[1], 'srpm 1')
+            write(bug.spec_file, 'Release: 2\nLicense: MIT\n')
+            write(bug.srpm_file, 'srpm 2')
+            write(os.path.join(tmpdir, 'previous/srpm-unpacked/a'), 'a')
+            write(os.path.join(tmpdir, 'previous/srpm-unpacked/b'), 'b')
+            write(os.path.join(tmpdir, 'srpm-unpacked/b'), 'b2')
+            write(os.path.join(tmpdir, 'srpm-unpacked/c'), 'c')
+            delta = Delta(bug)
+            self.assertTrue(delta.is_available)
+            self.assertTrue(delta.srpm_changed())
+            self.assertEqual(delta.srpm_changes(), (['c'], ['a'], ['b']))
+            diff = ''.join(delta.spec_diff())
+            self.assertIn('-Release: 1', diff)
+            self.assertIn('+Release: 2', diff)
+            self.assertNotIn('-License', diff)
+            checks = ChecksMockup([CheckMockup('CheckA', 'pass'),
+                                   CheckMockup('CheckB', None),
+                                   CheckMockup('CheckC', 'fail')])
+            previous = {'CheckA': 'pass', 'CheckB': 'fail', 'CheckD': 'na'}
+            self.assertEqual(Delta.state_changes(checks, previous),
+                             [('CheckB', 'fail', 'na'),
+                              ('CheckC', None, 'fail'),
+                              ('CheckD', 'na', None)])
+        finally:
+            ReviewDirs.reset()
+            shutil.rmtree(tmpdir)
+
+    def test_incremental_resultdir(self):
+        ''' A new revision is built in an emptied results dir. '''
+        from plugins.generic_build import CheckResultdir
+
+        def write(path, text):
+            with open(path, 'w') as f:
+                f.write(text)
+
+        class BugMockup(object):
+            spec_file = None
+            srpm_file = None
+
+            def get_previous(self):             # pylint: disable=R0201
+                return (os.path.join(ReviewDirs.previous, 'srpm/t.spec'),
+                        os.path.join(ReviewDirs.previous,
+                                     'srpm/t-1-1.src.rpm'))
+
+        tmpdir = tempfile.mkdtemp()
+        Settings.incremental = True
+        try:
+            ReviewDirs.reset(tmpdir)
+            ReviewDirs.workdir_setup('t-review')
+            write(os.path.join(ReviewDirs.srpm, 't.spec'), 'Release: 1\n')
+            write(os.path.join(ReviewDirs.srpm, 't-1-1.src.rpm'), 'srpm 1')
+            write(os.path.join(ReviewDirs.results, 't-1-1.noarch.rpm'), 'x')
+            write(os.path.join(ReviewDirs.results, 'build.log'), 'log')
+            ReviewDirs.reset(tmpdir)
+            ReviewDirs.workdir_setup('t-review')
+            bug = BugMockup()
+            bug.spec_file = os.path.join(ReviewDirs.srpm, 't.spec')
+            bug.srpm_file = os.path.join(ReviewDirs.srpm, 't-1-2.src.rpm')
+            write(bug.spec_file, 'Release: 2\n')
+            write(bug.srpm_file, 'srpm 2')
+            helper = ReviewHelper()
+            helper.bug = bug
+            helper._setup_delta()
+            self.assertFalse(Settings.nobuild)
+            self.assertEqual(os.listdir(ReviewDirs.results), [])
+            self.assertTrue(os.path.exists(
+                os.path.join(ReviewDirs.previous,
+                             'results', 't-1-1.noarch.rpm')))
+            check = CheckResultdir(None)
+            check.run()
+            self.assertTrue(check.is_na)
+        finally:
+            Settings.incremental = False
+            ReviewDirs.reset(self.startdir)
+            shutil.rmtree(tmpdir)
+
+    def test_batch(self):
+        ''' Parse a batch file, write json and xml summaries. '''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'jobs')
+            with open(path, 'w') as f:
+                f.write('# comment\n817271\n\n'
+                        'https://example.com/show_bug.cgi?id=2150\n'
+                        '  ../srpms/python-test-1.0-1.fc17.src.rpm\n'
+                        'python-test\n')
+            jobs = read_jobs(path)
+            self.assertEqual([j.kind for j in jobs],
+                             ['bug', 'url', 'name', 'name'])
+            self.assertEqual(jobs[2].arg,
+                             '../srpms/python-test-1.0-1.fc17.src.rpm')
+            self.assertEqual([j.dirname for j in jobs],
+                             ['001-817271', '002-show_bug.cgi_id_2150',
+                              '003-python-test-1.0-1.fc17',
+                              '004-python-test'])
+            summaries = [{'index': 1, 'kind': 'bug', 'arg': '817271',
+                          'rcode': 0, 'elapsed': 1.5,
+                          'review_dir': '/tmp/817271-test',
+                          'report': '/tmp/817271-test/review.txt',
+                          'counts': {'pass': 2, 'fail': 1,
+                                     'pending': 0, 'na': 0},
+                          'failed': ['CheckFoo']},
+                         {'index': 2, 'kind': 'name', 'arg': 'foo',
+                          'rcode': 2, 'elapsed': 0.1, 'review_dir': None,
+                          'report': None, 'counts': {}, 'failed': []}]
+            write_summary(summaries, os.path.join(tmpdir, 'summary.json'))
+            with open(os.path.join(tmpdir, 'summary.json')) as f:
+                self.assertEqual(json.load(f)['jobs'], summaries)
+            write_summary(summaries, os.path.join(tmpdir, 'summary.xml'))
+            root = ET.parse(os.path.join(tmpdir, 'summary.xml')).getroot()
+            xml_jobs = root.findall('jobs/job')
+            self.assertEqual([j.get('rcode') for j in xml_jobs], ['0', '2'])
+            self.assertEqual(xml_jobs[0].find('counts').get('fail'), '1')
+            self.assertEqual(xml_jobs[0].find('failed').get('test-id'),
+                             'CheckFoo')
+            self.assertEqual(xml_jobs[1].get('report'), None)
+        finally:
+            shutil.rmtree(tmpdir)
+
     @unittest.skipIf(FAST_TEST, 'slow test disabled by REVIEW_FAST_TEST')
     def test_mock_uniqueext(self):
         ''' Test --uniqueext option. '''
@@ -723,6 +1344,110 @@ class TestMisc(FR_TestCase):
         self.assertTrue(check.is_failed)
         expected = 'diff -r also reports differences'
         self.assertTrue(expected in check.result.attachments[0].text)
+        with open(os.path.join(ReviewDirs.root, 'diff.txt')) as f:
+            diff = f.read()
+        self.assertIn('Differs: python-test-1.0/setup.py', diff)
+        self.assertIn('+# Line added to make diff -r fail', diff)
+
+    def test_license_scan(self):
+        ''' Sharded, cached licensecheck gives licensecheck -r output. '''
+        self.init_test('test_misc',
+                       argv=['-n', 'python-test', '--prebuilt'])
+        tmpdir = self._tmp_cache_home()
+        srcdir = os.path.join(tmpdir, 'src')
+        os.makedirs(os.path.join(srcdir, 'sub'))
+        shutil.copy('python-test.spec', srcdir)
+        with open(os.path.join(srcdir, 'sub', 'gpl.c'), 'w') as f:
+            f.write('/* This program is free software; you can'
+                    ' redistribute it and/or modify it under the'
+                    ' terms of the GNU General Public License as'
+                    ' published by the Free Software Foundation;'
+                    ' either version 2 of the License, or (at your'
+                    ' option) any later version. */\n')
+        os.mkfifo(os.path.join(srcdir, 'sub', 'fifo.c'))
+        expected = sorted(check_output(['licensecheck', '-r', srcdir])
+                          .splitlines(True))
+        self.assertEqual(sorted(LicenseScanner(srcdir).scan()),
+                         expected)
+        self.assertTrue(os.path.exists(
+            os.path.join(tmpdir, 'cache', 'fedora-review', CACHE)))
+        self.assertEqual(sorted(LicenseScanner(srcdir).scan()),
+                         expected)
+
+    def test_license_detect(self):
+        ''' Built-in license detection, as licensecheck names them. '''
+        gpl = '''
+            # This program is free software; you can redistribute it
+            # and/or modify it under the terms of the GNU General Public
+            # License as published by the Free Software Foundation;
+            # either version 2 of the License, or (at your option) any
+            # later version.
+            '''
+        self.assertEqual(detect(gpl), 'GPL (v2 or later)')
+        self.assertEqual(detect('Licensed under the Apache License,'
+                                ' Version 2.0 (the "License");'),
+                         'Apache (v2.0)')
+        self.assertEqual(detect('Redistribution and use in source and'
+                                ' binary forms ... Neither the name of'),
+                         'BSD (3 clause)')
+        self.assertEqual(detect('int main() { return 0; }'), 'UNKNOWN')
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(tmpdir, 'gpl.c'), 'w') as f:
+                f.write('x' * 100000 + gpl)
+            with open(os.path.join(tmpdir, 'README'), 'w') as f:
+                f.write(gpl)
+            self.assertEqual(list(LicenseDetector(tmpdir).scan()),
+                             [os.path.join(tmpdir, 'gpl.c') +
+                              ': GPL (v2 or later)\n'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_tree_diff(self):
+        ''' Comparing trees using digests, writing capped diffs. '''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            old = os.path.join(tmpdir, 'old')
+            new = os.path.join(tmpdir, 'new')
+            for topdir in [old, new]:
+                os.makedirs(os.path.join(topdir, 'sub'))
+                with open(os.path.join(topdir, 'sub', 'same'), 'w') as f:
+                    f.write('same\n')
+            with open(os.path.join(old, 'gone'), 'w') as f:
+                f.write('gone\n')
+            with open(os.path.join(new, 'added'), 'w') as f:
+                f.write('added\n')
+            with open(os.path.join(old, 'sub', 'text'), 'w') as f:
+                f.write('a\nb\nc\n')
+            with open(os.path.join(new, 'sub', 'text'), 'w') as f:
+                f.write('a\nB\nc\n')
+            delta = compare_trees(old, new)
+            self.assertEqual(delta.added, ['added'])
+            self.assertEqual(delta.removed, ['gone'])
+            self.assertEqual(delta.changed, ['sub/text'])
+            out = StringIO.StringIO()
+            self.assertFalse(write_diffs([(delta, old, new)], out))
+            self.assertIn('-b\n+B\n', out.getvalue())
+            out = StringIO.StringIO()
+            self.assertTrue(write_diffs([(delta, old, new)], out, 10))
+            self.assertIn('[Diff truncated at 10 bytes]', out.getvalue())
+            self.assertFalse(compare_trees(old, old))
+            lines = ['line %d\n' % i for i in range(200000)]
+            with open(os.path.join(old, 'big'), 'w') as f:
+                f.writelines(lines)
+            lines[7] = 'LINE 7\n'
+            with open(os.path.join(new, 'big'), 'w') as f:
+                f.writelines(lines)
+            delta = compare_trees(old, new)
+            self.assertEqual(delta.changed, ['big', 'sub/text'])
+            out = StringIO.StringIO()
+            self.assertFalse(write_diffs([(delta, old, new)], out))
+            self.assertIn('-line 7\n+LINE 7\n', out.getvalue())
+            self.assertIn('-b\n+B\n', out.getvalue())
+            out = StringIO.StringIO()
+            self.assertTrue(write_diffs([(delta, old, new)], out, 10))
+        finally:
+            shutil.rmtree(tmpdir)
 
     def test_dirty_resultdir(self):
         ''' Test that non-empty resultdir quits. '''
@@ -823,6 +1548,41 @@ class TestMisc(FR_TestCase):
         self.assertEqual(len(l), 1)
         self.assertEqual(l['test1'], c1)
 
+    def test_parallel_runner(self):
+        ''' _ParallelRunner component test. '''
+        checks = _ChecksMockup()
+        checks.checkdict.extend([_RunnerCheck('a', []),
+                                 _RunnerCheck('b', ['a']),
+                                 _RunnerCheck('c', ['a']),
+                                 _RunnerCheck('d', ['b', 'c'])])
+        checks.checkdict['b'].parallel_safe = False
+        completed = _ParallelRunner(checks, 3).run()
+        self.assertEqual([c.name for c in completed][0], 'a')
+        self.assertEqual([c.name for c in completed][3], 'd')
+        self.assertEqual(set([c.name for c in completed]),
+                         set(['a', 'b', 'c', 'd']))
+        for check in checks.checkdict.itervalues():
+            self.assertTrue(check.is_run)
+
+    def test_needs_data(self):
+        ''' needs_data and scheduling of checks not needing the build. '''
+        self.assertEqual(needs_for_data(None), ['CheckBuildCompleted'])
+        self.assertEqual(needs_for_data(['spec', 'sources']), [])
+        self.assertEqual(needs_for_data(['rpms', 'spec']), ['CheckBuild'])
+        self.assertEqual(needs_for_data(['buildsrc', 'rpms']),
+                         ['CheckBuildCompleted'])
+        self.assertRaises(ValueError, needs_for_data, ['foo'])
+
+        started = []
+        checks = _ChecksMockup()
+        checks.checkdict.extend([_RunnerCheck('spec', [], started),
+                                 _RunnerCheck('build', [], started),
+                                 _RunnerCheck('rpmlint', ['build'], started),
+                                 _RunnerCheck('done', ['rpmlint'], started)])
+        completed = _ParallelRunner(checks, 1).run()
+        self.assertEqual(started, ['build', 'rpmlint', 'spec', 'done'])
+        self.assertEqual(len(completed), 4)
+
     def test_1_unversioned_so(self):
         ''' Handling unversioned-sofile, expected to fail. '''
         self.init_test('unversioned-so',